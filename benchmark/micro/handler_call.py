@@ -0,0 +1,129 @@
+"""
+Microbenchmark of the per-call overhead of invoking handlers.
+
+Calls handlers of a few common signatures the way the reconciler
+does, comparing the generic kwargs wrapper with all arguments
+computed per call (baseline) against the generated adapters that
+compute only the arguments a handler asks for.
+
+Usage: python handler_call.py [num_mounts]
+"""
+import sys
+import time
+
+from digi.on import adapter
+from digi.reconcile import safe_lookup, get_back_prop
+
+
+def _baseline(fn, kwarg_filter, path, typ):
+    # the generic wrapper and the per-handler arguments
+    # as built before the adapters
+    def wrapper_fn(subview, proc_view, view,
+                   old_view, mount, obs, back_prop,
+                   diff, meta):
+        kwargs = dict()
+        for _k, _v in [("subview", subview),
+                       ("proc_view", proc_view),
+                       ("view", view),
+                       ("old_view", old_view),
+                       ("mount", mount),
+                       ("obs", obs),
+                       ("back_prop", back_prop),
+                       ("diff", diff),
+                       ("meta", meta),
+                       ("typ", typ),
+                       ]:
+            if _k in kwarg_filter:
+                kwargs[kwarg_filter[_k]] = _v
+        fn(**kwargs)
+
+    def call(proc_spec, spec, old, diff):
+        wrapper_fn(
+            subview=safe_lookup(proc_spec, path),
+            proc_view=proc_spec,
+            view=spec, old_view=old,
+            mount=proc_spec.get("mount", {}),
+            obs=proc_spec.get("obs", {}),
+            back_prop=_get_back_prop(diff),
+            diff=diff,
+            meta=proc_spec.get("meta", {}),
+        )
+
+    return call
+
+
+def _get_back_prop(diff):
+    # uncached, as before
+    bp = list()
+    for op, path, old, new in diff:
+        if op != "change" and op != "add":
+            continue
+        if len(path) < 3 or path[0] != "spec" \
+                or path[1] != "mount":
+            continue
+        fs = set(path)
+        if "intent" not in fs and "input" not in fs:
+            continue
+        bp.append((op, path, old, new))
+    return bp
+
+
+def h_subview(sv):
+    _ = sv
+
+
+def h_mounts(sv, pv, mounts):
+    _, _, _ = sv, pv, mounts
+
+
+def h_back_prop(proc_view, back_prop):
+    _, _ = proc_view, back_prop
+
+
+handlers = [
+    ("subview", h_subview, {"subview": "sv"}),
+    ("mounts", h_mounts, {"subview": "sv", "proc_view": "pv", "mount": "mounts"}),
+    ("back_prop", h_back_prop, {"proc_view": "proc_view", "back_prop": "back_prop"}),
+]
+
+
+def make_model(num_mounts):
+    lamps = {
+        f"default/l{i}": {
+            "spec": {"control": {"power": {"intent": "on", "status": "on"}}},
+        } for i in range(num_mounts)
+    }
+    return {"control": {"power": {"intent": "on"}},
+            "mount": {"digi.dev/v1/lamps": lamps}}
+
+
+def make_diff(num_mounts):
+    return [("change", ("spec", "mount", "digi.dev/v1/lamps", f"default/l{i}",
+                        "spec", "control", "power", "intent"), "off", "on")
+            for i in range(num_mounts)]
+
+
+def bench(call, proc_spec, diff, rounds=20000):
+    start = time.perf_counter()
+    for i in range(rounds):
+        # a fresh diff object per reconcile every 10 calls
+        if i % 10 == 0:
+            diff = list(diff)
+        call(proc_spec, proc_spec, proc_spec, diff)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    num_mounts = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    proc_spec, diff = make_model(num_mounts), make_diff(num_mounts)
+    path = ("control", "power")
+    print(f"mounts={num_mounts}")
+    print(f"{'handler':<12}{'baseline(us)':>14}{'adapter(us)':>13}")
+    for name, fn, kwarg_filter in handlers:
+        t0 = bench(_baseline(fn, kwarg_filter, path, None), proc_spec, diff)
+        t1 = bench(adapter(fn, path), proc_spec, diff)
+        print(f"{name:<12}{t0:>14.3f}{t1:>13.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Microbenchmark of handler filtering in a reconcile loop.
+
+Runs the default ``changed`` condition of N handlers over the same
+diff on a parent with M mounted children, comparing the per-handler
+path expansion (baseline) against the shared changed-path index.
+
+Usage: python handler_filter.py [num_mounts]
+"""
+import sys
+import time
+
+from digi import filter as filter_
+
+
+def _baseline_changed(diff, path):
+    # per-handler expansion as done before the shared index
+    changed_paths = {(".",): True}
+    for op, path_, old, new in diff:
+        if old is None and len(path_) == 0:
+            changed_paths.update(_from_model(new))
+        else:
+            changed_paths.update({path_[1:_i + 1]: True for _i in range(len(path_))})
+    return path in changed_paths or len(diff) == 0
+
+
+def _from_model(d: dict):
+    result = dict()
+    to_visit = [[d.get("spec", {}), []]]
+    for n, prefix in to_visit:
+        result[tuple(prefix)] = True
+        if type(n) is not dict:
+            continue
+        for _k, _v in n.items():
+            to_visit.append([_v, prefix + [_k]])
+    return result
+
+
+def make_model(num_mounts):
+    lamps = {
+        f"default/l{i}": {
+            "spec": {"control": {"power": {"intent": "on", "status": "on"},
+                                 "brightness": {"intent": 0.5, "status": 0.5}}},
+            "generation": 1,
+        } for i in range(num_mounts)
+    }
+    return {"spec": {"control": {"mode": {"intent": "work"}},
+                     "mount": {"digi.dev/v1/lamps": lamps}}}
+
+
+def make_diffs(model, num_mounts):
+    update = [("change", ("spec", "mount", "digi.dev/v1/lamps", f"default/l{i}",
+                          "spec", "control", "power", "status"), "off", "on")
+              for i in range(0, num_mounts, max(1, num_mounts // 10))]
+    create = [("add", (), None, model)]
+    return {"update": update, "create": create}
+
+
+def bench(cond, diff, paths, rounds=20):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        # a fresh diff object per reconcile
+        diff = list(diff)
+        for p in paths:
+            cond(diff, p)
+    return (time.perf_counter() - start) / rounds * 1e3
+
+
+def main():
+    num_mounts = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    model = make_model(num_mounts)
+    print(f"mounts={num_mounts}")
+    print(f"{'diff':<8}{'handlers':>10}{'baseline(ms)':>15}{'index(ms)':>12}")
+    for name, diff in make_diffs(model, num_mounts).items():
+        for num_handlers in [1, 10, 50, 100, 200]:
+            paths = [("control",), ("mount", "digi.dev/v1/lamps"), ("meta",)] * num_handlers
+            paths = paths[:num_handlers]
+            t0 = bench(_baseline_changed, diff, paths)
+            t1 = bench(filter_.path_changed, diff, paths)
+            print(f"{name:<8}{num_handlers:>10}{t0:>15.3f}{t1:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Microbenchmark of the driver's import time.
+
+Measures, in a fresh interpreter each round, the wall time to import
+digi and to reach the modules a handler file and the driver's run()
+need, comparing eagerly importing every submodule and the kubernetes
+client (baseline, as digi did on import) against the lazy submodules.
+The cluster config is not loaded, so no cluster is needed.
+
+Usage: python import_time.py [rounds]
+"""
+import os
+import sys
+import subprocess
+import statistics
+
+cases = {
+    "eager": "import digi; [getattr(digi, m) for m in sorted(digi._modules)]; "
+             "digi.data.lake; import kubernetes",
+    "import digi": "import digi",
+    "handler": "import digi; digi.on",
+    "run": "import digi; digi.on; digi.run",
+}
+
+_timer = """
+import time
+start = time.perf_counter()
+{}
+print(time.perf_counter() - start)
+"""
+
+
+def bench(stmt, rounds):
+    times = list()
+    for _ in range(rounds):
+        out = subprocess.check_output([sys.executable, "-c", _timer.format(stmt)],
+                                      env=os.environ.copy())
+        times.append(float(out.decode().split()[-1]) * 1e3)
+    return statistics.median(times)
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"rounds={rounds}")
+    print(f"{'case':<14}{'median(ms)':>12}")
+    for name, stmt in cases.items():
+        print(f"{name:<14}{bench(stmt, rounds):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Microbenchmark of ZJSON decoding of query results.
+
+Decodes a stream of N telemetry records, comparing the per-value
+type walk with dateutil timestamps (baseline) against the decoder
+that compiles each type of the stream once.
+
+Usage: python zjson_decode.py [num_records]
+"""
+import sys
+import json
+import time
+import datetime
+
+import dateutil.parser
+
+from digi.data import zjson
+
+
+def _baseline_decode(raw):
+    # per-value type walk as done before the compiled decoder
+    types = {}
+    for msg in raw:
+        typ, value = msg['type'], msg['value']
+        if isinstance(typ, dict):
+            yield _baseline_decode_value(_baseline_decode_type(types, typ), value)
+
+
+def _baseline_decode_type(types, typ):
+    kind = typ['kind']
+    if kind == 'ref':
+        return types[typ['id']]
+    if kind == 'primitive':
+        return typ
+    elif kind == 'record':
+        for f in typ['fields'] or []:
+            f['type'] = _baseline_decode_type(types, f['type'])
+    elif kind in ['array', 'set']:
+        typ['type'] = _baseline_decode_type(types, typ['type'])
+    types[typ['id']] = typ
+    return typ
+
+
+def _baseline_decode_value(typ, value):
+    if value is None:
+        return None
+    kind = typ['kind']
+    if kind == 'primitive':
+        name = typ['name']
+        if name in ['uint8', 'uint16', 'uint32', 'uint64',
+                    'int8', 'int16', 'int32', 'int64']:
+            return int(value)
+        if name == 'time':
+            return dateutil.parser.isoparse(value)
+        if name in ['float16', 'float32', 'float64']:
+            return float(value)
+        if name == 'bool':
+            return value in {'T', 'true'}
+        if name == 'string':
+            return value
+        raise Exception(f'unknown primitive name {name}')
+    if kind == 'record':
+        return {f['name']: _baseline_decode_value(f['type'], v)
+                for f, v in zip(typ['fields'] or [], value)}
+    if kind == 'array':
+        return [_baseline_decode_value(typ['type'], v) for v in value]
+    raise Exception(f'unknown type kind {kind}')
+
+
+def make_stream(num_records):
+    now = datetime.datetime.utcnow()
+    batch = [{
+        "ts": now + datetime.timedelta(microseconds=i),
+        "name": f"l{i}",
+        "control": {"power": {"intent": "on", "status": "on"},
+                    "brightness": {"intent": 0.5, "status": 0.5}},
+        "obs": {"watt": i, "online": True, "tags": ["a", "b"]},
+    } for i in range(num_records)]
+    return list(zjson.encode(batch))
+
+
+def bench(decode, lines, rounds=5):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        # a fresh stream per query
+        for _ in decode(json.loads(_l) for _l in lines):
+            pass
+    return (time.perf_counter() - start) / rounds * 1e3
+
+
+def main():
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"{'records':<10}{'baseline(ms)':>14}{'compiled(ms)':>14}")
+    for n in [10, 100, 1000, num_records]:
+        lines = make_stream(n)
+        t0 = bench(_baseline_decode, lines)
+        t1 = bench(zjson.decode_raw, lines)
+        print(f"{n:<10}{t0:>14.3f}{t1:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
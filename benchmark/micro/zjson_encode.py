@@ -0,0 +1,104 @@
+"""
+Microbenchmark of ZJSON encoding of telemetry batches.
+
+Encodes batches of N identically shaped records (as produced by
+Sync and ZedPool.load), comparing the per-object type encoding
+(baseline) against the shape-caching encoder that emits ref types.
+
+Usage: python zjson_encode.py [batch_size]
+"""
+import sys
+import json
+import time
+import datetime
+
+import durationpy
+
+from digi.data import zjson
+
+_baseline_primitive_type = {
+    str(t): n for t, n in zjson._py_to_zed_primitive_type.items()
+}
+
+
+def _baseline_encode(objs):
+    # per-object encoding as done before the shape cache
+    ctr = [29]
+    for obj in objs:
+        yield json.dumps({
+            "type": _baseline_encode_type(ctr, obj),
+            "value": _baseline_encode_value(obj),
+        })
+
+
+def _baseline_encode_type(ctr, value):
+    if isinstance(value, dict):
+        typ = {
+            "kind": "record",
+            "fields": [
+                {"name": _f, "type": _baseline_encode_type(ctr, _v)}
+                for _f, _v in value.items()
+            ] if len(value) > 0 else None,
+        }
+    elif isinstance(value, list):
+        typ = {
+            "kind": "array",
+            "type": _baseline_encode_type(ctr, value[0] if len(value) > 0 else None),
+        }
+    else:
+        typ = str(type(value))
+        if typ not in _baseline_primitive_type:
+            raise Exception(f"unknown zed primitive type for {typ}")
+        return {"kind": "primitive", "name": _baseline_primitive_type[typ]}
+    ctr[0] += 1
+    typ["id"] = ctr[0]
+    return typ
+
+
+def _baseline_encode_value(value):
+    if isinstance(value, dict):
+        return [_baseline_encode_value(_v) for _, _v in value.items()]
+    elif isinstance(value, list):
+        return [_baseline_encode_value(_v) for _v in value]
+    elif isinstance(value, datetime.datetime):
+        return zjson.encode_datetime(value)
+    elif isinstance(value, datetime.timedelta):
+        return durationpy.to_str(value)
+    elif value is None:
+        return None
+    elif type(value) == bool:
+        return str(value).lower()
+    return str(value)
+
+
+def make_batch(batch_size):
+    now = datetime.datetime.utcnow()
+    return [{
+        "ts": now,
+        "name": f"l{i}",
+        "control": {"power": {"intent": "on", "status": "on"},
+                    "brightness": {"intent": 0.5, "status": 0.5}},
+        "obs": {"watt": i, "online": True, "tags": ["a", "b"]},
+    } for i in range(batch_size)]
+
+
+def bench(encode, batch, rounds=10):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        payload = "".join(encode(batch))
+    return (time.perf_counter() - start) / rounds * 1e3, len(payload)
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(f"{'batch':<8}{'baseline(ms)':>14}{'baseline(KB)':>14}"
+          f"{'shape(ms)':>12}{'shape(KB)':>12}")
+    for n in [1, 10, 100, batch_size]:
+        batch = make_batch(n)
+        t0, b0 = bench(_baseline_encode, batch)
+        t1, b1 = bench(zjson.encode, batch)
+        print(f"{n:<8}{t0:>14.3f}{b0 / 1e3:>14.1f}{t1:>12.3f}{b1 / 1e3:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
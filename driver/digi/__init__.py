@@ -1,5 +1,6 @@
 import os
 import logging
+import importlib
 
 # default logger
 logger = logging.getLogger(os.environ.get("LOGGER_NAME", __name__))
@@ -16,31 +17,54 @@ ns = namespace = os.environ.get("NAMESPACE", "default")
 duri = auri = (g, v, r, n, ns)
 
 lake_provider = os.environ.get("LAKE_PROVIDER", "zed")
+pool_write_behind = os.environ.get("POOL_WRITE_BEHIND", "") == "true"
+pool_batch_size = int(os.environ.get("POOL_BATCH_SIZE", 1000))
+pool_batch_age = float(os.environ.get("POOL_BATCH_AGE", 0.5))
+pool_buffer_size = int(os.environ.get("POOL_BUFFER_SIZE", 10000))
 load_trim_mount = os.environ.get("TRIM_MOUNT_ON_LOAD", "") != "false"
+model_snapshot_async = os.environ.get("MODEL_SNAPSHOT_ASYNC", "") != "false"
+model_snapshot_interval = float(os.environ.get("MODEL_SNAPSHOT_INTERVAL", 0))
+model_snapshot_delta = os.environ.get("MODEL_SNAPSHOT_DELTA", "") == "true"
+model_snapshot_keyframe = int(os.environ.get("MODEL_SNAPSHOT_KEYFRAME", 50))
 enable_mounter = os.environ.get("MOUNTER", "") == "true"
+enable_model_cache = os.environ.get("MODEL_CACHE", "") != "false"
+model_cache_ttl = float(os.environ.get("MODEL_CACHE_TTL", 30))
+handler_timeout = float(os.environ.get("HANDLER_TIMEOUT", -1))
+coalesce_window = float(os.environ.get("COALESCE_WINDOW", 0))
+coalesce_quiet = float(os.environ.get("COALESCE_QUIET", 0.05))
+enable_profile = os.environ.get("PROFILE", "") == "true"
+profile_port = int(os.environ.get("PROFILE_PORT", 9102))
+profile_obs_interval = float(os.environ.get("PROFILE_OBS_INTERVAL", -1))
 enable_visual = os.environ.get("VISUAL", "") == "true"
 visual_type = os.environ.get("VISUAL_TYPE", "")
 visual_refresh_interval = float(os.environ.get("VISUAL_REFRESH_INTERVAL", 1000))
 
-# digi modules; force init
-from digi import (
-    on,
-    util,
-    mount,
-    filter,
-    view,
-    data,
-    control,
-    dbox,
-    message,
-)
-from digi.main import run
-from digi.reconcile import rc
-model, pool, router = None, None, None
+model, pool, router, mounter = None, None, None, None
+
+# digi modules are imported on first access, e.g., digi.on,
+# so that importing digi does not import kopf, kubernetes or
+# the lake clients until they are needed
+_modules = {
+    "on", "util", "mount", "filter", "view", "data", "control",
+    "dbox", "message", "digilite", "profile", "reconcile", "main",
+}
+
+
+def __getattr__(name):
+    if name in _modules:
+        return importlib.import_module(f"digi.{name}")
+    if name == "run":
+        from digi.main import run
+        return run
+    if name == "rc":
+        from digi.reconcile import rc
+        return rc
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
 
 __all__ = [
     "on", "util", "view", "filter",
     "run", "logger", "mount", "rc",
-    "model", "pool", "router", "dbox",
-    "data", "control", "message", "digilite"
+    "model", "pool", "router", "mounter", "dbox",
+    "data", "control", "message", "digilite", "profile"
 ]
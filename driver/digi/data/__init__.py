@@ -1,5 +1,7 @@
 import os
 import logging
+import importlib
+import threading
 
 """
 The digi.data module provides a set of functions to load and query 
@@ -14,13 +16,31 @@ elif "ZED_LAKE" in os.environ:
 else:
     lake_url = "http://localhost:9867"
 
-from digi.data.pool import create_pool
-from digi.data.router import create_router
-from digi.data.zed import Client
-from digi.data.sync import Sync, Watch
+_lake_lock = threading.Lock()
+
+# the submodules, and the lake client, are loaded on first use
+_attrs = {
+    "create_pool": "digi.data.pool",
+    "create_router": "digi.data.router",
+    "Client": "digi.data.zed",
+    "Sync": "digi.data.sync",
+    "Watch": "digi.data.sync",
+}
+
+
+def __getattr__(name):
+    global lake
+    if name in _attrs:
+        return getattr(importlib.import_module(_attrs[name]), name)
+    if name == "lake":
+        # singleton used by the digi driver; router creates its own client(s)
+        with _lake_lock:
+            if "lake" not in globals():
+                from digi.data.zed import Client
+                lake = Client()
+        return lake
+    raise AttributeError(f"module {__name__} has no attribute {name}")
 
-# singleton used by the digi driver; router creates its own client(s)
-lake = Client()
 
 __all__ = [
     "Sync", "Watch",
@@ -1,10 +1,17 @@
 import sys
 import json
+import time
+import atexit
 import threading
 from abc import ABC, abstractmethod
-from typing import List, Callable
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Callable, Optional
 
 import digi
+from digi.util import merge_patch, apply_merge_patch
+from digi.view import CleanView
+from digi.profile import profiler
 from digi.data import logger, zjson
 from digi.data import sync
 from digi.data import router
@@ -27,14 +34,47 @@ class Pool(ABC):
 
 
 class ZedPool(Pool):
-    def __init__(self, name):
+    def __init__(self, name, *,
+                 write_behind: bool = False,
+                 batch_size: int = 1000,
+                 batch_age: float = 0.5,
+                 buffer_size: int = 10000,
+                 snapshot_async: bool = True,
+                 snapshot_interval: float = 0,
+                 snapshot_delta: bool = False,
+                 snapshot_keyframe: int = 50):
         super().__init__(name)
         self.client = digi.data.lake
 
+        # if write-behind is enabled, loads are buffered and
+        # committed in batches by a background writer
+        self._writer = None
+        if write_behind:
+            self._writer = WriteBehind(self._load,
+                                       batch_size=batch_size,
+                                       batch_age=batch_age,
+                                       buffer_size=buffer_size)
+            self._writer.start()
+            atexit.register(self.close)
+
+        # model snapshots to the model branch
+        self._snapshot = ModelSnapshot(self,
+                                       min_interval=snapshot_interval,
+                                       delta=snapshot_delta,
+                                       keyframe=snapshot_keyframe,
+                                       trim_mount=digi.load_trim_mount)
+        if snapshot_async:
+            self._snapshot.start()
+
     def load(self, objects: List[dict], *,
              branch="main",
              encoding="zjson",
-             same_type=False):
+             same_type=False,
+             buffered: bool = None):
+        """Load objects to the pool. With write-behind enabled the objects
+        are buffered and committed asynchronously unless buffered is
+        set to False; the call blocks while the buffer is full. An
+        unbuffered load raises if the objects are not committed."""
         # update event and processing time
         now = util.now()
         if encoding == "zjson":
@@ -44,31 +84,90 @@ class ZedPool(Pool):
                 if "event_ts" not in o:
                     o["event_ts"] = o.get("ts", now)
                 o["ts"] = now
-            data = "".join(zjson.encode(objects))
         elif encoding == "json":
             zjson_now = zjson.encode_datetime(now)  # as str
             for o in objects:
                 if "event_ts" not in o:
                     o["event_ts"] = o.get("ts", zjson_now)
                 o["ts"] = zjson_now
-            data = "\n".join(json.dumps(o) for o in objects)
         else:
             raise NotImplementedError
 
-        self.lock.acquire()
+        if buffered is None:
+            buffered = self._writer is not None
+        if buffered and self._writer is not None:
+            self._writer.put((branch, encoding), objects)
+        else:
+            self._load(objects, branch, encoding)
+
+    def _load(self, objects: List[dict], branch: str, encoding: str):
+        now = util.now()
         try:
-            # TBD better source name
-            meta = json.dumps({f"{digi.name}": zjson.encode_datetime(now)})
-            self.client.load(self.name, data,
-                             branch_name=branch,
-                             commit_author=digi.name,
-                             meta=meta)
-            # TBD load from digi also commits source ts in meta
+            if encoding == "zjson":
+                data = "".join(zjson.encode(objects))
+            else:
+                data = "\n".join(json.dumps(o) for o in objects)
+
+            with self.lock:
+                # TBD better source name
+                meta = json.dumps({f"{digi.name}": zjson.encode_datetime(now)})
+                self.client.load(self.name, data,
+                                 branch_name=branch,
+                                 commit_author=digi.name,
+                                 meta=meta)
+                # TBD load from digi also commits source ts in meta
         except Exception as e:
-            logger.warning(f"unable to load "
-                           f"{data} to {self.name}: {e}")
-        finally:
-            self.lock.release()
+            logger.warning(f"unable to load {len(objects)} objects "
+                           f"to {self.name}@{branch}: {e}")
+            raise
+
+    def load_model(self, spec: dict, gen: int = None):
+        """Load a snapshot of the model to the model branch. Once
+        started, the snapshots are loaded in the background and the
+        spec must not be modified after the call."""
+        if self._snapshot.is_alive():
+            self._snapshot.submit(spec, gen)
+        else:
+            self._snapshot.load(spec, gen)
+
+    def model_at(self, gen: int = None, ts: datetime = None) -> Optional[dict]:
+        """Reconstruct the model as of the given generation or time,
+        or the latest model if neither is given, from the nearest full
+        snapshot at or before it and the deltas that follow. Requires
+        the snapshots to be loaded in delta mode."""
+        if gen is not None:
+            bound = f"__gen <= {gen}"
+        elif ts is not None:
+            bound = f"ts <= {zjson.encode_datetime(ts)}"
+        else:
+            bound = "true"
+
+        base = list(self.query_branch(
+            "model", f"__snapshot == 'full' and {bound} | sort -r __gen | head 1"))
+        if len(base) == 0:
+            return None
+        base_gen = base[0]["__gen"]
+        model = _strip_snapshot(base[0])
+        for delta in self.query_branch(
+                "model", f"__snapshot == 'delta' and __gen > {base_gen} "
+                         f"and {bound} | sort __gen"):
+            apply_merge_patch(model, _strip_snapshot(delta))
+        return model
+
+    def query_branch(self, branch: str, query: str):
+        if query != "":
+            query = f"| {query}"
+        return self.client.query(f"from {self.name}@{branch} {query}")
+
+    def flush(self):
+        """Wait until the buffered objects are loaded."""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        """Load the buffered objects and stop the writer."""
+        if self._writer is not None:
+            self._writer.stop()
 
     def query(self, query: str):
         if query != "":
@@ -81,21 +180,231 @@ class ZedPool(Pool):
               *,
               in_flow: str = "",
               eoio: bool = True,
+              checkpoint: str = None,
               ):
         """Watch changes of the main pool and run UDF."""
         source = f"{self.name}@{branch}"
+        if checkpoint is None:
+            checkpoint = sync.checkpoint_path(
+                f"{self.name}-watch-{fn.__name__}")
         return sync.Watch(fn,
                           sources=[source],
                           eoio=eoio,
-                          in_flow=in_flow)
+                          in_flow=in_flow,
+                          checkpoint=checkpoint)
 
     def create_branch_if_not_exist(self, branch: str):
         if not self.client.branch_exist(self.name, branch):
             self.client.create_branch(self.name, branch)
-            self.load([router.Egress.INIT], branch=branch)
+            self.load([router.Egress.INIT], branch=branch, buffered=False)
             logger.info(f"load {router.Egress.INIT} to {self.name}@{branch}")
 
 
+class WriteBehind(threading.Thread):
+    """Buffers objects keyed by (branch, encoding) and loads them in
+    batches once a batch is full or its oldest object reaches the max
+    age. Producers block while the buffer is full, i.e., when the lake
+    lags behind, so ingest is bounded by the lake's load throughput."""
+
+    def __init__(self, load_fn: Callable, *,
+                 batch_size: int = 1000,
+                 batch_age: float = 0.5,
+                 buffer_size: int = 10000):
+        threading.Thread.__init__(self, daemon=True)
+        self.load_fn = load_fn
+        self.batch_size = batch_size
+        self.batch_age = batch_age
+        self.buffer_size = max(buffer_size, batch_size)
+        self.failed = 0
+
+        self._buffer = defaultdict(list)
+        self._count = 0
+        self._oldest = None
+        self._loading = False
+        self._flushing = False
+        self._cv = threading.Condition()
+        self._stop_flag = threading.Event()
+
+    def put(self, key: tuple, objects: List[dict]):
+        with self._cv:
+            # backpressure
+            while self._count > 0 and \
+                    self._count + len(objects) > self.buffer_size and \
+                    not self._stop_flag.is_set():
+                self._cv.wait()
+            if not self._stop_flag.is_set():
+                self._buffer[key].extend(objects)
+                self._count += len(objects)
+                # wake up the writer to track the age of a new
+                # batch or to load a full one
+                if self._oldest is None or self._count >= self.batch_size:
+                    self._oldest = self._oldest or time.time()
+                    self._cv.notify_all()
+                return
+        # the writer is stopped or draining; load in the caller
+        self.load_fn(objects, *key)
+
+    def run(self):
+        while True:
+            with self._cv:
+                while not self._ready():
+                    self._cv.wait(self._wait_time())
+                if self._count == 0:
+                    # stopped and drained
+                    return
+                batches, self._buffer = self._buffer, defaultdict(list)
+                self._count, self._oldest = 0, None
+                self._loading = True
+                self._cv.notify_all()
+
+            for (branch, encoding), objects in batches.items():
+                for i in range(0, len(objects), self.batch_size):
+                    batch = objects[i:i + self.batch_size]
+                    # a failed batch must not stop the writer, or
+                    # producers and flush() would block forever
+                    try:
+                        self.load_fn(batch, branch, encoding)
+                    except Exception as e:
+                        self.failed += len(batch)
+                        logger.warning(f"unable to load {len(batch)} objects "
+                                       f"to {branch}: {e}")
+
+            with self._cv:
+                self._loading = False
+                self._cv.notify_all()
+
+    def _ready(self) -> bool:
+        if self._count == 0:
+            return self._stop_flag.is_set()
+        if self._stop_flag.is_set() or self._flushing:
+            return True
+        return self._count >= self.batch_size or \
+               time.time() - self._oldest >= self.batch_age
+
+    def _wait_time(self):
+        if self._count == 0:
+            return None
+        return max(0, self.batch_age - (time.time() - self._oldest))
+
+    def flush(self):
+        with self._cv:
+            self._flushing = True
+            self._cv.notify_all()
+            while self._count > 0 or self._loading:
+                self._cv.wait()
+            self._flushing = False
+
+    def stop(self):
+        if self._stop_flag.is_set():
+            return
+        with self._cv:
+            self._stop_flag.set()
+            self._cv.notify_all()
+        self.join()
+
+
+class ModelSnapshot(threading.Thread):
+    """Loads snapshots of the model to the model branch off the
+    reconcile path. Generations submitted while a snapshot is loading
+    or within min_interval of the last one are coalesced into the
+    latest. With delta, a snapshot carries only the attributes changed
+    since the previous one, with removed attributes set to None, and
+    every keyframe-th snapshot is a full one; each snapshot is then
+    tagged with __snapshot (full or delta) and the model's __gen."""
+
+    def __init__(self, pool: Pool, *,
+                 min_interval: float = 0,
+                 delta: bool = False,
+                 keyframe: int = 50,
+                 trim_mount: bool = True):
+        threading.Thread.__init__(self, daemon=True)
+        self.pool = pool
+        self.min_interval = min_interval
+        self.delta = delta
+        self.keyframe = keyframe
+        self.trim_mount = trim_mount
+        self.submitted, self.loaded = 0, 0
+        self._since_full = 0
+
+        self._pending = None
+        self._last, self._last_at = None, 0
+        self._cv = threading.Condition()
+
+    def submit(self, spec: dict, gen: int = None):
+        with self._cv:
+            self._pending = (spec, gen)
+            self.submitted += 1
+            self._cv.notify()
+
+    def run(self):
+        while True:
+            with self._cv:
+                while self._pending is None:
+                    self._cv.wait()
+                wait = self._last_at + self.min_interval - time.time()
+                if wait > 0:
+                    # newer generations may arrive meanwhile
+                    self._cv.wait(wait)
+                    continue
+                (spec, gen), self._pending = self._pending, None
+            self.load(spec, gen)
+
+    def load(self, spec: dict, gen: int = None):
+        self._last_at = time.time()
+        model = CleanView(dict(spec), trim_mount=self.trim_mount).m()
+        full = not self.delta or self._last is None or \
+            (self.keyframe > 0 and self._since_full + 1 >= self.keyframe)
+        if not self.delta:
+            record = dict(model)
+        elif full:
+            record = _tag_snapshot(dict(model), "full", gen)
+        else:
+            record = merge_patch(self._last, model)
+            if len(record) == 0:
+                return
+            record = _tag_snapshot(record, "delta", gen)
+
+        try:
+            # load() adds the ts to the record it is given; the
+            # snapshot is committed, not buffered, once it returns
+            with profiler.stage("snapshot_load"):
+                self.pool.load([record], branch="model", buffered=False)
+        except Exception as e:
+            # the next snapshot is a full one, since the lake may
+            # not hold the base of a delta
+            self._last = None
+            logger.warning(f"unable to load to pool: {e}")
+            return
+        self._last = model
+        self._since_full = 0 if full else self._since_full + 1
+        self.loaded += 1
+        logger.info(f"done loading model snapshot to pool")
+
+
+# fields set by Pool.load(); a delta snapshot keeps the
+# model's own ones aside as __ts and __event_ts
+_stamped = ["ts", "event_ts"]
+
+
+def _tag_snapshot(record: dict, kind: str, gen: int = None) -> dict:
+    for k in _stamped:
+        if k in record:
+            record[f"__{k}"] = record.pop(k)
+    record["__snapshot"] = kind
+    if gen is not None:
+        record["__gen"] = gen
+    return record
+
+
+def _strip_snapshot(record: dict) -> dict:
+    for k in ["__snapshot", "__gen"] + _stamped:
+        record.pop(k, None)
+    for k in _stamped:
+        if f"__{k}" in record:
+            record[k] = record.pop(f"__{k}")
+    return record
+
+
 def pool_name(g, v, r, n, ns):
     _, _, _ = g, v, r
     if ns == "default":
@@ -124,5 +433,13 @@ def create_pool():
         sys.exit(1)
 
     return providers[digi.lake_provider](
-        pool_name(*digi.duri)
+        pool_name(*digi.duri),
+        write_behind=digi.pool_write_behind,
+        batch_size=digi.pool_batch_size,
+        batch_age=digi.pool_batch_age,
+        buffer_size=digi.pool_buffer_size,
+        snapshot_async=digi.model_snapshot_async,
+        snapshot_interval=digi.model_snapshot_interval,
+        snapshot_delta=digi.model_snapshot_delta,
+        snapshot_keyframe=digi.model_snapshot_keyframe,
     )
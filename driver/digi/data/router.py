@@ -8,9 +8,7 @@ from digi.data import flow as flow_lib
 
 import yaml
 from kubernetes.client.rest import ApiException
-from kubernetes import config, client
-
-config.load_incluster_config()
+from kubernetes import client
 
 
 """
@@ -32,6 +30,7 @@ def create_custom_api_object(name, src, dst, in_flow, out_flow, interval, eoio,
     :param eoio: end of interval offset in seconds
     :param action: create or delete
     '''
+    digi.util.api()  # loads the cluster config
     with client.ApiClient() as api_client:
         # Create an instance of the API class
         api_instance = client.CustomObjectsApi(api_client)
@@ -64,22 +63,111 @@ class Router:
         self.egress = Egress()
 
 
-class Ingress:
+class Pipelets:
+    """Syncs of the ingresses or egresses of a digi.
+
+    Reconfiguration is incremental: the resolved spec of each pipelet
+    is compared with the running one, and only pipelets that were
+    added, removed or changed are started, stopped or re-pointed.
+    A re-pointed sync carries over the source ts of the one it
+    replaces instead of recovering them from the lake, unless the
+    replaced sync has exited, e.g., on a failed load.
+    """
+    kind = "pipelet"
+
     def __init__(self):
         self._syncs = dict()
+        self._specs = dict()
 
     def start(self):
-        for name, _sync in self._syncs.items():
+        for name, _sync in list(self._syncs.items()):
+            if _sync.is_alive():
+                continue  # running
+            if _sync.ident is not None:
+                # the sync thread died; a thread can't be restarted,
+                # so replace it and recover its source ts from the
+                # checkpoint or the lake
+                logger.warning(f"{self.kind} sync {name} exited; restarting")
+                _sync = self._make_sync(name, self._specs[name])
+                self._syncs[name] = _sync
             _sync.start()
-            logger.info(f"started ingress sync {name} "
+            logger.info(f"started {self.kind} sync {name} "
                         f"with query: {_sync.query_str}")
 
     def stop(self):
         for _, _sync in self._syncs.items():
             _sync.stop()
+        self._syncs, self._specs = dict(), dict()
 
     def update(self, config: dict):
-        self._syncs = dict()
+        specs = self.resolve(config)
+
+        for name in set(self._syncs) - set(specs):
+            self._syncs.pop(name).stop()
+            self._specs.pop(name)
+            logger.info(f"stopped {self.kind} sync {name}")
+
+        for name, spec in specs.items():
+            old = self._syncs.get(name)
+            if old is not None:
+                if self._specs[name] == spec:
+                    continue
+                exited = _exited(old)
+                old.stop()
+                if exited:
+                    old = None
+            self._syncs[name] = self._make_sync(name, spec, old)
+            self._specs[name] = spec
+
+    def restart(self, config: dict):
+        self.update(config=config)
+        self.start()
+
+    def resolve(self, config: dict) -> dict:
+        """Return the specs, i.e., sync kwargs, of the pipelets."""
+        raise NotImplementedError
+
+    def _make_sync(self, name, spec: dict, old: sync.Sync = None) -> sync.Sync:
+        spec = dict(spec)
+        skip_history = spec.pop("skip_history", False)
+        checkpoint = sync.checkpoint_path(f"{digi.name}-{self.kind}-{name}")
+        if old is None:
+            return sync.Sync(
+                **spec,
+                client=zed.Client(),
+                owner=digi.name,
+                min_ts=util.now() if skip_history else util.min_time(),
+                checkpoint=checkpoint,
+            )
+
+        # re-point the sync; sources new to it skip their
+        # history if asked to, while the others resume
+        source_ts = dict(old.source_ts)
+        for s in spec["sources"]:
+            if skip_history and s not in source_ts:
+                source_ts[s] = util.now()
+        pools = set(s.split("@")[0] for s in spec["sources"])
+        return sync.Sync(
+            **spec,
+            client=old.client,
+            owner=digi.name,
+            min_ts=old.min_ts,
+            checkpoint=checkpoint,
+            source_ts=source_ts,
+            source_pool_ids=old.source_pool_ids
+            if pools <= set(old.source_pool_ids.values()) else None,
+        )
+
+
+def _exited(_sync: sync.Sync) -> bool:
+    return _sync.ident is not None and not _sync.is_alive()
+
+
+class Ingress(Pipelets):
+    kind = "ingress"
+
+    def resolve(self, config: dict) -> dict:
+        specs = dict()
 
         for name, ig in config.items():
             if ig.get("pause", False):
@@ -95,6 +183,7 @@ class Ingress:
             # concat and dedup sources
             for s in source_quantifiers:
                 sources += sourcer.resolve(s, use_sourcer)
+            sources = sorted(set(sources))
 
             logger.info(f"router: resolved {source_quantifiers} to {sources} "
                         f"for ingress {name}")
@@ -113,9 +202,6 @@ class Ingress:
                 _out_flow = f"{flow_agg} | {flow_lib.refresh_ts}"
 
             # TBD add support for external pipelet
-            # TBD disambiguate sync updates at fine-grained level
-            # so that skip_history won't skip upon the config changes
-            # or mount changes that don't affect this sync
             # TBD cleanup created pipelets
 
             if pipelet_offload:
@@ -131,46 +217,28 @@ class Ingress:
                     action="create"
                 )
             else:
-                # TBD disambiguate sync updates at fine-grained level
-                # so that skip_history won't skip upon the config changes
-                # or mount changes that don't affect this sync
-                _sync = sync.Sync(
-                    sources=sources,
-                    in_flow=flow,
-                    out_flow=_out_flow,
-                    dest=digi.pool.name,
-                    eoio=ig.get("eoio", True),
-                    patch_source=ig.get("patch_source", False),
-                    client=zed.Client(),
-                    owner=digi.name,
-                    min_ts=util.now() if ig.get("skip_history", False) else util.min_time()
-                )
-                self._syncs[name] = _sync
-
-    def restart(self, config: dict):
-        self.stop()
-        self.update(config=config)
-        self.start()
-
-
-class Egress:
+                specs[name] = {
+                    "sources": sources,
+                    "in_flow": flow,
+                    "out_flow": _out_flow,
+                    "dest": digi.pool.name,
+                    "eoio": ig.get("eoio", True),
+                    "patch_source": ig.get("patch_source", False),
+                    "chunk_size": ig.get("chunk_size", sync.default_chunk_size),
+                    # flow_agg aggregates across sources in one query
+                    "fan_in": ig.get("fan_in", sync.default_fan_in)
+                    if flow_agg == "" else 0,
+                    "skip_history": ig.get("skip_history", False),
+                }
+        return specs
+
+
+class Egress(Pipelets):
+    kind = "egress"
     INIT = {"__meta": "init"}
 
-    def __init__(self):
-        self._syncs = dict()
-
-    def start(self):
-        for name, _sync in self._syncs.items():
-            _sync.start()
-            logger.info(f"started egress sync {name} "
-                        f"with query:\n{_sync.query_str}")
-
-    def stop(self):
-        for _, _sync in self._syncs.items():
-            _sync.stop()
-
-    def update(self, config: dict):
-        self._syncs = dict()
+    def resolve(self, config: dict) -> dict:
+        specs = dict()
 
         for name, eg in config.items():
             digi.pool.create_branch_if_not_exist(name)
@@ -204,21 +272,15 @@ class Egress:
                 )
             else:
                 # TBD support external sources including external lakes
-                _sync = sync.Sync(
-                    sources=[digi.pool.name],
-                    in_flow=flow,
-                    out_flow=out_flow,
-                    dest=f"{digi.pool.name}@{name}",
-                    eoio=eg.get("eoio", True),
-                    client=zed.Client(),
-                    owner=digi.name,
-                )
-                self._syncs[name] = _sync
-
-    def restart(self, config: dict):
-        self.stop()
-        self.update(config=config)
-        self.start()
+                specs[name] = {
+                    "sources": [digi.pool.name],
+                    "in_flow": flow,
+                    "out_flow": out_flow,
+                    "dest": f"{digi.pool.name}@{name}",
+                    "eoio": eg.get("eoio", True),
+                    "chunk_size": eg.get("chunk_size", sync.default_chunk_size),
+                }
+        return specs
 
 
 @digi.on.mount
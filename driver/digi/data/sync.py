@@ -6,17 +6,26 @@ import typing
 import requests
 import json
 import yaml
+import heapq
+import queue
+import itertools
 from collections import defaultdict
 
-from . import zed, zjson
+from . import logger, zed, zjson
 
 default_lake_url = os.environ.get("ZED_LAKE", "http://localhost:9867")
+# max records read per source and load; <=0: unbounded
+default_chunk_size = int(os.environ.get("SYNC_CHUNK_SIZE", -1))
+# max sources read concurrently by a sync; <=0: read in one query
+default_fan_in = int(os.environ.get("SYNC_FAN_IN", 0))
+# max records buffered per source being read concurrently
+fan_in_buffer = int(os.environ.get("SYNC_FAN_IN_BUFFER", 1000))
+# directory of the source ts checkpoints; unset: no checkpoints
+checkpoint_dir = os.environ.get("SYNC_CHECKPOINT_DIR", None)
 
 
 class Sync(threading.Thread):
     """Many-to-one sync between data pools on Zed lake."""
-    SOURCE_COMMIT = 1
-    SKIP = 2
 
     def __init__(self,
                  sources: typing.List[str],
@@ -31,6 +40,11 @@ class Sync(threading.Thread):
                  lake_url: str = default_lake_url,
                  client: zed.Client = None,
                  min_ts: datetime = datetime.min.replace(tzinfo=timezone.utc),
+                 chunk_size: int = default_chunk_size,
+                 fan_in: int = default_fan_in,
+                 checkpoint: str = None,  # checkpoint file path
+                 source_ts: dict = None,  # skip fetching if given
+                 source_pool_ids: dict = None,
                  ):
         assert len(sources) > 0 and dest != ""
         self.sources = self._normalize(sources)
@@ -44,9 +58,26 @@ class Sync(threading.Thread):
         # process only those records that contain
         # a 'ts' field; XXX assume pool key is ts
         self.eoio = eoio
+        # if chunk_size > 0 (and eoio), the history of the
+        # sources is backfilled in ts ranges of at most
+        # chunk_size records per source, each streamed into
+        # its own load that advances the source ts
+        self.chunk_size = chunk_size
+        # if fan_in > 0 (and eoio), the sources are read in
+        # per-source queries, fan_in at a time, and merged by ts;
+        # the out_flow then applies per source and must not
+        # aggregate across sources
+        self.fan_in = fan_in
+        # {source: {lag, read}} of the last sync in sec, where lag
+        # is from the source's max ts to its records committed
+        self.source_lag = dict()
         self.client = zed.Client(base_url=lake_url) if client is None else client
-        self.source_ts = self._fetch_source_ts()  # track {source: max(ts)}
-        self.source_pool_ids = self._fetch_source_pool_ids()
+        self.checkpoint = Checkpoint(checkpoint) if checkpoint else None
+        # track {source: max(ts)}
+        self.source_ts = self._fetch_source_ts() \
+            if source_ts is None else source_ts
+        self.source_pool_ids = self._fetch_source_pool_ids() \
+            if source_pool_ids is None else source_pool_ids
         self.min_ts = min_ts  # min ts to sync
         self.source_set = set(self.sources)
         self.query_str = self._make_query()
@@ -54,6 +85,7 @@ class Sync(threading.Thread):
         threading.Thread.__init__(self)
         self._stop_flag = threading.Event()
         self._stop_flag.set()
+        self._commit = threading.Event()
 
     def run(self):
         self._stop_flag.clear()
@@ -69,15 +101,29 @@ class Sync(threading.Thread):
             return
 
         self._stop_flag.set()
+        self._commit.set()
         self.join()
 
     def once(self):
-        records = self.read()
+        if self.eoio and (self.chunk_size > 0 or self.fan_in > 0):
+            return self._sync_ranges()
+
+        records, source_ts = self._read()
         if len(records) != 0:
-            self.load(records)
+            self.load(records, {**self.source_ts, **source_ts})
+        # advanced only once the load commits, so that a failed
+        # load is retried from the same source ts
+        self.source_ts.update(source_ts)
 
     def read(self) -> list:
-        records = list()
+        records, source_ts = self._read()
+        self.source_ts.update(source_ts)
+        return records
+
+    def _read(self) -> tuple:
+        """Return the records and the source ts they advance to,
+        leaving the source ts of the sync as is."""
+        records, source_ts = list(), dict()
         if self.eoio:
             self.query_str = self._make_query()
         for r in self.client.query(self.query_str):
@@ -88,70 +134,208 @@ class Sync(threading.Thread):
             if self.eoio:
                 if max_ts is None:
                     raise Exception(f"no ts found in records from {source}")
-                if source not in self.source_ts:
-                    self.source_ts[source] = max_ts
-                else:
-                    self.source_ts[source] = max(max_ts, self.source_ts[source])
+                cur_ts = source_ts.get(source, self.source_ts.get(source))
+                source_ts[source] = max_ts if cur_ts is None else max(max_ts, cur_ts)
             else:
-                self.source_ts[source] = self.min_ts
-        return records
+                source_ts[source] = self.min_ts
+        return records, source_ts
 
-    def load(self, records: list):
-        records = "\n".join(zjson.encode(records))
+    def load(self, records: typing.Iterable, source_ts: dict = None):
+        if isinstance(records, list):
+            data = "\n".join(zjson.encode(records))
+        else:
+            # stream the records into the request body
+            data = (f"{_l}\n".encode() for _l in zjson.encode(records))
+        source_ts = self.source_ts if source_ts is None else source_ts
+        # a pending checkpoint is not trusted on restart since
+        # the load may or may not have been committed
+        if self.checkpoint is not None:
+            self.checkpoint.write(source_ts, pending=True)
         dest_pool, dest_branch = self._denormalize_one(self.dest)
         self.client.load(
-            dest_pool, records,
+            dest_pool, data,
             branch_name=dest_branch,
             commit_author=self.owner,
-            meta=self._source_ts_json(),
+            meta=self._source_ts_json(source_ts),
         )
+        if self.checkpoint is not None:
+            self.checkpoint.write(source_ts)
+
+    def _sync_ranges(self):
+        # each round reads the sources up to the max ts found
+        # beforehand, so the source ts committed along with the
+        # streamed load is known before the records are read
+        while not self._stop_flag.is_set():
+            upper = self._fetch_upper()
+            if len(upper) == 0:
+                return
+            if self.fan_in > 0:
+                records = self._read_fan_in(upper)
+            else:
+                records = (r for r in self.client.query(self._make_query(upper))
+                           if "__from" not in r)
+            first = next(records, None)
+            source_ts = {**self.source_ts, **upper}
+            if first is not None:
+                self.load(itertools.chain([first], records), source_ts)
+            self.source_ts.update(upper)
+
+            now = datetime.now(timezone.utc)
+            for source, ts in upper.items():
+                self.source_lag.setdefault(source, dict())["lag"] = \
+                    (now - ts).total_seconds()
+            # without chunks the round covered all sources
+            if self.chunk_size <= 0:
+                return
+
+    def _fetch_upper(self) -> dict:
+        """Return the max ts of each source that has records newer
+        than its source ts, within the next chunk if chunked."""
+        chunk_flow = f"sort ts | head {self.chunk_size} |" \
+            if self.chunk_size > 0 else ""
+        in_str = "from (\n"
+        for source in self.sources:
+            in_str += f"pool {source} => {self._ts_filter(source)} " \
+                      f"{chunk_flow} max(ts) | put __from := '{source}'\n"
+        in_str += ")"
+        return {
+            r["__from"]: r["max"] for r in self.client.query(in_str)
+            if r.get("max") is not None
+        }
+
+    def _read_fan_in(self, upper: dict) -> typing.Iterator:
+        """Read the sources in per-source queries, up to fan_in at
+        a time, and merge the records of each group by ts."""
+        sources = list(upper)
+        for i in range(0, len(sources), self.fan_in):
+            done = threading.Event()
+            try:
+                yield from heapq.merge(*(
+                    self._read_source(_s, upper[_s], done)
+                    for _s in sources[i:i + self.fan_in]
+                ), key=_ts_key)
+            finally:
+                # unblock the readers if the load is abandoned
+                done.set()
+
+    def _read_source(self, source: str, upper: datetime,
+                     done: threading.Event) -> typing.Iterator:
+        q = queue.Queue(maxsize=fan_in_buffer)
+
+        def put(item) -> bool:
+            while not done.is_set():
+                try:
+                    q.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read():
+            start = time.time()
+            try:
+                query = self._make_query({source: upper}, sort="ts")
+                for r in self.client.query(query):
+                    if "__from" not in r and not put(r):
+                        return
+                put(_done)
+            except Exception as e:
+                put(e)
+            self.source_lag.setdefault(source, dict())["read"] = \
+                time.time() - start
+
+        # the readers start before the merge pulls from them
+        threading.Thread(target=read, daemon=True).start()
+
+        def records():
+            while True:
+                r = q.get()
+                if r is _done:
+                    return
+                if isinstance(r, Exception):
+                    raise r
+                yield r
+
+        return records()
 
     def _event_loop(self):
-        s = requests.Session()
-        with s.get(f"{default_lake_url}/events",
-                   headers=None, stream=True) as resp:
-            lines = resp.iter_lines()
-            for line in lines:
+        # wait for the shared event stream to notify commits to
+        # the sources; commits arriving during once() are caught
+        # up by the next round
+        hub = event_hub(self.client.base_url)
+        hub.subscribe(self, self._source_keys())
+        try:
+            while not self._stop_flag.is_set():
+                self._commit.wait()
+                self._commit.clear()
                 if self._stop_flag.is_set():
                     return
-                event = self._parse_event(line, lines)
-                if event == Sync.SOURCE_COMMIT:
-                    self.once()
-                elif event == Sync.SKIP:
-                    continue
-                else:
-                    raise NotImplementedError
+                self.once()
+        finally:
+            hub.unsubscribe(self)
+
+    def notify(self):
+        """Called by the event hub on a commit to one of the sources."""
+        self._commit.set()
+
+    def _source_keys(self) -> set:
+        pool_names = {name: pool_id for pool_id, name in self.source_pool_ids.items()}
+        keys = set()
+        for source in self.sources:
+            pool, branch = self._denormalize_one(source)
+            if pool in pool_names:
+                keys.add((pool_names[pool], branch))
+        return keys
 
     def _poll_loop(self):
         while not self._stop_flag.is_set():
             self.once()
             time.sleep(self.poll_interval)
 
-    def _make_query(self) -> str:
+    def _make_query(self, upper: dict = None, sort: str = "this") -> str:
+        # upper: read only the given sources up to their max ts
+        sources = self.sources if upper is None else list(upper)
         in_str = "from (\n"
-        for source in self.sources:
-            cur_ts = max(self.source_ts.get(source, self.min_ts), self.min_ts)
-            filter_flow = f"ts > {zjson.encode_datetime(cur_ts)} |" \
-                if self.eoio else ""
+        for source in sources:
+            filter_flow = self._ts_filter(
+                source, None if upper is None else upper[source])
             patch_source_flow = f"put from := '{source}' |" \
                 if self.patch_source else ""
             in_str += f"pool {source} => {filter_flow} {patch_source_flow} fork (" \
                       f"=> select max(ts) as max_ts | put __from := '{source}' " \
                       f"=> {'pass' if self.in_flow == '' else self.in_flow})"
-            if len(self.sources) > 1:
+            if len(sources) > 1:
                 in_str += "\n"
         in_str += ")\n"  # wrap up from clause
         out_str = f"switch (case has(__from) => pass default => " \
                   f"{'pass' if self.out_flow == '' else self.out_flow})"
-        return f"{in_str} | sort this | {out_str}"
-
-    def _source_ts_json(self) -> str:
+        return f"{in_str} | sort {sort} | {out_str}"
+
+    def _ts_filter(self, source: str, upper: datetime = None) -> str:
+        if not self.eoio:
+            return ""
+        cur_ts = max(self.source_ts.get(source, self.min_ts), self.min_ts)
+        if upper is None:
+            return f"ts > {zjson.encode_datetime(cur_ts)} |"
+        return f"ts > {zjson.encode_datetime(cur_ts)} " \
+               f"and ts <= {zjson.encode_datetime(upper)} |"
+
+    def _source_ts_json(self, source_ts: dict = None) -> str:
+        source_ts = self.source_ts if source_ts is None else source_ts
         return json.dumps({
             source: zjson.encode_datetime(ts)
-            for source, ts in self.source_ts.items()
+            for source, ts in source_ts.items()
         })
 
     def _fetch_source_ts(self) -> dict:
+        if self.checkpoint is not None:
+            source_ts = self.checkpoint.read()
+            if source_ts is not None:
+                return source_ts
+        return self._scan_source_ts()
+
+    def _scan_source_ts(self) -> dict:
+        """Recover the source ts from the commit log of the dest."""
         source_ts = dict()
         pool, branch = self._denormalize_one(self.dest)
         # filter to branches that have at least one commit
@@ -174,29 +358,13 @@ class Sync(threading.Thread):
         return source_ts
 
     def _fetch_source_pool_ids(self) -> dict:
+        pools = set(s.split("@")[0] for s in self.sources)
         return {
-            f"0x{r['id'].hex()}": r["name"]
-            for r in self.client.query("from :pools")
-            if r["name"] in set(s.split("@")[0] for s in self.sources)
+            pool_id: name
+            for name, pool_id in self.client.pools().items()
+            if name in pools
         }
 
-    def _parse_event(self, line: bytes, lines: typing.Iterator) -> int:
-        def substr(s, start, end):
-            return (s.split(start))[1].split(end)[0]
-
-        line = line.decode()
-        if line == "event: branch-commit":
-            data = next(lines).decode().lstrip("data: ")
-            pool_id = substr(data, "pool_id:", ",")
-            branch = substr(data, "branch:", ",").strip('"')
-            # TBD cache commit_id
-            # commit_id = substr(data, "commit_id:", ",")
-            if pool_id in self.source_pool_ids:
-                pool_name = self.source_pool_ids[pool_id]
-                if f"{pool_name}@{branch}" in self.source_set:
-                    return Sync.SOURCE_COMMIT
-        return Sync.SKIP
-
     @staticmethod
     def _normalize(names: list) -> list:
         return [Sync._normalize_one(n) for n in names]
@@ -212,6 +380,16 @@ class Sync(threading.Thread):
         return pool, branch
 
 
+# end of the records of a source read concurrently
+_done = object()
+
+
+def _ts_key(record: dict) -> tuple:
+    # records without ts go first
+    ts = record.get("ts")
+    return (0, 0) if ts is None else (1, ts)
+
+
 class Watch(Sync):
     """A destination-less sync that runs a UDF in once()."""
 
@@ -227,14 +405,195 @@ class Watch(Sync):
 
     def once(self):
         self.fn(self.read())
+        if self.checkpoint is not None:
+            self.checkpoint.write(self.source_ts)
 
     def _fetch_source_ts(self) -> dict:
         if self.source_ts is None:
-            return defaultdict(lambda: self.min_ts)
+            source_ts = defaultdict(lambda: self.min_ts)
+            if self.checkpoint is not None:
+                source_ts.update(self.checkpoint.read() or {})
+            return source_ts
         else:
             return self.source_ts
 
 
+class Checkpoint:
+    """Source ts of a sync kept in a local file, so that a restart
+    reads O(sources) instead of scanning the commit log of the dest.
+    Each write replaces the file atomically."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self) -> typing.Optional[dict]:
+        """Return the committed source ts, or None if there are
+        none and the source ts should be recovered otherwise."""
+        try:
+            with open(self.path) as f:
+                cp = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cp.get("pending", True):
+            return None
+        return {
+            source: zjson.decode_time(ts)
+            for source, ts in cp["source_ts"].items()
+        }
+
+    def write(self, source_ts: dict, pending: bool = False):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "source_ts": {
+                    source: zjson.encode_datetime(ts)
+                    for source, ts in source_ts.items()
+                },
+                "pending": pending,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+def checkpoint_path(name: str) -> typing.Optional[str]:
+    """Return the checkpoint file of the named sync, if enabled."""
+    if checkpoint_dir is None:
+        return None
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    return os.path.join(checkpoint_dir, f"{name}.json")
+
+
+class EventHub(threading.Thread):
+    """Process-wide subscriber to the lake's event stream.
+
+    Each event is parsed once and dispatched to the syncs
+    subscribed to its (pool_id, branch), instead of every
+    sync holding its own stream to the lake. Listeners
+    receive every event as (type, fields), and RECONNECT
+    once the stream is re-established."""
+    BRANCH_COMMIT = "branch-commit"
+    RECONNECT = "reconnect"
+
+    def __init__(self, lake_url: str = default_lake_url,
+                 retry_interval: float = 1,
+                 max_retry_interval: float = 30):
+        self.lake_url = lake_url
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        # (pool_id, branch) -> subscribed syncs
+        self._index = defaultdict(set)
+        self._keys = dict()
+        self._listeners = list()
+        self._lock = threading.Lock()
+
+        threading.Thread.__init__(self, daemon=True)
+
+    def add_listener(self, fn: typing.Callable):
+        with self._lock:
+            self._listeners.append(fn)
+
+    def subscribe(self, sync: Sync, keys: set):
+        with self._lock:
+            self._keys[sync] = keys
+            for k in keys:
+                self._index[k].add(sync)
+
+    def unsubscribe(self, sync: Sync):
+        with self._lock:
+            for k in self._keys.pop(sync, set()):
+                self._index[k].discard(sync)
+                if len(self._index[k]) == 0:
+                    self._index.pop(k)
+
+    def run(self):
+        s = zed.session()
+        backoff = self.retry_interval
+        while True:
+            # the hub serves every sync, watch and metadata cache
+            # of the process, so no error may end the thread
+            try:
+                with s.get(f"{self.lake_url}/events",
+                           headers=None, stream=True) as resp:
+                    resp.raise_for_status()
+                    backoff = self.retry_interval
+                    # commits may have been missed while the
+                    # stream was down; let all syncs catch up
+                    self._notify_all()
+                    self._dispatch_loop(resp.iter_lines())
+            except requests.RequestException as e:
+                logger.warning(f"lake event stream unavailable: {e}")
+            except Exception as e:
+                logger.error(f"lake event stream failed: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_retry_interval)
+
+    def _dispatch_loop(self, lines: typing.Iterator):
+        for line in lines:
+            line = line.decode(errors="replace")
+            if not line.startswith("event:"):
+                continue
+            typ = line[len("event:"):].strip()
+            data = next(lines, None)
+            if data is None:
+                # the stream ended
+                return
+            try:
+                fields = self._parse_data(data)
+            except ValueError as e:
+                logger.warning(f"unable to parse lake event {data}: {e}")
+                continue
+            with self._lock:
+                listeners = list(self._listeners)
+                syncs = list(self._index.get(
+                    (fields.get("pool_id"), fields.get("branch")), ())) \
+                    if typ == EventHub.BRANCH_COMMIT else []
+            self._call_listeners(listeners, typ, fields)
+            for sync in syncs:
+                sync.notify()
+
+    def _notify_all(self):
+        with self._lock:
+            listeners = list(self._listeners)
+            syncs = list(self._keys)
+        self._call_listeners(listeners, EventHub.RECONNECT, dict())
+        for sync in syncs:
+            sync.notify()
+
+    @staticmethod
+    def _call_listeners(listeners: list, typ: str, fields: dict):
+        for fn in listeners:
+            try:
+                fn(typ, fields)
+            except Exception as e:
+                logger.error(f"event listener {fn} failed on {typ}: {e}")
+
+    @staticmethod
+    def _parse_data(line: bytes) -> dict:
+        # data: {pool_id:0x..,branch:"main",commit_id:0x..,..}
+        data = line.decode()
+        if data.startswith("data:"):
+            data = data[len("data:"):]
+        fields = dict()
+        for f in data.strip().strip("{}").split(","):
+            if ":" in f:
+                k, v = f.split(":", 1)
+                fields[k.strip().strip('"')] = v.strip().strip('"')
+        return fields
+
+
+_hubs, _hubs_lock = dict(), threading.Lock()
+
+
+def event_hub(lake_url: str = default_lake_url) -> EventHub:
+    """Return the running event hub of the lake, starting it on first use."""
+    with _hubs_lock:
+        if lake_url not in _hubs:
+            _hubs[lake_url] = EventHub(lake_url)
+            _hubs[lake_url].start()
+        return _hubs[lake_url]
+
+
 def from_config(path: str) -> Sync:
     with open(path) as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
@@ -244,6 +603,8 @@ def from_config(path: str) -> Sync:
         in_flow=config.get("in_flow", ""),
         out_flow=config.get("out_flow", ""),
         poll_interval=config.get("poll_interval", -1),
+        chunk_size=config.get("chunk_size", default_chunk_size),
+        fan_in=config.get("fan_in", default_fan_in),
     )
 
 
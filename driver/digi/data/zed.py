@@ -1,9 +1,26 @@
+import os
 import json
+import time
+import zlib
+import socket
 import getpass
+import threading
 import urllib.parse
+import requests
+import requests.adapters
+import urllib3.connection
 import pyzed
 from . import zjson
 
+# sec the pools and branches of a lake are cached for
+meta_ttl = float(os.environ.get("ZED_META_TTL", 30))
+# max connections kept open per lake by the shared transport
+pool_size = int(os.environ.get("ZED_POOL_SIZE", 32))
+# tcp keep-alive on the connections of the shared transport
+keepalive = os.environ.get("ZED_KEEPALIVE", "true") != "false"
+# gzip the request bodies of loads
+gzip_load = os.environ.get("ZED_GZIP_LOAD", "false") == "true"
+
 
 class Client(pyzed.Client):
     """TBD patch upstream"""
@@ -11,14 +28,28 @@ class Client(pyzed.Client):
     def __init__(self, *args, **kwargs):
         # In zed.Client: self.base_url = os.environ.get("ZED_LAKE", "http://localhost:9867")
         super().__init__(*args, **kwargs)
+        mount(self.session)
+        self._metadata = None
+
+    @property
+    def metadata(self) -> "Metadata":
+        # shared by the clients of the lake; resolved on
+        # first use so that no event stream opens on import
+        if self._metadata is None:
+            self._metadata = metadata(self.base_url)
+        return self._metadata
 
     def load(self, pool_name_or_id, data, branch_name='main',
-             commit_author=getpass.getuser(), commit_body='', meta=''):
+             commit_author=getpass.getuser(), commit_body='', meta='',
+             gzip=None):
         pool = urllib.parse.quote(pool_name_or_id)
         branch = urllib.parse.quote(branch_name)
         url = self.base_url + '/pool/' + pool + '/branch/' + branch
         commit_message = {'author': commit_author, 'body': commit_body, 'meta': meta}
         headers = {'Zed-Commit': json.dumps(commit_message)}
+        if gzip_load if gzip is None else gzip:
+            data = _gzip(data)
+            headers['Content-Encoding'] = 'gzip'
         r = self.session.post(url, headers=headers, data=data)
         self.__raise_for_status(r)
 
@@ -30,12 +61,157 @@ class Client(pyzed.Client):
                                   "commit": commit,
                               })
         self.__raise_for_status(r)
+        self.metadata.add_branch(pool, name)
 
     def branch_exist(self, pool, name):
-        records = self.query(f"from {pool}:branches")
-        return name in set(r["branch"]["name"] for r in records)
+        return name in self.metadata.branches(self, pool)
+
+    def pools(self) -> dict:
+        """Return {pool name: pool id} of the lake."""
+        return self.metadata.pools(self)
 
     def query(self, query):
         r = self.query_raw(query)
         return zjson.decode_raw((json.loads(line)
                                  for line in r.iter_lines() if line))
+
+
+class _Adapter(requests.adapters.HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        if keepalive:
+            kwargs["socket_options"] = \
+                urllib3.connection.HTTPConnection.default_socket_options + \
+                [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super().init_poolmanager(*args, **kwargs)
+
+
+_adapter, _adapter_lock = None, threading.Lock()
+
+
+def adapter() -> requests.adapters.HTTPAdapter:
+    """Return the transport shared by the lake clients of the
+    process; its connection pools are thread-safe."""
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            _adapter = _Adapter(pool_connections=8,
+                                pool_maxsize=pool_size)
+        return _adapter
+
+
+def mount(session: requests.Session) -> requests.Session:
+    """Route the requests of the session via the shared transport."""
+    session.mount("http://", adapter())
+    session.mount("https://", adapter())
+    return session
+
+
+def session() -> requests.Session:
+    return mount(requests.Session())
+
+
+def _gzip(data):
+    if isinstance(data, str):
+        data = data.encode()
+    if isinstance(data, bytes):
+        # zlib.compress takes wbits only since python 3.11
+        z = zlib.compressobj(wbits=31)
+        return z.compress(data) + z.flush()
+
+    # stream the compressed chunks
+    def chunks():
+        z = zlib.compressobj(wbits=31)
+        for chunk in data:
+            yield z.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        yield z.flush()
+
+    return chunks()
+
+
+class Metadata:
+    """Pools and branches of a lake, cached for a ttl and kept
+    fresh in between from the lake's event stream."""
+
+    def __init__(self, ttl: float = meta_ttl):
+        self.ttl = ttl
+        # name -> id, fetched at
+        self._pools, self._pools_at = None, 0
+        # pool name -> (branch names, fetched at)
+        self._branches = dict()
+        self._lock = threading.Lock()
+
+    def pools(self, client: Client) -> dict:
+        with self._lock:
+            if self._pools is not None \
+                    and time.time() - self._pools_at < self.ttl:
+                return dict(self._pools)
+        pools = {
+            r["name"]: f"0x{r['id'].hex()}"
+            for r in client.query("from :pools")
+        }
+        with self._lock:
+            self._pools, self._pools_at = pools, time.time()
+        return dict(pools)
+
+    def branches(self, client: Client, pool: str) -> set:
+        with self._lock:
+            if pool in self._branches \
+                    and time.time() - self._branches[pool][1] < self.ttl:
+                return set(self._branches[pool][0])
+        branches = set(r["branch"]["name"]
+                       for r in client.query(f"from {pool}:branches"))
+        with self._lock:
+            self._branches[pool] = (branches, time.time())
+        return set(branches)
+
+    def add_branch(self, pool: str, branch: str):
+        with self._lock:
+            if pool in self._branches:
+                self._branches[pool][0].add(branch)
+
+    def invalidate(self):
+        with self._lock:
+            self._pools, self._branches = None, dict()
+
+    def on_event(self, typ: str, fields: dict):
+        if typ in {"pool-new", "pool-update", "pool-delete"}:
+            with self._lock:
+                name = self._pool_name(fields.get("pool_id"))
+                self._pools = None
+                if typ == "pool-delete":
+                    self._branches.pop(name, None)
+        elif typ in {"branch-commit", "branch-update", "branch-delete"}:
+            with self._lock:
+                name = self._pool_name(fields.get("pool_id"))
+                if name is None and typ == "branch-delete":
+                    self._branches = dict()
+                if name not in self._branches:
+                    return
+                branches, branch = self._branches[name][0], fields.get("branch")
+                if typ == "branch-delete":
+                    branches.discard(branch)
+                else:
+                    branches.add(branch)
+        elif typ == "reconnect":
+            # events may have been missed
+            self.invalidate()
+
+    def _pool_name(self, pool_id: str):
+        for name, _id in (self._pools or {}).items():
+            if _id == pool_id:
+                return name
+        return None
+
+
+_metadata, _metadata_lock = dict(), threading.Lock()
+
+
+def metadata(lake_url: str) -> Metadata:
+    """Return the metadata cache of the lake, watching its events."""
+    from . import sync
+
+    with _metadata_lock:
+        if lake_url not in _metadata:
+            _metadata[lake_url] = Metadata()
+            sync.event_hub(lake_url).add_listener(_metadata[lake_url].on_event)
+        return _metadata[lake_url]
@@ -10,193 +10,245 @@ import json
 """TBD patch upstream pyzed"""
 
 _py_to_zed_primitive_type = {
-    "<class 'int'>": "int64",
-    "<class 'datetime.timedelta'>": "duration",
-    "<class 'datetime.datetime'>": "time",
-    "<class 'float'>": "float64",
-    "<class 'decimal.Decimal'>": "decimal",
-    "<class 'bool'>": "bool",  # TBD check zed/zed.py 'bool' -> 'T'
-    "<class 'bytes'>": "bytes",
-    "<class 'str'>": "string",
-    "<class 'ipaddress.IPv4Address'>": "ip",
-    "<class 'ipaddress.IPv4Network'>": "net",
-    "<class 'type'>": "type",
-    "<class 'NoneType'>": "null",
+    int: "int64",
+    datetime.timedelta: "duration",
+    datetime.datetime: "time",
+    float: "float64",
+    decimal.Decimal: "decimal",
+    bool: "bool",  # TBD check zed/zed.py 'bool' -> 'T'
+    bytes: "bytes",
+    str: "string",
+    ipaddress.IPv4Address: "ip",
+    ipaddress.IPv4Network: "net",
+    type: "type",
+    type(None): "null",
 }
 
+_primitive_types = {
+    t: {"kind": "primitive", "name": n}
+    for t, n in _py_to_zed_primitive_type.items()
+}
 
-class __Counter:
-    def __init__(self):
-        self.ctr = 29
 
-    def get_and_inc(self):
-        self.ctr += 1
-        return self.ctr
+class Encoder:
+    """ZJSON encoder that caches the types it emits by the shape of
+    the values, so that values of a shape seen before in the batch
+    (or stream) refer to its type id with a ZJSON ref type instead of
+    repeating the type definition."""
 
+    def __init__(self):
+        # shape -> type id
+        self._ids = dict()
+        self._next_id = 30
 
-def encode(objs: typing.List[dict]) -> typing.Generator[str, None, None]:
-    id_ctr, types = __Counter(), dict()
-    for obj in objs:
-        yield json.dumps({
-            "type": _encode_type(id_ctr, obj),
-            "value": _encode_value(obj),
-        })
+    def encode(self, objs: typing.Iterable) -> typing.Generator[str, None, None]:
+        for obj in objs:
+            yield json.dumps({
+                "type": self.encode_type(obj),
+                "value": _encode_value(obj),
+            })
 
+    def encode_type(self, value) -> dict:
+        return self._encode_type(value)[1]
 
-def _encode_type(id_ctr, value) -> dict:
-    # TBD ref type
-    if isinstance(value, dict):
-        return {
-            "kind": "record",
-            "fields": [
-                {"name": _f, "type": _encode_type(id_ctr, _v)}
-                for _f, _v in value.items()
-            ] if len(value) > 0 else None,
-            "id": id_ctr.get_and_inc()
-        }
-    elif isinstance(value, list):
-        return {
-            "kind": "array",
-            "type": _encode_type(id_ctr, value[0] if len(value) > 0 else None),
-            "id": id_ctr.get_and_inc()
-        }
-    elif isinstance(value, set):
-        return {
-            "kind": "set",
-            "type": _encode_type(id_ctr, next(iter(value)) if len(value) > 0 else None),
-            "id": id_ctr.get_and_inc()
-        }
-    else:  # primitive type
-        typ = str(type(value))
-        if typ not in _py_to_zed_primitive_type:
+    def _encode_type(self, value) -> typing.Tuple[typing.Hashable, dict]:
+        # returns the (shape, type) of the value
+        typ = type(value)
+        if typ is dict:
+            fields = [(_f, self._encode_type(_v)) for _f, _v in value.items()]
+            shape = ("record", tuple((_f, _s) for _f, (_s, _) in fields))
+            return shape, self._complex(shape, lambda: {
+                "kind": "record",
+                "fields": [
+                    {"name": _f, "type": _t} for _f, (_, _t) in fields
+                ] if len(fields) > 0 else None,
+            })
+        elif typ is list or typ is set:
+            kind = "array" if typ is list else "set"
+            elem = next(iter(value)) if len(value) > 0 else None
+            elem_shape, elem_typ = self._encode_type(elem)
+            shape = (kind, elem_shape)
+            return shape, self._complex(shape, lambda: {
+                "kind": kind,
+                "type": elem_typ,
+            })
+        elif typ in _primitive_types:
+            return typ, _primitive_types[typ]
+        elif isinstance(value, dict):
+            return self._encode_type(dict(value))
+        elif isinstance(value, list):
+            return self._encode_type(list(value))
+        elif isinstance(value, set):
+            return self._encode_type(set(value))
+        else:
             raise Exception(f"unknown zed primitive type for {typ}")
-        return {
-            "kind": "primitive",
-            "name": _py_to_zed_primitive_type[typ],
-        }
+
+    def _complex(self, shape, make_typ: typing.Callable) -> dict:
+        if shape in self._ids:
+            return {"kind": "ref", "id": self._ids[shape]}
+        typ = make_typ()
+        typ["id"] = self._ids[shape] = self._next_id
+        self._next_id += 1
+        return typ
+
+
+def encode(objs: typing.List[dict]) -> typing.Generator[str, None, None]:
+    # type ids are shared by the objects in the batch
+    return Encoder().encode(objs)
 
 
 def _encode_value(value) -> typing.Union[list, str, None]:
+    typ = type(value)
+    if typ in _value_encoders:
+        return _value_encoders[typ](value)
     if isinstance(value, dict):
-        return [_encode_value(_v) for _, _v in value.items()]
-    elif isinstance(value, list):
-        return [_encode_value(_v) for _v in value]
-    elif isinstance(value, set):
-        return [_encode_value(_v) for _v in value]
-    elif isinstance(value, datetime.datetime):
-        return encode_datetime(value)
-    elif isinstance(value, datetime.timedelta):
-        return durationpy.to_str(value)
-    elif str(type(value)) in _py_to_zed_primitive_type:
-        if value is None:
-            return None
-        if type(value) == bool:
-            return str(value).lower()
-        else:
-            return str(value)
-    else:
-        raise Exception(f"cannot encode value of type {type(value)}")
+        return _value_encoders[dict](value)
+    if isinstance(value, (list, set)):
+        return _value_encoders[list](value)
+    raise Exception(f"cannot encode value of type {typ}")
 
 
 def encode_datetime(value: datetime.datetime) -> str:
     return value.isoformat().replace("+00:00", "") + "Z"
 
 
+_value_encoders = {
+    dict: lambda v: [_encode_value(_v) for _v in v.values()],
+    list: lambda v: [_encode_value(_v) for _v in v],
+    set: lambda v: [_encode_value(_v) for _v in v],
+    datetime.datetime: encode_datetime,
+    datetime.timedelta: durationpy.to_str,
+    bool: lambda v: "true" if v else "false",
+    type(None): lambda v: None,
+    **{
+        t: str for t in _py_to_zed_primitive_type
+        if t not in {bool, type(None),
+                     datetime.datetime, datetime.timedelta}
+    },
+}
+
+
 class QueryError(Exception):
     """Raised by Client.query() when a query fails."""
     pass
 
 
-def decode_raw(raw):
-    types = {}
-    for msg in raw:
-        typ, value = msg['type'], msg['value']
-        if isinstance(typ, dict):
-            yield _decode_value(_decode_type(types, typ), value)
-        elif typ == 'QueryError':
-            raise QueryError(value['error'])
+def decode_raw(raw) -> typing.Generator:
+    # type ids are scoped to the stream
+    return Decoder().decode(raw)
 
 
-def _decode_type(types, typ):
-    kind = typ['kind']
-    if kind == 'ref':
-        return types[typ['id']]
-    if kind == 'primitive':
-        return typ
-    elif kind == 'record':
-        if typ['fields'] is None:
-            # XXX
+class Decoder:
+    """ZJSON decoder that compiles each type of a stream once into
+    a function decoding the values of that type, so that values do
+    not re-walk their type tree. Records are decoded lazily as the
+    messages of the stream are consumed."""
+
+    def __init__(self):
+        # type id -> decode function
+        self._decoders = dict()
+
+    def decode(self, raw) -> typing.Generator:
+        for msg in raw:
+            typ, value = msg['type'], msg['value']
+            if isinstance(typ, dict):
+                yield self.compile(typ)(value)
+            elif typ == 'QueryError':
+                raise QueryError(value['error'])
+
+    def compile(self, typ: dict) -> typing.Callable:
+        kind = typ['kind']
+        if kind == 'ref':
+            return self._decoders[typ['id']]
+        if kind == 'primitive':
+            name = typ['name']
+            if name not in _primitive_decoders:
+                raise Exception(f'unknown primitive name {name}')
+            return _primitive_decoders[name]
+
+        if kind == 'record':
+            fields = [(f['name'], self.compile(f['type']))
+                      for f in typ['fields'] or []]
+
+            def fn(v):
+                if v is None:
+                    return None
+                return {_n: _f(_v) for (_n, _f), _v in zip(fields, v)}
+        elif kind == 'array':
+            elem = self.compile(typ['type'])
+
+            def fn(v):
+                return None if v is None else [elem(_v) for _v in v]
+        elif kind == 'set':
+            elem = self.compile(typ['type'])
+
+            def fn(v):
+                return None if v is None else {elem(_v) for _v in v}
+        elif kind == 'map':
+            key, val = self.compile(typ['key_type']), self.compile(typ['val_type'])
+
+            def fn(v):
+                return None if v is None else {key(_v[0]): val(_v[1]) for _v in v}
+        elif kind == 'union':
+            types = [self.compile(t) for t in typ['types']]
+
+            def fn(v):
+                return None if v is None else types[int(v[0])](v[1])
+        elif kind == 'enum':
+            symbols = typ['symbols']
+
+            def fn(v):
+                return None if v is None else symbols[int(v)]
+        elif kind in ['error', 'named']:
+            fn = self.compile(typ['type'])
+        else:
+            raise Exception(f'unknown type kind {kind}')
+        self._decoders[typ['id']] = fn
+        return fn
+
+
+def decode_time(value: str) -> datetime.datetime:
+    # fast path for the UTC timestamps emitted by Zed, which
+    # may carry up to nanoseconds; other formats go to dateutil
+    if len(value) >= 20 and value[-1] == 'Z' and value[10] == 'T':
+        base, _, frac = value[:-1].partition('.')
+        try:
+            return datetime.datetime(
+                int(base[0:4]), int(base[5:7]), int(base[8:10]),
+                int(base[11:13]), int(base[14:16]), int(base[17:19]),
+                int(frac[:6].ljust(6, '0')) if frac else 0,
+                tzinfo=datetime.timezone.utc,
+            )
+        except ValueError:
             pass
-        for f in typ['fields']:
-            f['type'] = _decode_type(types, f['type'])
-    elif kind in ['array', 'set']:
-        typ['type'] = _decode_type(types, typ['type'])
-    elif kind == 'map':
-        typ['key_type'] = _decode_type(types, typ['key_type'])
-        typ['val_type'] = _decode_type(types, typ['val_type'])
-    elif kind == 'union':
-        typ['types'] = [_decode_type(types, t) for t in typ['types']]
-    elif kind == 'enum':
-        pass
-    elif kind in ['error', 'named']:
-        typ['type'] = _decode_type(types, typ['type'])
-    else:
-        raise Exception(f'unknown type kind {kind}')
-    types[typ['id']] = typ
-    return typ
-
-
-def _decode_value(typ, value):
-    if value is None:
-        return None
-    kind = typ['kind']
-    if kind == 'primitive':
-        name = typ['name']
-        if name in ['uint8', 'uint16', 'uint32', 'uint64',
-                    'int8', 'int16', 'int32', 'int64']:
-            return int(value)
-        if name == 'duration':
-            return durationpy.from_str(value)
-        if name == 'time':
-            return dateutil.parser.isoparse(value)
-        if name in ['float16', 'float32', 'float64']:
-            return float(value)
-        if name == 'decimal':
-            return decimal.Decimal(value)
-        if name == 'bool':
-            return value in {'T', 'true'}  # TBD patch upstream
-        if name == 'bytes':
-            return binascii.a2b_hex(value[2:])
-        if name == 'string':
-            return value
-        if name == 'ip':
-            return ipaddress.ip_address(value)
-        if name == 'net':
-            return ipaddress.ip_network(value)
-        if name in 'type':
-            return value
-        if name == 'null':
-            return None
-        raise Exception(f'unknown primitive name {name}')
-    if kind == 'record':
-        return {f['name']: _decode_value(f['type'], v)
-                for f, v in zip(typ['fields'], value)}
-    if kind == 'array':
-        return [_decode_value(typ['type'], v) for v in value]
-    if kind == 'set':
-        return {_decode_value(typ['type'], v) for v in value}
-    if kind == 'map':
-        key_type, val_type = typ['key_type'], typ['val_type']
-        return {_decode_value(key_type, v[0]): _decode_value(val_type, v[1])
-                for v in value}
-    if kind == 'union':
-        type_index, val = value
-        return _decode_value(typ['types'][int(type_index)], val)
-    if kind == 'enum':
-        return typ['symbols'][int(value)]
-    if kind in ['error', 'named']:
-        return _decode_value(typ['type'], value)
-    raise Exception(f'unknown type kind {kind}')
+    return dateutil.parser.isoparse(value)
+
+
+def _nullable(fn: typing.Callable) -> typing.Callable:
+    return lambda v: None if v is None else fn(v)
+
+
+_primitive_decoders = {
+    **{
+        name: _nullable(int) for name in
+        ['uint8', 'uint16', 'uint32', 'uint64',
+         'int8', 'int16', 'int32', 'int64']
+    },
+    **{
+        name: _nullable(float) for name in
+        ['float16', 'float32', 'float64']
+    },
+    'duration': _nullable(durationpy.from_str),
+    'time': _nullable(decode_time),
+    'decimal': _nullable(decimal.Decimal),
+    'bool': _nullable(lambda v: v in {'T', 'true'}),  # TBD patch upstream
+    'bytes': _nullable(lambda v: binascii.a2b_hex(v[2:])),
+    'string': lambda v: v,
+    'ip': _nullable(ipaddress.ip_address),
+    'net': _nullable(ipaddress.ip_network),
+    'type': lambda v: v,
+    'null': lambda v: None,
+}
 
 
 if __name__ == '__main__':
@@ -208,6 +260,4 @@ if __name__ == '__main__':
         {"watt": "12", "user": {"alice": True}},
     ]
     print("\n".join((encode(test))))
-    # import zed
-    # TBD fix zed.py/decoder handle null fields
-    # print(list(zed.decode_raw(json.loads(line) for line in (encode(test)))))
+    print(list(decode_raw(json.loads(line) for line in (encode(test)))))
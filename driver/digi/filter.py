@@ -8,40 +8,69 @@ def always(*args, **kwargs):
 
 def changed(_, diff, path, *args, **kwargs) -> bool:
     _, _ = args, kwargs
-    # TBD: add shared diff for all handlers
     # TBD: support incremental diff
-    return path_changed(diff, path)
+    return change_index(diff).changed(path)
 
 
 def path_changed(diff: list, path: tuple):
-    changed_paths = {(".",): True}
-    for op, path_, old, new in diff:
-        # when create
-        if old is None and len(path_) == 0:
-            changed_paths.update(_from_model(new))
+    return change_index(diff).changed(path)
+
+
+class ChangeIndex:
+    """A trie of the attribute paths changed by a diff.
+
+    The index is built once per diff and shared by the
+    conditions of all handlers, so that each lookup costs
+    O(len(path)) instead of O(len(diff)) or O(model size).
+    Paths are stored without the leading "spec".
+    """
+
+    def __init__(self, diff: list):
+        self._root = dict()
+        # on create the whole model is new; a path is
+        # changed iff it exists in the model's spec
+        self._model = None
+        self._empty = len(diff) == 0
+
+        for op, path_, old, new in diff:
+            if old is None and len(path_) == 0:
+                self._model = (new or {}).get("spec", {})
+                continue
+            n = self._root
+            for p in path_[1:]:
+                n = n.setdefault(p, dict())
+
+    def changed(self, path: tuple) -> bool:
+        if self._empty or path == (".",):
+            return True
+
+        n = self._root
+        for p in path:
+            if p not in n:
+                break
+            n = n[p]
         else:
-            changed_paths.update(_from_path_tuple(path_))
-    if path in changed_paths or len(diff) == 0:
-        return True
-    return False
-
-
-def _from_model(d: dict):
-    result = dict()
-    to_visit = [[d.get("spec", {}), []]]
-    for n, prefix in to_visit:
-        result[tuple(prefix)] = True
-        if type(n) is not dict:
-            continue
-        for _k, _v in n.items():
-            to_visit.append([_v, prefix + [_k]])
-    return result
-
-
-def _from_path_tuple(p: tuple):
-    # expand a path tuple to dict of paths
-    return {
-        # skip "spec"
-        p[1:_i + 1]: True
-        for _i in range(len(p))
-    }
+            return True
+
+        if self._model is not None:
+            n = self._model
+            for p in path:
+                if type(n) is not dict or p not in n:
+                    return False
+                n = n[p]
+            return True
+        return False
+
+    __contains__ = changed
+
+
+# the index of the most recent diff; a reconcile loop
+# runs the conditions of all handlers over the same diff
+_last_diff, _last_index = None, None
+
+
+def change_index(diff: list) -> ChangeIndex:
+    global _last_diff, _last_index
+    if diff is not _last_diff:
+        _last_diff, _last_index = diff, ChangeIndex(diff)
+    return _last_index
@@ -1,16 +1,26 @@
+import copy
+import json
+import time
+import threading
 import kopf
 
 import digi.util as util
 from digi.mount import Mounter
+from digi.profile import profiler
 
 
 def run():
     import digi
 
+    # import the kubernetes client and load the cluster
+    # config while the operator starts up
+    threading.Thread(target=util.api, daemon=True).start()
+
     # mounter
     if digi.enable_mounter:
-        Mounter(digi.g, digi.v, digi.r, digi.n, digi.ns,
-                log_level=digi.log_level).start()
+        digi.mounter = Mounter(digi.g, digi.v, digi.r, digi.n, digi.ns,
+                               log_level=digi.log_level)
+        digi.mounter.start()
 
     digi.model = digi.control.create_model()
     digi.pool = digi.data.create_pool()
@@ -28,6 +38,7 @@ def run():
         "registry": _registry,
     }
     _ready, _stop = None, None
+    _last_profile_obs = 0
 
     # force decorate the handlers
     from . import handler
@@ -40,12 +51,22 @@ def run():
         settings.posting.level = digi.log_level
 
     # reconciler operations
-    from digi.reconcile import rc
-    from digi.view import CleanView
+    from digi.reconcile import rc, Coalescer
+    _coalescer = None
+    if digi.coalesce_window > 0:
+        _coalescer = Coalescer(
+            lambda: util.get_model(digi.g, digi.v, digi.r, digi.n, digi.ns),
+            window=digi.coalesce_window, quiet=digi.coalesce_quiet)
+
     @kopf.on.create(**_model, **_kwargs)
     @kopf.on.resume(**_model, **_kwargs)
     @kopf.on.update(**_model, **_kwargs)
     def reconcile(spec, meta, *args, **kwargs):
+        with profiler.stage("reconcile"):
+            _reconcile(spec, meta, *args, **kwargs)
+
+    def _reconcile(spec, meta, *args, **kwargs):
+        nonlocal _last_profile_obs
         digi.logger.debug(f"processing gen: {meta['generation']}; "
                           f"resource version: {meta['resourceVersion']}; "
                           f"skip_gen: {rc.skip_gen}; "
@@ -53,21 +74,26 @@ def run():
                           f"reconcile count: {rc.count}")
 
         gen = meta["generation"]
-        if gen == rc.last_seen_gen:
+        util.model_cache.update(digi.g, digi.v, digi.r, digi.n, digi.ns,
+                                spec, meta["resourceVersion"], gen)
+        # generations up to the last seen may have been
+        # coalesced into it
+        if gen <= rc.last_seen_gen:
             digi.logger.info(f"skipped gen {gen} due to last-seen")
             return
 
         rc.last_seen_gen = gen
         rc.count += 1
 
+        # kopf's new is a separate copy of the model at this
+        # generation; handlers edit the spec in place
+        new = kwargs.get("new", None)
+
         if digi.pool is not None:
-            try:
-                model = CleanView(dict(spec),
-                                  trim_mount=digi.load_trim_mount).m()
-                digi.pool.load([model], branch="model")
-                digi.logger.info(f"done loading model snapshot to pool")
-            except Exception as e:
-                digi.logger.warning(f"unable to load to pool: {e}")
+            # snapshots are loaded in the background
+            with profiler.stage("snapshot"):
+                digi.pool.load_model(new["spec"] if new is not None and "spec" in new
+                                     else copy.deepcopy(dict(spec)), gen)
 
         # skip the last self-write
         # TBD for parallel reconciliation may need to lock rc.gen before patch
@@ -75,13 +101,58 @@ def run():
             digi.logger.info(f"skipped gen {gen} due to self-write")
             return
 
-        spec = rc.run(spec, *args, **kwargs)
+        # under a burst of updates, reconcile the latest
+        # generation with the diff merged over the burst
+        if _coalescer is not None:
+            with profiler.stage("coalesce"):
+                latest = _coalescer.latest(gen)
+            if latest is not None:
+                old = kwargs.get("old", None)
+                new = copy.deepcopy({"spec": latest.get("spec", {}),
+                                     "metadata": latest["metadata"]})
+                kwargs["new"] = new
+                kwargs["diff"] = [("add", (), None, new)] if old is None \
+                    else util.diff({"spec": old.get("spec", {})},
+                                   {"spec": new["spec"]})
+                spec = copy.deepcopy(new["spec"])
+                digi.logger.info(f"coalesced gen {gen} into "
+                                 f"{latest['metadata']['generation']}")
+                gen = rc.last_seen_gen = latest["metadata"]["generation"]
+                util.model_cache.update_from_body(digi.g, digi.v, digi.r,
+                                                  digi.n, digi.ns, latest)
+                if digi.pool is not None:
+                    digi.pool.load_model(new["spec"], gen)
+                # the latest may be the last self-write
+                if gen == rc.skip_gen and rc.should_skip():
+                    digi.logger.info(f"skipped gen {gen} due to self-write")
+                    return
+
+        with profiler.stage("handlers"):
+            spec = rc.run(spec, *args, **kwargs)
+        if new is not None:
+            with profiler.stage("diff"):
+                spec = util.merge_patch(new.get("spec", {}), spec, prune=False)
+            if len(spec) == 0:
+                rc.clear_pending()
+                digi.logger.info(f"done reconciliation; no changes")
+                return
+
+        # piggyback the profile summary on a write that
+        # happens anyway, at most once per interval
+        if profiler.enabled and 0 <= digi.profile_obs_interval \
+                < time.time() - _last_profile_obs:
+            _last_profile_obs = time.time()
+            spec.setdefault("obs", {})["profile"] = profiler.summary()
+
+        rc.add_patch_bytes(len(json.dumps(spec)))
         _, resp, e = util.check_gen_and_patch_spec(digi.g, digi.v, digi.r, digi.n, digi.ns,
-                                                   spec, gen=gen)
+                                                   spec, gen=gen, profile=True)
         if e is not None:
             if e.status == util.DriverError.GEN_OUTDATED:
                 digi.logger.warning(f"gen {gen} outdated; "
                                     f"pending {len(rc._pending_handler)} handlers")
+                if _coalescer is not None:
+                    _coalescer.outdated()
                 return
             else:
                 raise kopf.PermanentError(e.status)
@@ -103,6 +174,9 @@ def run():
     if digi.pool is not None:
         digi.pool.create_branch_if_not_exist("model")
 
+    if digi.enable_profile:
+        profiler.serve(digi.profile_port)
+
     if digi.enable_visual:
         import os, sys, subprocess
         try:
@@ -8,6 +8,13 @@ automatically listens on the topic corresponding to the digi's name,
 and any JSON data that it receives will be added to the zed pool.
 """
 
-from digi.message.mqtt import start_listening
+
+def __getattr__(name):
+    # paho is imported on first use
+    if name == "start_listening":
+        from digi.message.mqtt import start_listening
+        return start_listening
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
 
 __all__ = ["start_listening"]
@@ -1,6 +1,12 @@
+import os
+import json
+import time
+import queue
+import threading
+import typing
+
 from paho.mqtt import client as mqtt_client
 import digi
-import json
 
 # Debug flag to toggle more verbose logging
 DEBUG = False
@@ -10,7 +16,125 @@ DEBUG = False
 broker = 'emqx'
 port = 1883
 
-def connect_mqtt(username, password) -> mqtt_client:
+# max messages buffered between receipt and load
+queue_size = int(os.environ.get("MQTT_QUEUE_SIZE", 10000))
+# max messages per load and max sec a message waits for its batch
+batch_size = int(os.environ.get("MQTT_BATCH_SIZE", 500))
+batch_age = float(os.environ.get("MQTT_BATCH_AGE", 0.1))
+
+# the running ingest pipeline, if any
+ingest = None
+
+
+class Ingest(threading.Thread):
+    """Loads the messages received from the broker into the pool in
+    batches, so that paho's network thread only enqueues them.
+
+    Messages are dropped when the queue is full, except for QoS 1/2
+    messages with manual ack, which block the network thread instead
+    and are acked only once their batch is loaded."""
+
+    def __init__(self, load: typing.Callable = None, *,
+                 manual_ack: bool = False,
+                 queue_size: int = queue_size,
+                 batch_size: int = batch_size,
+                 batch_age: float = batch_age):
+        self.load = load_to_pool if load is None else load
+        self.manual_ack = manual_ack
+        self.batch_size = batch_size
+        self.batch_age = batch_age
+        self.client = None  # set on subscribe, for acks
+        self.counters = {
+            "received": 0,
+            "dropped": 0,
+            "invalid": 0,
+            "loaded": 0,
+            "failed": 0,
+        }
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._stop_flag = threading.Event()
+
+        threading.Thread.__init__(self, daemon=True)
+
+    def put(self, msg):
+        """Called by on_message in paho's network thread."""
+        self._count("received")
+        if self.manual_ack and msg.qos > 0:
+            self._queue.put(msg)
+            return
+        try:
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            self._count("dropped")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, queued=self._queue.qsize())
+
+    def stop(self):
+        self._stop_flag.set()
+        self.join()
+
+    def run(self):
+        while not (self._stop_flag.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if len(batch) > 0:
+                self._load(batch)
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self._queue.get(timeout=self.batch_age)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.batch_age
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _load(self, batch: list):
+        records = list()
+        for msg in batch:
+            try:
+                records.append(json.loads(msg.payload))
+            except ValueError:
+                self._count("invalid")
+                digi.logger.error("Message was not in JSON format, ignoring")
+
+        if len(records) > 0:
+            try:
+                self.load(records)
+                self._count("loaded", len(records))
+            except Exception as e:
+                # unacked messages are redelivered by the broker
+                self._count("failed", len(records))
+                digi.logger.error(f"Failed to load {len(records)} messages: {e}")
+                return
+
+        if DEBUG: digi.logger.info(f"Loaded {len(records)} messages: {self.stats()}")
+        if self.manual_ack and self.client is not None:
+            for msg in batch:
+                if msg.qos > 0:
+                    self.client.ack(msg.mid, msg.qos)
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+
+def load_to_pool(records: list):
+    # unbuffered, so that the records are committed, or an
+    # error is raised, before their messages are acked
+    digi.pool.load(records, buffered=False)
+
+
+def connect_mqtt(username, password, manual_ack=False) -> mqtt_client:
     def on_connect(client, userdata, flags, rc):
         if rc == 0:
             digi.logger.info("Connected to digi MQTT broker")
@@ -18,32 +142,36 @@ def connect_mqtt(username, password) -> mqtt_client:
             digi.logger.info(f"Failed to connect to digi MQTT broker, return code {rc}")
 
     # Client ID - used for tracking subscriptions; must be unique
-    client = mqtt_client.Client(digi.name + '-ingest')
+    client = mqtt_client.Client(client_id=digi.name + '-ingest',
+                                manual_ack=manual_ack)
     client.username_pw_set(username, password)
     client.on_connect = on_connect
     client.connect(broker, port)
     return client
 
-def subscribe(client: mqtt_client):
+
+def subscribe(client: mqtt_client, pipeline: Ingest,
+              topics: typing.List[str] = None, qos: int = 0):
     def on_message(client, userdata, msg):
-        data = msg.payload.decode()
-        topic = msg.topic
+        if DEBUG: digi.logger.info(f"New message on topic {msg.topic}:\n{msg.payload}")
+        pipeline.put(msg)
 
-        if DEBUG: digi.logger.info(f"New message on topic {topic}:\n{data}")
+    # Listen on digi's name as the topic by default; topics
+    # may contain the MQTT wildcards + and #
+    topics = [digi.name] if topics is None else topics
+    client.subscribe([(t, qos) for t in topics])
+    client.on_message = on_message
+    pipeline.client = client
 
-        try:
-            data_json = json.loads(data)
-            digi.pool.load([data_json])
-        except json.JSONDecodeError:
-            digi.logger.error("Message was not in JSON format, ignoring")
+    digi.logger.info(f"Listening for messages on topics {topics}")
 
-    # Listen on digi's name as the topic
-    client.subscribe(digi.name)
-    client.on_message = on_message
 
-    digi.logger.info(f"Listening for messages on topic {digi.name}")
+def start_listening(username="admin", password="digi_password",
+                    topics=None, qos=0, manual_ack=False):
+    global ingest
+    ingest = Ingest(manual_ack=manual_ack)
+    ingest.start()
 
-def start_listening(username="admin", password="digi_password"):
-    client = connect_mqtt(username, password)
-    subscribe(client)
+    client = connect_mqtt(username, password, manual_ack=manual_ack)
+    subscribe(client, ingest, topics=topics, qos=qos)
     client.loop_forever()
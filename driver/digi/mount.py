@@ -1,7 +1,10 @@
 import os
 import sys
+import time
 import logging
-from collections import defaultdict
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import kopf
 
 import digi.util as util
@@ -29,6 +32,12 @@ if _mount_mode == "strict":
 elif _mount_mode == "intent_rec":
     TRIM_FROM_CHILD = set()
 
+# max number of children synced concurrently on a parent update
+SYNC_CONCURRENCY = int(os.environ.get("MOUNT_SYNC_CONCURRENCY", 16))
+# window (sec) over which the children's updates are merged into
+# a single parent update; <= 0 (default) writes each update immediately
+COALESCE_WINDOW = float(os.environ.get("MOUNT_COALESCE_WINDOW", 0))
+
 class Watch:
     def __init__(self, g, v, r, n, ns="default", *,
                  create_fn=None,
@@ -37,6 +46,7 @@ class Watch:
                  # TBD enable finalizer but avoid looping with multiple children
                  delete_fn=None, delete_optional=True,
                  field_fn=None, field="",
+                 when=None,
                  log_level=logging.INFO):
         self._registry = util.KopfRegistry()
         self._log_level = log_level
@@ -44,7 +54,8 @@ class Watch:
         _kwargs = {
             "registry": self._registry,
             # watch a specific model only
-            "when": lambda name, namespace, **_: name == n and namespace == ns,
+            "when": (lambda name, namespace, **_: name == n and namespace == ns)
+            if when is None else when,
         }
 
         @kopf.on.startup(registry=self._registry)
@@ -79,16 +90,51 @@ class Watch:
         return self
 
 
+class KindWatch(Watch):
+    """A single watch on the models of a kind that dispatches the
+    events of the models added to it to the handlers; models can be
+    added and removed without restarting the watch stream."""
+
+    def __init__(self, g, v, r, **kwargs):
+        # spaced names of the watched models
+        self._names = set()
+        super().__init__(g, v, r, n=None, ns=None,
+                         when=lambda name, namespace, **_:
+                         spaced_name(name, namespace) in self._names,
+                         **kwargs)
+
+    def add(self, n, ns="default"):
+        self._names.add(spaced_name(n, ns))
+        return self
+
+    def remove(self, n, ns="default"):
+        self._names.discard(spaced_name(n, ns))
+        return self
+
+    def names(self) -> set:
+        return set(self._names)
+
+    def __contains__(self, nsn_str):
+        return nsn_str in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+
 class Mounter:
     """Implements the mount semantics for a given (parent) digivice"""
 
     def __init__(self, g, v, r, n, ns="default",
-                 log_level=logging.INFO):
+                 log_level=logging.INFO,
+                 sync_concurrency=SYNC_CONCURRENCY,
+                 coalesce_window=COALESCE_WINDOW):
 
         """ children event handlers """
 
         def on_child_create(body, meta, name, *args, **kwargs):
             _g, _v, _r = util.gvr_from_body(body)
+            util.model_cache.update_from_body(_g, _v, _r, name,
+                                              meta["namespace"], body)
             self._logger.info(f"on create child {name} gen {meta['generation']}")
             _sync_from_parent(_g, _v, _r, meta=meta, name=name,
                               attrs_to_trim=TRIM_FROM_PARENT,
@@ -101,6 +147,7 @@ class Mounter:
                             *args, **kwargs):
             _g, _v, _r = util.gvr_from_body(body)
             _id = util.model_id(_g, _v, _r, name, namespace)
+            util.model_cache.update_from_body(_g, _v, _r, name, namespace, body)
 
             self._logger.info(f"on child {name} gen {meta['generation']}")
             if meta["generation"] == self._children_skip_gen.get(_id, -1):
@@ -115,18 +162,17 @@ class Mounter:
             _, _ = args, kwargs
 
             _g, _v, _r = util.gvr_from_body(body)
+            util.model_cache.invalidate(_g, _v, _r, name, namespace)
 
-            # remove watch
+            # remove from watch
             gvr_str = util.gvr(_g, _v, _r)
-            nsn_str = util.spaced_name(name, namespace)
-
-            w = self._children_watches.get(gvr_str, {}).get(nsn_str, None)
+            w = self._children_watches.get(gvr_str, None)
             if w is not None:
-                w.stop()
-                self._children_watches[gvr_str].pop(nsn_str, "")
+                w.remove(name, namespace)
 
             # will delete from parent
-            _sync_to_parent(_g, _v, _r, name, namespace, spec=None,
+            kwargs["spec"] = None
+            _sync_to_parent(_g, _v, _r, name, namespace,
                             *args, **kwargs)
 
         def _sync_from_parent(group, version, plural, name, namespace, meta,
@@ -156,12 +202,13 @@ class Mounter:
             _, resp, e = util.check_gen_and_patch_spec(
                 group, version, plural,
                 name, namespace,
-                patch, gen=meta["generation"]
+                patch, gen=meta["generation"],
+                minimal=True,
             )
 
             if e is not None:
                 self._logger.warning(f"unable to sync from parent to {name} due to {e}")
-            else:
+            elif resp is not None:
                 model_id = util.model_id(group, version, plural,
                                          name, namespace)
                 new_gen = resp["metadata"]["generation"]
@@ -172,79 +219,122 @@ class Mounter:
         def _sync_to_parent(group, version, plural, name, namespace, meta,
                             spec, diff, attrs_to_trim=None, *args, **kwargs):
             _, _ = args, kwargs
-
-            # propagation from child retries until succeed
+            update = {
+                "gvr_str": util.gvr(group, version, plural),
+                "name": name,
+                "namespace": namespace,
+                "gen": meta["generation"],
+                "spec": spec,
+                "diff": diff,
+                "attrs_to_trim": attrs_to_trim,
+            }
+            if self._coalesce_window <= 0:
+                return _flush_to_parent([update])
+
+            # buffered and written with the other children's
+            # updates in the current window; latest update wins
+            model_id = util.model_id(group, version, plural, name, namespace)
+            with self._parent_lock:
+                self._parent_updates[model_id] = update
+                self._parent_updated.set()
+
+        def _flush_to_parent(updates: list):
+            # propagation from children retries until succeed; the
+            # first attempt is based on the cached parent
+            cached, attempt = True, 0
             while True:
-                parent, prv, pgn = util.get_spec(g, v, r, n, ns)
-
-                # check if child exists
+                parent, prv, pgn = util.get_spec(g, v, r, n, ns, cached=cached)
                 mounts = parent.get("mount", {})
-                gvr_str = util.gvr(group, version, plural)
-                nsn_str = util.spaced_name(name, namespace)
 
-                if (gvr_str not in mounts or
-                        (nsn_str not in mounts[gvr_str] and
-                         name not in mounts[gvr_str])):
-                    self._logger.warning(f"unable to find the {nsn_str} or {name} in the {parent}")
-                    return
+                patch, up_to_date = dict(), list()
+                for u in updates:
+                    gvr_str, name, gen = u["gvr_str"], u["name"], u["gen"]
+                    nsn_str = util.spaced_name(name, u["namespace"])
+
+                    # check if child exists
+                    if (gvr_str not in mounts or
+                            (nsn_str not in mounts[gvr_str] and
+                             name not in mounts[gvr_str])):
+                        self._logger.warning(f"unable to find the {nsn_str} or {name} in the {parent}")
+                        continue
 
-                models = mounts[gvr_str]
-                n_ = name if name in models else nsn_str
+                    models = mounts[gvr_str]
+                    n_ = name if name in models else nsn_str
 
-                if spec is None:
-                    parent_patch = None  # will convert to json null
-                else:
+                    if u["spec"] is None:
+                        patch.setdefault(gvr_str, dict())[n_] = None  # will convert to json null
+                        continue
+
+                    attrs_to_trim = set(u["attrs_to_trim"] or set())
                     if models[n_].get("mode", "hide") == "hide":
-                        if attrs_to_trim is None:
-                            attrs_to_trim = set()
                         attrs_to_trim.add("mount")
 
                     # TBD rename to _gen_parent_spec
-                    parent_patch = _gen_parent_patch(spec, diff, attrs_to_trim)
-
-                # add roots
-                if parent_patch is None:
-                    # only child
-                    if len(mounts[gvr_str]) == 1:
-                        parent_patch = {
-                            "mount": {
-                                gvr_str: None
-                            }
-                        }
-                    else:
-                        parent_patch = {
-                            "mount": {
-                                gvr_str: {
-                                    n_: None
-                                }
-                            }
-                        }
-                else:
-                    parent_patch = {
-                        "mount": {
-                            gvr_str: {
-                                n_: {
-                                    "spec": parent_patch,
-                                    "generation": meta["generation"],
-                                }
-                            }
-                        }}
+                    child_patch = _gen_parent_patch(u["spec"], u["diff"], attrs_to_trim)
+                    # send only what differs from the parent's copy
+                    child_patch = util.merge_patch(models[n_].get("spec", {}),
+                                                   child_patch, prune=False)
+                    if len(child_patch) == 0 and \
+                            models[n_].get("generation", -1) == gen:
+                        up_to_date.append(name)
+                        continue
+
+                    patch.setdefault(gvr_str, dict())[n_] = {
+                        "spec": child_patch,
+                        "generation": gen,
+                    }
+
+                # drop the kinds whose children are all removed
+                for gvr_str, entries in patch.items():
+                    if all(e is None for e in entries.values()) and \
+                            len(entries) == len(mounts[gvr_str]):
+                        patch[gvr_str] = None
+
+                if len(patch) == 0:
+                    if cached and len(up_to_date) > 0:
+                        # confirm on the latest parent
+                        cached = False
+                        continue
+                    self._logger.info(f"children {up_to_date} are up to date in parent")
+                    return
 
                 # maybe rejected if parent has been updated;
                 # continue to try until succeed
-                resp, e = util.patch_spec(g, v, r, n, ns, parent_patch, rv=prv)
+                resp, e = util.patch_spec(g, v, r, n, ns, {"mount": patch}, rv=prv)
                 if e is not None:
                     if e.status == 409:
-                        self._logger.warning(f"unable to sync to parent from {name} due to conflict; retry")
+                        self._logger.warning(f"unable to sync {len(updates)} children "
+                                             f"to parent due to conflict; retry")
+                        cached = False
+                        time.sleep(util.backoff(attempt))
+                        attempt += 1
                     else:
-                        self._logger.error(f"failed to sync {name} to parent due to {e}; abort")
+                        self._logger.error(f"failed to sync {len(updates)} children "
+                                           f"to parent due to {e}; abort")
                         return
                 else:
                     new_gen = resp["metadata"]["generation"]
-                    self._logger.info(f"update child {name} generation to {meta['generation']}")
+                    self._logger.info(f"update children "
+                                      f"{[(u['name'], u['gen']) for u in updates]} "
+                                      f"in parent")
                     if pgn + 1 == new_gen:
                         self._parent_skip_gen = new_gen
-                    break
+                    return
+
+        def _flush_loop():
+            while not self._stop_flag.is_set():
+                if not self._parent_updated.wait(timeout=1):
+                    continue
+                # let the updates of other children accumulate
+                time.sleep(self._coalesce_window)
+                with self._parent_lock:
+                    updates = list(self._parent_updates.values())
+                    self._parent_updates.clear()
+                    self._parent_updated.clear()
+                try:
+                    _flush_to_parent(updates)
+                except Exception as e:
+                    self._logger.error(f"failed to sync children to parent: {e}")
 
         def _gen_parent_patch(child_spec, diff, attrs_to_trim=None):
             child_spec = dict(child_spec)
@@ -259,13 +349,15 @@ class Mounter:
 
         """ parent event handlers """
 
-        def on_parent_create(spec, diff, *args, **kwargs):
+        def on_parent_create(body, spec, diff, *args, **kwargs):
             _, _ = args, kwargs
+            util.model_cache.update_from_body(g, v, r, n, ns, body)
             _update_children_watches(spec.get("mount", {}))
             _sync_to_children(spec, diff)
 
-        def on_mount_attr_update(spec, meta, diff, *args, **kwargs):
+        def on_mount_attr_update(body, spec, meta, diff, *args, **kwargs):
             _, _ = args, kwargs
+            util.model_cache.update_from_body(g, v, r, n, ns, body)
 
             if meta["generation"] == self._parent_skip_gen:
                 self._logger.info(f"skipped parent gen {self._parent_skip_gen}")
@@ -308,42 +400,66 @@ class Mounter:
                 mounts = spec.get("mount", {})
 
         def _update_children_watches(mounts: dict):
-            # iterate over mounts and add/trim child event watches
-            # add watches
+            # iterate over mounts and add/trim children in the
+            # per-kind watches; a kind watch starts with its first
+            # child and stops after its last one is unmounted
             for gvr_str, models in mounts.items():
                 gvr = parse_gvr(gvr_str)  # child's gvr
 
+                w = self._children_watches.get(gvr_str, None)
+                new_watch = w is None
+                if new_watch:
+                    w = KindWatch(*gvr,
+                                  create_fn=on_child_create,
+                                  resume_fn=on_child_create,
+                                  update_fn=on_child_update,
+                                  delete_fn=on_child_delete,
+                                  log_level=log_level)
+                    self._children_watches[gvr_str] = w
+
                 for nsn_str, m in models.items():
                     nsn = parse_spaced_name(nsn_str)
                     # in case default ns is omitted in the model
                     nsn_str = spaced_name(*nsn)
 
-                    if gvr_str in self._children_watches and \
-                            nsn_str in self._children_watches[gvr_str]:
+                    if nsn_str in w:
                         continue
 
-                    # TBD: add child event handlers
                     self._logger.info(f"new watch for child {nsn_str}")
-                    self._children_watches[gvr_str][nsn_str] \
-                        = Watch(*gvr, *nsn,
-                                create_fn=on_child_create,
-                                resume_fn=on_child_create,
-                                update_fn=on_child_update,
-                                delete_fn=on_child_delete,
-                                log_level=log_level).start()
-
-            # trim watches no longer needed
-            for gvr_str, model_watches in self._children_watches.items():
-                mw_to_delete = set()
-                for nsn_str, w in model_watches.items():
-                    models = mounts.get(gvr_str, {})
+                    w.add(*nsn)
+                    # the running stream has seen the child already
+                    # so the initial sync is done here
+                    if not new_watch:
+                        _sync_new_child(gvr, *nsn)
+
+                if new_watch:
+                    w.start()
+                    self._logger.info(f"started watch for {gvr_str}")
+
+            # trim children no longer mounted
+            for gvr_str, w in list(self._children_watches.items()):
+                models = mounts.get(gvr_str, {})
+                for nsn_str in w.names():
                     if nsn_str not in models and \
                             util.trim_default_space(nsn_str) not in models:
-                        w.stop()
-                        mw_to_delete.add(nsn_str)
+                        w.remove(*parse_spaced_name(nsn_str))
+
+                if len(w) == 0:
+                    w.stop()
+                    self._children_watches.pop(gvr_str, None)
+                    self._logger.info(f"stopped watch for {gvr_str}")
 
-                for d in mw_to_delete:
-                    model_watches.pop(d, None)
+        def _sync_new_child(gvr, name, namespace):
+            body = util.get_model(*gvr, name, namespace)
+            if body is None:
+                # synced by the create event if it comes later
+                return
+            on_child_create(body=body,
+                            meta=body["metadata"],
+                            name=name,
+                            namespace=namespace,
+                            spec=body.get("spec", {}),
+                            diff=())
 
         def _gen_child_patch(parent_spec, gvr_str, nsn_str):
             mount_entry = parent_spec \
@@ -395,20 +511,30 @@ class Mounter:
                         if cs is not None:
                             to_sync[model_id] = cs, gen
 
-            # push to children models
+            # push to children models concurrently
             # TBD: transactional update
-            for model_id, (cs, gen) in to_sync.items():
-                cur_gen, resp, e = util.check_gen_and_patch_spec(
-                    *util.parse_model_id(model_id),
-                    spec=cs,
-                    gen=max(gen, self._children_gen.get(model_id, -1)))
-                if e is not None:
-                    self._logger.warning(f"unable to sync to child {model_id} due to {e}")
-                else:
-                    new_gen = resp["metadata"]["generation"]
-                    self._children_gen[model_id] = new_gen
-                    if cur_gen + 1 == new_gen:
-                        self._children_skip_gen[model_id] = new_gen
+            start = time.time()
+            latencies = list(self._sync_pool.map(
+                lambda x: _sync_to_child(x[0], *x[1]), to_sync.items()))
+            if len(latencies) > 0:
+                self._record_fanout(time.time() - start, latencies)
+
+        def _sync_to_child(model_id, cs, gen) -> float:
+            start = time.time()
+            # conflicts are retried per child
+            cur_gen, resp, e = util.check_gen_and_patch_spec(
+                *util.parse_model_id(model_id),
+                spec=cs,
+                gen=max(gen, self._children_gen.get(model_id, -1)),
+                minimal=True)
+            if e is not None:
+                self._logger.warning(f"unable to sync to child {model_id} due to {e}")
+            elif resp is not None:
+                new_gen = resp["metadata"]["generation"]
+                self._children_gen[model_id] = new_gen
+                if cur_gen + 1 == new_gen:
+                    self._children_skip_gen[model_id] = new_gen
+            return time.time() - start
 
         # subscribe to the events of the parent model
         self._parent_watch = Watch(g, v, r, n, ns,
@@ -419,8 +545,8 @@ class Mounter:
                                    log_level=log_level)
 
         # subscribe to the events of the child models;
-        # keyed by the gvr and then spaced name
-        self._children_watches = defaultdict(dict)
+        # one watch per kind keyed by the gvr
+        self._children_watches = dict()
 
         # last handled generation of a child, keyed by model_id;
         # used when update the children because the parent's copy
@@ -431,21 +557,54 @@ class Mounter:
         self._children_skip_gen = dict()
         self._parent_skip_gen = -1
 
+        # bounded pool for the parent-to-children fan-out and
+        # the latencies (sec) of the recent fan-outs and children
+        self._sync_pool = ThreadPoolExecutor(max_workers=max(1, sync_concurrency),
+                                             thread_name_prefix="mount-sync")
+        self._fanout_latency = deque(maxlen=1024)
+        self._child_latency = deque(maxlen=1024)
+
+        # children's updates pending to be written to the
+        # parent, keyed by the child's model_id
+        self._coalesce_window = coalesce_window
+        self._parent_updates = dict()
+        self._parent_lock = threading.Lock()
+        self._parent_updated = threading.Event()
+        self._parent_flusher = threading.Thread(target=_flush_loop, daemon=True)
+        self._stop_flag = threading.Event()
+
         # mounter logging
         self._logger = logging.getLogger(__name__)
         self._logger.setLevel(log_level)
 
     def start(self):
+        if self._coalesce_window > 0:
+            self._parent_flusher.start()
         self._parent_watch.start()
         self._logger.info("started the mounter")
 
     def stop(self):
+        self._stop_flag.set()
         self._parent_watch.stop()
-        for _, mws in self._children_watches.items():
-            for _, w in mws.items():
-                w.stop()
+        for _, w in self._children_watches.items():
+            w.stop()
+        self._sync_pool.shutdown(wait=False)
         return self
 
+    def _record_fanout(self, latency: float, child_latencies: list):
+        self._fanout_latency.append(latency)
+        self._child_latency.extend(child_latencies)
+        self._logger.info(f"synced {len(child_latencies)} children in {latency:.3f}s; "
+                          f"max child latency {max(child_latencies):.3f}s")
+
+    def fanout_stats(self) -> dict:
+        """Latency distribution (sec) of the recent parent-to-children
+        fan-outs and of the individual child syncs."""
+        return {
+            "fanout": util.latency_summary(self._fanout_latency),
+            "child": util.latency_summary(self._child_latency),
+        }
+
 
 def test():
     gvr = ("mock.digi.dev", "v1", "samples")
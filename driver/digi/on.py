@@ -4,7 +4,7 @@ from collections import OrderedDict
 
 import digi
 import digi.util as util
-from digi.reconcile import rc
+from digi.reconcile import rc, safe_lookup, get_back_prop
 
 """Filters."""
 
@@ -145,7 +145,7 @@ def model(*args, **kwargs):
     return decorator
 
 
-def register(fn, path=".", prio=0, cond=digi.filter.changed):
+def register(fn, path=".", prio=0, cond=digi.filter.changed, timeout=None):
     # preprocess the path str -> tuple of str
     _path = list()
     ps = path.split(".")
@@ -181,6 +181,33 @@ def register(fn, path=".", prio=0, cond=digi.filter.changed):
     # TBD: join multiple path to allow multiple decorators per handler
     _path = tuple(_path)
 
+    rc.add(handler=adapter(fn, _path, child_typ),
+           priority=prio,
+           condition=cond,
+           path=_path,
+           timeout=timeout)
+
+
+# argument expressions of the handler adapters, evaluated
+# only for the arguments a handler declares
+_arg_exprs = {
+    "subview": "safe_lookup(proc_view, path)",
+    "proc_view": "proc_view",
+    "view": "view",
+    "old_view": "old_view",
+    "mount": "proc_view.get('mount', {})",
+    "obs": "proc_view.get('obs', {})",
+    "back_prop": "get_back_prop(diff)",
+    "diff": "diff",
+    "meta": "proc_view.get('meta', {})",
+    "typ": "typ",
+}
+
+
+def adapter(fn, path=(".",), typ=None):
+    """Generate the function the reconciler calls as
+    adapter(proc_view, view, old_view, diff) to invoke the
+    handler fn with the arguments its signature asks for."""
     sig = inspect.signature(fn)
 
     # allow the handler declaration to omit arguments
@@ -243,6 +270,8 @@ def register(fn, path=".", prio=0, cond=digi.filter.changed):
     for i, (k, v) in enumerate(args.items()):
         if v is None:
             continue
+        if v.kind in {v.VAR_POSITIONAL, v.VAR_KEYWORD}:
+            break
         if i == 0:
             kwarg_filter["subview"] = k
         elif i == 1:
@@ -264,29 +293,26 @@ def register(fn, path=".", prio=0, cond=digi.filter.changed):
         else:
             break
 
-    def wrapper_fn(subview, proc_view, view,
-                   old_view, mount, obs, back_prop,
-                   diff, meta):
-        kwargs = dict()
-        for _k, _v in [("subview", subview),
-                       ("proc_view", proc_view),
-                       ("view", view),
-                       ("old_view", old_view),
-                       ("mount", mount),
-                       ("obs", obs),
-                       ("back_prop", back_prop),
-                       ("diff", diff),
-                       ("meta", meta),
-                       ("typ", child_typ),
-                       ]:
-            if _k in kwarg_filter:
-                kwargs[kwarg_filter[_k]] = _v
-        fn(**kwargs)
-
-    rc.add(handler=wrapper_fn,
-           priority=prio,
-           condition=cond,
-           path=_path)
+    call = ", ".join(f"{param}={_arg_exprs[arg]}"
+                     for arg, param in kwarg_filter.items())
+    # async handlers are run concurrently with the other
+    # async handlers of the same priority
+    if inspect.iscoroutinefunction(fn):
+        src = f"async def adapter(proc_view, view, old_view, diff):\n" \
+              f"    await fn({call})\n"
+    else:
+        src = f"def adapter(proc_view, view, old_view, diff):\n" \
+              f"    fn({call})\n"
+
+    namespace = {
+        "fn": fn, "path": path, "typ": typ,
+        "safe_lookup": safe_lookup,
+        "get_back_prop": get_back_prop,
+    }
+    exec(compile(src, f"<adapter {fn.__name__}>", "exec"), namespace)
+    _adapter = namespace["adapter"]
+    _adapter.__name__ = fn.__name__
+    return _adapter
 
 
 def mount_change(diff, gvr=None) -> bool:
@@ -306,9 +332,8 @@ def mount_change(diff, gvr=None) -> bool:
 
 
 def pool(*args, **kwargs):
-    # TBD load max_ts on restart; the max_ts should be stored
-    #   at a persistent location and written atomically, e.g.,
-    #   the digi.model or digi.pool
+    # the max_ts of the watch is checkpointed across restarts
+    #   if SYNC_CHECKPOINT_DIR is set to a persistent location
 
     class DelayedWatch:
         def __init__(self, fn, *args, **kwargs):
@@ -3,7 +3,6 @@
 # import pyjq
 import time
 from digi import logger
-from digi.view import ModelView
 
 
 def jq(policy: str):
@@ -19,6 +18,8 @@ def jq(policy: str):
     #
     # logger.info(f"processor: jq running policy {policy}")
     #
+    # from digi.view import ModelView
+    #
     # def fn(proc_view, *args, **kwargs):
     #     _, _ = args, kwargs
     #     with ModelView(proc_view) as mv:
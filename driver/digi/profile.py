@@ -0,0 +1,180 @@
+"""Reconcile instrumentation
+
+Records the call count and the wall and CPU time of handlers,
+handler conditions and the stages of a reconcile (e.g., get,
+patch, conflict retries) as histograms; async handlers get the
+wall time only. The stats are served by
+an in-process HTTP endpoint in Prometheus text (/metrics) and
+JSON (/stats) format. When disabled, timing a section costs a
+flag check.
+"""
+
+import json
+import time
+import threading
+from collections import defaultdict, deque
+
+import digi
+
+# upper bounds (sec) of the histogram buckets
+buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, float("inf"))
+
+
+class Histogram:
+    def __init__(self, window: int = 256):
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        # recent values for the percentiles of the summary
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        for i, b in enumerate(buckets):
+            if value <= b:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.recent.append(value)
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+class _Timer:
+    __slots__ = ("_profiler", "_kind", "_name", "_wall", "_cpu", "_with_cpu")
+
+    def __init__(self, profiler, kind, name, cpu=True):
+        self._profiler, self._kind, self._name = profiler, kind, name
+        self._with_cpu = cpu
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time() if self._with_cpu else None
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self._profiler.observe(self._kind, self._name,
+                               time.perf_counter() - self._wall,
+                               None if self._cpu is None
+                               else time.thread_time() - self._cpu)
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        pass
+
+
+_no_timer = _NoTimer()
+
+
+class Profiler:
+    """Wall and CPU time histograms keyed by (kind, name), where
+    kind is one of handler, condition or stage."""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        # (kind, name) -> (wall histogram, cpu histogram)
+        self._stats = defaultdict(lambda: (Histogram(), Histogram()))
+        self._lock = threading.Lock()
+        self._server = None
+
+    def time(self, kind: str, name: str, cpu: bool = True):
+        """Return a context manager that times its block. If cpu is
+        not set, only the wall time is recorded, e.g., for a block that
+        awaits, as the CPU time of the thread would include whatever
+        else runs on it meanwhile."""
+        if not self.enabled:
+            return _no_timer
+        return _Timer(self, kind, name, cpu)
+
+    def stage(self, name: str):
+        return self.time("stage", name)
+
+    def count(self, kind: str, name: str):
+        """Record an event without duration, e.g., a retry."""
+        if self.enabled:
+            self.observe(kind, name, 0, 0)
+
+    def observe(self, kind: str, name: str, wall: float, cpu: float = None):
+        with self._lock:
+            w, c = self._stats[(kind, name)]
+            w.observe(wall)
+            if cpu is not None:
+                c.observe(cpu)
+
+    def summary(self) -> dict:
+        """Count and wall time percentiles (ms) of the recent calls."""
+        import digi.util as util
+
+        with self._lock:
+            stats = {k: (w.count, list(w.recent), c.count, c.sum)
+                     for k, (w, c) in self._stats.items()}
+        result = defaultdict(dict)
+        for (kind, name), (count, recent, cpu_count, cpu) in stats.items():
+            s = util.latency_summary(recent)
+            result[kind][name] = {
+                "count": count,
+                "p50_ms": round(s["p50"] * 1e3, 3),
+                "p99_ms": round(s["p99"] * 1e3, 3),
+            }
+            # wall time only, e.g., for async handlers
+            if cpu_count > 0:
+                result[kind][name]["cpu_ms"] = round(cpu / cpu_count * 1e3, 3)
+        return dict(result)
+
+    def prometheus(self) -> str:
+        lines = list()
+        with self._lock:
+            for (kind, name), hists in sorted(self._stats.items()):
+                for clock, h in zip(["wall", "cpu"], hists):
+                    if h.count == 0:
+                        continue
+                    metric = f"digi_{kind}_{clock}_seconds"
+                    label = f'name="{name}"'
+                    cum = 0
+                    for b, c in zip(buckets, h.counts):
+                        cum += c
+                        le = "+Inf" if b == float("inf") else b
+                        lines.append(f'{metric}_bucket{{{label},le="{le}"}} {cum}')
+                    lines.append(f"{metric}_sum{{{label}}} {h.sum}")
+                    lines.append(f"{metric}_count{{{label}}} {cum}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def serve(self, port: int):
+        """Serve the stats over HTTP from a daemon thread."""
+        import http.server
+
+        profiler = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, typ = profiler.prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/stats":
+                    body, typ = json.dumps(profiler.summary()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", typ)
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("", port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        digi.logger.info(f"serving profile at :{port}/metrics")
+
+
+profiler = Profiler(enabled=digi.enable_profile)
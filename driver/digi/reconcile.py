@@ -1,5 +1,10 @@
 import copy
+import time
 import typing
+import asyncio
+import inspect
+import itertools
+import threading
 import traceback
 from collections import OrderedDict
 
@@ -7,6 +12,7 @@ import digi
 import digi.util as util
 import digi.filter as filter_
 import digi.processor as processor
+from digi.profile import profiler
 
 
 class HandlerType:
@@ -16,13 +22,15 @@ class HandlerType:
 
 class __Reconciler:
     def __init__(self):
-        # handlers are stored as tuples (fn, condition, path, priority)
-        # the higher the priority value, the higher the priority;
+        # handlers are stored as tuples (fn, condition, path, priority,
+        # timeout); the higher the priority value, the higher the priority;
         # default priority is 0; low priority handlers are run first;
         # priority lower than 0 is skipped.
         # - condition: a function that decides whether the handler
         #   should be run or not.
         # - path: the attribute subtree the handler subscribes to
+        # - timeout: sec an async handler may run before it is
+        #   cancelled; None for the default digi.handler_timeout
 
         # sorted list of handlers in execution order
         self.handlers = list()
@@ -39,6 +47,9 @@ class __Reconciler:
         self._skip = True
         self.last_seen_gen = -1
         self.count = 0
+        # size of the spec patches sent by the reconciler
+        self.patch_bytes = 0
+        self.last_patch_bytes = 0
 
         # handler info (e.g., priority) are used to
         # generate the self.handlers upon handler updates;
@@ -58,43 +69,105 @@ class __Reconciler:
 
         self._data_watches = dict()
 
+        # event loop of the async handlers, run in a daemon thread
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
     def run(self, spec, old, diff, *args, **kwargs):
         spec = dict(spec)
         proc_spec = dict(spec)
 
         self._view = proc_spec
-        self._update_handler_info(spec, diff)
-        self._compile_handler()
-
-        for fn, cond, path, _ in self.handlers:
-            if cond(proc_spec, diff, path, *args, **kwargs) \
-                    or id(fn) in self._pending_handler:
-                # handler edits the spec object
-                try:
-                    # TBD allow subview to be a forest
-                    fn(
-                        subview=safe_lookup(proc_spec, path),
-                        proc_view=proc_spec,
-                        view=spec, old_view=old,
-                        mount=proc_spec.get("mount", {}),
-                        obs=proc_spec.get("obs", {}),
-                        back_prop=get_back_prop(diff),
-                        diff=diff,
-                        meta=proc_spec.get("meta", {}),
-                    )
-                    self._pending_handler.add(id(fn))
-                except Exception as e:
-                    self._logger.error(f"reconcile error: {e}")
-                    self._logger.error(traceback.format_exc())
-                    # TBD: expose driver status on model, e.g., obs.reason/or some debug attribute
-                    return proc_spec
+        with profiler.stage("compile"):
+            self._update_handler_info(spec, diff)
+            self._compile_handler()
+
+            # build the changed-path index once; it is
+            # shared by the conditions of all handlers
+            filter_.change_index(diff)
+
+        # handlers of the same priority form a group; the async
+        # handlers of a group run concurrently once its sync
+        # handlers are done, and a group starts only after the
+        # previous one has finished
+        for _, group in itertools.groupby(self.handlers, key=lambda h: h[3]):
+            to_run = list()
+            for fn, cond, path, _, timeout in group:
+                with profiler.time("condition", fn.__name__):
+                    if cond(proc_spec, diff, path, *args, **kwargs) \
+                            or id(fn) in self._pending_handler:
+                        to_run.append((fn, timeout))
+            if not self._run_group(to_run, proc_spec, spec, old, diff):
+                # TBD: expose driver status on model, e.g., obs.reason/or some debug attribute
+                return proc_spec
         return proc_spec
 
+    def _run_group(self, handlers, proc_spec, spec, old, diff) -> bool:
+        """Run the handlers of a group and return whether all succeeded."""
+        async_handlers = list()
+        for fn, timeout in handlers:
+            if inspect.iscoroutinefunction(fn):
+                async_handlers.append((fn, timeout))
+                continue
+            # handler edits the spec object
+            try:
+                with profiler.time("handler", fn.__name__):
+                    fn(proc_spec, spec, old, diff)
+                self._pending_handler.add(id(fn))
+            except Exception as e:
+                self._logger.error(f"reconcile error: {e}")
+                self._logger.error(traceback.format_exc())
+                return False
+
+        if len(async_handlers) == 0:
+            return True
+
+        # the handlers share the loop's thread so their
+        # edits interleave only at await points
+        coros = [self._run_async(fn, timeout, (proc_spec, spec, old, diff))
+                 for fn, timeout in async_handlers]
+        results = asyncio.run_coroutine_threadsafe(
+            _gather(coros), self._event_loop()).result()
+
+        ok = True
+        for (fn, timeout), e in zip(async_handlers, results):
+            if e is None:
+                self._pending_handler.add(id(fn))
+            elif isinstance(e, asyncio.TimeoutError):
+                self._logger.error(f"reconcile error: handler {fn.__name__} "
+                                   f"timed out after {timeout}s")
+                ok = False
+            else:
+                self._logger.error(f"reconcile error: {e}")
+                self._logger.error("".join(traceback.format_exception(
+                    type(e), e, e.__traceback__)))
+                ok = False
+        return ok
+
+    @staticmethod
+    async def _run_async(fn, timeout, args):
+        if timeout is None:
+            timeout = digi.handler_timeout
+        # other handlers run on the loop's thread meanwhile,
+        # so only the wall time is recorded
+        with profiler.time("handler", fn.__name__, cpu=False):
+            await asyncio.wait_for(fn(*args),
+                                   timeout if timeout >= 0 else None)
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever,
+                                 daemon=True).start()
+            return self._loop
+
     def add(self, handler: typing.Callable,
             condition: typing.Callable,
             priority: int,
             path: tuple = (),
-            typ=HandlerType.BUILTIN):
+            typ=HandlerType.BUILTIN,
+            timeout: float = None):
 
         n = handler.__name__
 
@@ -108,6 +181,7 @@ class __Reconciler:
             "view_path": path,
             "priority": priority,
             "type": typ,
+            "timeout": timeout,
         }
 
     def _update_handler_info(self, spec, diff):
@@ -137,6 +211,7 @@ class __Reconciler:
                     "view_path": ".",
                     "priority": 0,
                     "type": HandlerType.REFLEX,
+                    "timeout": None,
                 })
 
                 patch = dict()
@@ -176,7 +251,8 @@ class __Reconciler:
             if hi["priority"] < 0:
                 continue
             self.handlers.append((hi["fn"], hi["condition"],
-                                  hi["view_path"], hi["priority"]))
+                                  hi["view_path"], hi["priority"],
+                                  hi["timeout"]))
 
         # sort by priority
         self.handlers = sorted(self.handlers, key=lambda x: x[3])
@@ -185,6 +261,10 @@ class __Reconciler:
     def view(self):
         return copy.deepcopy(self._view)
 
+    def add_patch_bytes(self, n: int):
+        self.last_patch_bytes = n
+        self.patch_bytes += n
+
     def clear_pending(self):
         self._pending_handler.clear()
 
@@ -212,6 +292,54 @@ class __Reconciler:
         return skip
 
 
+class Coalescer:
+    """Coalesces bursts of generations so that only the latest one
+    of a burst is reconciled.
+
+    A generation is taken as part of a burst if it arrives within
+    quiet sec of the previous one or if the previous reconciliation
+    was outdated by a newer generation. The coalescer then polls the
+    model until no newer generation shows up for quiet sec, or for
+    at most window sec, and returns the latest model. Isolated
+    updates are reconciled without delay.
+    """
+
+    def __init__(self, fetch: typing.Callable,
+                 window: float = 0.2, quiet: float = 0.05):
+        # fetch() returns the current model or None
+        self.fetch = fetch
+        self.window = window
+        self.quiet = quiet
+        self.count = 0
+        self._last_arrival = 0
+        self._outdated = False
+
+    def outdated(self):
+        """Mark the last reconciliation as outdated."""
+        self._outdated = True
+
+    def latest(self, gen: int) -> typing.Optional[dict]:
+        """Return the latest model if newer than gen."""
+        now = time.time()
+        burst = self._outdated or now - self._last_arrival < self.quiet
+        self._last_arrival, self._outdated = now, False
+        if self.window <= 0 or not burst:
+            return None
+
+        deadline = now + self.window
+        model, latest_gen = None, gen
+        while time.time() < deadline:
+            time.sleep(max(min(self.quiet, deadline - time.time()), 0))
+            m = self.fetch()
+            if m is None or m["metadata"]["generation"] <= latest_gen:
+                break
+            model, latest_gen = m, m["metadata"]["generation"]
+
+        if model is not None:
+            self.count += latest_gen - gen
+        return model
+
+
 def safe_lookup(d: dict, path: tuple):
     if path == (".",):
         return d
@@ -221,11 +349,27 @@ def safe_lookup(d: dict, path: tuple):
     return d
 
 
+async def _gather(coros) -> list:
+    """Run the coroutines concurrently and return their
+    exceptions, or None for those that succeeded."""
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    return [r if isinstance(r, BaseException) else None for r in results]
+
+
 def do_nothing(*args, **kwargs):
     _, _ = args, kwargs
 
 
+# back-propagated changes of the most recent diff; they
+# are computed once for the handlers that ask for them
+_last_diff, _last_back_prop = None, None
+
+
 def get_back_prop(diff):
+    global _last_diff, _last_back_prop
+    if diff is _last_diff:
+        return _last_back_prop
+
     bp = list()
     for op, path, old, new in diff:
         if op != "change" and op != "add":
@@ -238,6 +382,7 @@ def get_back_prop(diff):
         if "intent" not in fs and "input" not in fs:
             continue
         bp.append((op, path, old, new))
+    _last_diff, _last_back_prop = diff, bp
     return bp
 
 
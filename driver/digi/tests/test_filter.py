@@ -0,0 +1,40 @@
+from digi.filter import path_changed, change_index
+
+model = {
+    "spec": {
+        "control": {"power": {"intent": "on"}},
+        "mount": {"digi.dev/v1/lamps": {"default/l1": {"spec": {}}}},
+    }
+}
+
+
+def test_update():
+    diff = [("change", ("spec", "control", "power", "intent"), "off", "on")]
+    assert path_changed(diff, (".",))
+    assert path_changed(diff, ("control",))
+    assert path_changed(diff, ("control", "power", "intent"))
+    assert not path_changed(diff, ("control", "power", "intent", "x"))
+    assert not path_changed(diff, ("mount",))
+    assert not path_changed(diff, ("meta",))
+
+
+def test_create():
+    diff = [("add", (), None, model)]
+    assert path_changed(diff, ("control", "power"))
+    assert path_changed(diff, ("mount", "digi.dev/v1/lamps"))
+    assert not path_changed(diff, ("mount", "digi.dev/v1/rooms"))
+    assert not path_changed(diff, ("meta",))
+
+
+def test_empty_and_shared():
+    assert path_changed([], ("meta",))
+
+    diff = [("add", ("spec", "meta", "gen_interval"), None, 1)]
+    assert change_index(diff) is change_index(diff)
+    assert path_changed(diff, ("meta",))
+
+
+if __name__ == '__main__':
+    test_update()
+    test_create()
+    test_empty_and_shared()
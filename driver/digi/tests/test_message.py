@@ -0,0 +1,92 @@
+import json
+import time
+
+import digi
+from digi.data.pool import ZedPool
+from digi.message.mqtt import Ingest
+
+
+class _Msg:
+    def __init__(self, payload, qos=0, mid=0):
+        self.payload, self.qos, self.mid, self.topic = payload, qos, mid, "t"
+
+
+class _Client:
+    def __init__(self):
+        self.acks = list()
+
+    def ack(self, mid, qos):
+        self.acks.append(mid)
+
+
+def test_ingest():
+    loads = list()
+    ingest = Ingest(loads.append, queue_size=3, batch_size=2, batch_age=0.05)
+    for i in range(4):
+        ingest.put(_Msg(json.dumps({"i": i}).encode()))
+    ingest.put(_Msg(b"not json"))
+    # the queue is full until the loader runs
+    assert ingest.stats()["dropped"] == 2
+
+    ingest.start()
+    ingest.stop()
+    assert loads == [[{"i": 0}, {"i": 1}], [{"i": 2}]]
+    assert ingest.stats() == {"received": 5, "dropped": 2, "invalid": 0,
+                              "loaded": 3, "failed": 0, "queued": 0}
+
+
+def test_ingest_ack():
+    def load(records):
+        if records[0]["i"] == 1:
+            raise Exception("lake unavailable")
+
+    ingest = Ingest(load, manual_ack=True, batch_size=1, batch_age=0.05)
+    ingest.client = _Client()
+    for i in range(3):
+        ingest.put(_Msg(json.dumps({"i": i}).encode(), qos=1, mid=i))
+    ingest.start()
+    time.sleep(0.2)
+    ingest.stop()
+    # messages of a failed load are left for redelivery
+    assert ingest.client.acks == [0, 2]
+    assert ingest.stats()["failed"] == 1
+
+
+class _Lake:
+    def __init__(self):
+        self.loads = list()
+        self.fail = False
+
+    def load(self, pool, data, **kwargs):
+        if self.fail:
+            raise ConnectionError("lake unavailable")
+        self.loads.append(data)
+
+
+def test_ingest_pool():
+    # through the pool's load path, with write-behind on
+    pool = ZedPool("t1", write_behind=True, batch_age=10, snapshot_async=False)
+    pool.client = lake = _Lake()
+    _pool, digi.pool = digi.pool, pool
+    try:
+        ingest = Ingest(manual_ack=True, batch_size=1, batch_age=0.05)
+        ingest.client = _Client()
+        ingest.put(_Msg(json.dumps({"i": 0}).encode(), qos=1, mid=0))
+        ingest._load([ingest._queue.get()])
+        # committed, not buffered, before the ack
+        assert len(lake.loads) == 1 and ingest.client.acks == [0]
+
+        lake.fail = True
+        ingest.put(_Msg(json.dumps({"i": 1}).encode(), qos=1, mid=1))
+        ingest._load([ingest._queue.get()])
+        assert ingest.client.acks == [0]
+        assert ingest.stats()["loaded"] == 1 and ingest.stats()["failed"] == 1
+    finally:
+        digi.pool = _pool
+        pool.close()
+
+
+if __name__ == '__main__':
+    test_ingest()
+    test_ingest_ack()
+    test_ingest_pool()
@@ -0,0 +1,258 @@
+import copy
+import threading
+import time
+
+from kubernetes.client.rest import ApiException
+
+from digi import mount, util
+
+PARENT = ("mock.digi.dev", "v1", "rooms", "room", "default")
+CHILD = "mock.digi.dev/v1/lamps"
+
+
+class _Parent:
+    """Stands in for the parent model on the apiserver; util.get_spec
+    and util.patch_spec are pointed at it."""
+
+    def __init__(self, mounts, conflicts=0):
+        self.spec = {"mount": mounts}
+        self.rv, self.gen = 1, 1
+        self.conflicts = conflicts
+        self.patches, self.reads = list(), list()
+        self.lock = threading.Lock()
+
+    def get_spec(self, g, v, r, n, ns, cached=False):
+        with self.lock:
+            self.reads.append(cached)
+            return copy.deepcopy(self.spec), str(self.rv), self.gen
+
+    def patch_spec(self, g, v, r, n, ns, spec, rv=None):
+        with self.lock:
+            if self.conflicts > 0 or rv != str(self.rv):
+                self.conflicts = max(0, self.conflicts - 1)
+                return None, ApiException(status=409)
+            self.patches.append(copy.deepcopy(spec))
+            util.apply_merge_patch(self.spec, copy.deepcopy(spec))
+            self.rv, self.gen = self.rv + 1, self.gen + 1
+            return {"metadata": {"generation": self.gen}}, None
+
+
+class _Operator:
+    """Records the handlers of the watches started in place
+    of running them; util.run_operator is pointed at it."""
+
+    def __init__(self):
+        self.watches, self.filters, self.stops = list(), list(), list()
+
+    def run(self, registry, **kwargs):
+        _ = kwargs
+        handlers = registry._changing.get_all_handlers()
+        self.watches.append({h.fn.__name__: h.fn for h in handlers})
+        self.filters.append(handlers[0].when)
+        self.stops.append(threading.Event())
+        return threading.Event(), self.stops[-1]
+
+
+def _stub(**fns):
+    saved = {k: getattr(util, k) for k in fns}
+    for k, fn in fns.items():
+        setattr(util, k, fn)
+    return saved
+
+
+def _mounts(*names):
+    return {CHILD: {f"default/{n}": {"spec": {"power": "off"},
+                                     "generation": 1,
+                                     "status": "active"}
+                    for n in names}}
+
+
+def _start(p, op=None, **kwargs):
+    """Start a mounter on the parent and return it with the
+    handlers of its children's watch."""
+    op = _Operator() if op is None else op
+    saved = _stub(run_operator=op.run,
+                  get_spec=p.get_spec, patch_spec=p.patch_spec,
+                  check_gen_and_patch_spec=lambda *_, **__: (1, None, None),
+                  backoff=lambda attempt: 0)
+    m = mount.Mounter(*PARENT, **kwargs)
+    m.start()
+    op.watches[0]["on_parent_create"](body={"metadata": {}},
+                                      spec=copy.deepcopy(p.spec), diff=())
+    return m, op.watches[1], saved
+
+
+def _event(name, gen, spec):
+    return {
+        "body": {"apiVersion": "mock.digi.dev/v1", "kind": "Lamp",
+                 "metadata": {"generation": gen}},
+        "meta": {"generation": gen, "namespace": "default"},
+        "name": name, "namespace": "default",
+        "spec": spec, "diff": (),
+    }
+
+
+def _wait(cond, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline and not cond():
+        time.sleep(0.01)
+
+
+def test_merged_deletes():
+    p = _Parent(_mounts("l1", "l2", "l3"))
+    m, child, saved = _start(p, coalesce_window=0.1)
+    try:
+        for n in ["l1", "l2"]:
+            child["on_child_delete"](**_event(n, 2, None))
+        _wait(lambda: len(p.patches) > 0)
+        time.sleep(0.2)
+
+        # both deletes go out in a single patch
+        assert p.patches == [{"mount": {CHILD: {"default/l1": None,
+                                                "default/l2": None}}}]
+        assert list(p.spec["mount"][CHILD]) == ["default/l3"]
+
+        # the kind is dropped once its last child is removed
+        child["on_child_delete"](**_event("l3", 2, None))
+        _wait(lambda: len(p.patches) > 1)
+        assert p.patches[-1] == {"mount": {CHILD: None}}
+        assert CHILD not in p.spec["mount"]
+    finally:
+        m.stop()
+        _stub(**saved)
+
+
+def test_conflict_retry():
+    p = _Parent(_mounts("l1"), conflicts=2)
+    # updates are written immediately by default
+    m, child, saved = _start(p)
+    try:
+        child["on_child_update"](**_event("l1", 2, {"power": "on"}))
+
+        # first read is cached; retries go to the latest parent
+        assert p.reads == [True, False, False]
+        assert p.patches == [{"mount": {CHILD: {"default/l1": {
+            "spec": {"power": "on"}, "generation": 2}}}}]
+        assert p.conflicts == 0
+    finally:
+        m.stop()
+        _stub(**saved)
+
+
+def test_concurrent_flush():
+    names = [f"l{i}" for i in range(8)]
+    p = _Parent(_mounts(*names))
+    m, child, saved = _start(p, coalesce_window=0.02)
+    try:
+        def _run(n):
+            for gen in range(2, 12):
+                child["on_child_update"](**_event(n, gen, {"power": "on",
+                                                           "level": gen}))
+                time.sleep(0.005)
+
+        ts = [threading.Thread(target=_run, args=(n,)) for n in names]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+
+        def _synced():
+            with p.lock:
+                models = p.spec["mount"][CHILD]
+                return all(models[f"default/{n}"]["generation"] == 11
+                           for n in names)
+
+        _wait(_synced)
+
+        # the latest update of every child lands in the parent
+        # with fewer writes than updates
+        for n in names:
+            assert p.spec["mount"][CHILD][f"default/{n}"]["spec"] == \
+                   {"power": "on", "level": 11}
+        assert 0 < len(p.patches) < len(names) * 10
+    finally:
+        m.stop()
+        _stub(**saved)
+
+
+def test_kind_watch():
+    p = _Parent(_mounts("l1", "l2"))
+    op = _Operator()
+    m, _, saved = _start(p, op=op)
+    saved.update(_stub(get_model=lambda *_, **__: None))
+    try:
+        parent, when = op.watches[0], op.filters[1]
+
+        def _mount(mounts, gen):
+            parent["on_mount_attr_update"](
+                body={"metadata": {}}, spec={"mount": mounts},
+                meta={"generation": gen, "resourceVersion": str(p.rv)}, diff=())
+
+        # one watch serves all the children of a kind
+        assert len(op.watches) == 2
+        assert when(name="l1", namespace="default")
+        assert when(name="l2", namespace="default")
+        assert not when(name="l3", namespace="default")
+
+        # children are added and removed without restarting it
+        _mount(_mounts("l2", "l3"), 2)
+        assert len(op.watches) == 2 and not op.stops[1].is_set()
+        assert not when(name="l1", namespace="default")
+        assert when(name="l3", namespace="default")
+
+        # and it stops with the last child of the kind
+        _mount({CHILD: {}}, 3)
+        assert op.stops[1].is_set()
+    finally:
+        m.stop()
+        _stub(**saved)
+
+
+def test_fanout():
+    calls, lock = dict(), threading.Lock()
+
+    def _patch(g, v, r, n, ns, spec, gen, minimal=False):
+        time.sleep(0.05)
+        with lock:
+            calls[util.model_id(g, v, r, n, ns)] = spec, gen, minimal
+        return 1, {"metadata": {"generation": 2}}, None
+
+    names = [f"l{i}" for i in range(8)]
+    p = _Parent(_mounts(*names))
+    op = _Operator()
+    m, child, saved = _start(p, op=op, sync_concurrency=8)
+    # the original is kept in saved by _start
+    _stub(check_gen_and_patch_spec=_patch)
+    try:
+        mounts = _mounts(*names)
+        mounts[CHILD]["default/l0"]["status"] = "inactive"
+        mounts[CHILD]["default/l1"]["spec"]["mount"] = {"x": {}}
+
+        start = time.time()
+        op.watches[0]["on_mount_attr_update"](
+            body={"metadata": {}}, spec={"mount": mounts},
+            meta={"generation": 2, "resourceVersion": "1"}, diff=())
+        elapsed = time.time() - start
+
+        # active children only, patched concurrently
+        assert set(calls) == {f"{CHILD}/default/l{i}" for i in range(1, 8)}
+        assert calls[f"{CHILD}/default/l1"] == ({"power": "off"}, 1, True)
+        assert elapsed < 7 * 0.05
+        # one fan-out on creation and one on the update
+        stats = m.fanout_stats()
+        assert stats["fanout"]["count"] == 2 and stats["child"]["count"] == 15
+
+        # the children's events of the mounter's own writes are skipped
+        child["on_child_update"](**_event("l1", 2, {"power": "off"}))
+        assert p.patches == []
+    finally:
+        m.stop()
+        _stub(**saved)
+
+
+if __name__ == '__main__':
+    test_merged_deletes()
+    test_conflict_retry()
+    test_concurrent_flush()
+    test_kind_watch()
+    test_fanout()
@@ -0,0 +1,40 @@
+import os
+
+from digi.on import adapter
+
+for _k, _v in {"GROUP": "mock.digi.dev", "VERSION": "v1",
+               "PLURAL": "lamps", "NAME": "l1"}.items():
+    os.environ.setdefault(_k, _v)
+
+proc_view = {"control": {"power": {"intent": "on"}}, "meta": {"k": 1}}
+diff = [("change", ("spec", "mount", "digi.dev/v1/lamps", "default/l1",
+                    "spec", "control", "power", "intent"), "off", "on")]
+
+
+def test_adapter():
+    calls = list()
+
+    def h(sv, view, bp, meta, typ):
+        calls.append((sv, view, bp, meta, typ))
+
+    a = adapter(h, path=("control", "power"), typ="digi.dev/v1/lamps")
+    assert a.__name__ == "h"
+    a(proc_view, {"v": 1}, None, diff)
+    assert calls == [({"intent": "on"}, {"v": 1}, diff, {"k": 1},
+                      "digi.dev/v1/lamps")]
+
+
+def test_adapter_positional():
+    calls = list()
+
+    def h(a, b, c, d):
+        calls.append((a, b, c, d))
+
+    adapter(h)(proc_view, {"v": 1}, {"v": 0}, diff)
+    # subview, proc_view, view and old_view by position
+    assert calls == [(proc_view, proc_view, {"v": 1}, {"v": 0})]
+
+
+if __name__ == '__main__':
+    test_adapter()
+    test_adapter_positional()
@@ -0,0 +1,176 @@
+import os
+import re
+import time
+import threading
+
+from digi.data.pool import ModelSnapshot, ZedPool, WriteBehind
+
+for _k, _v in {"GROUP": "mock.digi.dev", "VERSION": "v1",
+               "PLURAL": "lamps", "NAME": "l1"}.items():
+    os.environ.setdefault(_k, _v)
+
+
+class _Pool:
+    def __init__(self):
+        self.loads = list()
+        self.fail = False
+
+    def load(self, objects, branch="main", buffered=None):
+        assert branch == "model" and buffered is False
+        if self.fail:
+            raise ConnectionError("lake unavailable")
+        # stamps the records as ZedPool.load does
+        for o in objects:
+            o.setdefault("event_ts", o.get("ts", time.time()))
+            o["ts"] = time.time()
+        self.loads.append(objects[0])
+
+
+def test_model_snapshot():
+    pool = _Pool()
+    s = ModelSnapshot(pool, min_interval=0.2)
+    s.start()
+    for i in range(5):
+        s.submit({"control": {"power": {"intent": i}}})
+    time.sleep(0.1)
+    s.submit({"control": {"power": {"intent": 5}}})
+    time.sleep(0.4)
+    # rapid generations are coalesced into the latest
+    assert s.submitted == 6 and s.loaded <= 2
+    assert pool.loads[-1]["control"] == {"power": {"intent": 5}}
+    # snapshots are tagged in delta mode only
+    assert set(pool.loads[-1]) == {"control", "ts", "event_ts"}
+
+
+def test_model_snapshot_delta():
+    pool = _Pool()
+    s = ModelSnapshot(pool, delta=True, keyframe=3)
+    s.load({"control": {"power": {"intent": "on"}, "brightness": {"intent": 1}}}, 1)
+    s.load({"control": {"power": {"intent": "off"}, "brightness": {"intent": 1}}}, 2)
+    s.load({"control": {"power": {"intent": "off"}, "brightness": {"intent": 1}}}, 3)
+    s.load({"control": {"power": {"intent": "off"}}}, 4)
+    s.load({"control": {"power": {"intent": "on"}}}, 5)
+    assert [{k: v for k, v in l.items() if k not in {"ts", "event_ts"}}
+            for l in pool.loads] == [
+        {"control": {"power": {"intent": "on"}, "brightness": {"intent": 1}},
+         "__snapshot": "full", "__gen": 1},
+        {"control": {"power": {"intent": "off"}}, "__snapshot": "delta", "__gen": 2},
+        {"control": {"brightness": None}, "__snapshot": "delta", "__gen": 4},
+        # every keyframe-th snapshot is a full one
+        {"control": {"power": {"intent": "on"}}, "__snapshot": "full", "__gen": 5},
+    ]
+
+
+def test_model_snapshot_failure():
+    pool = _Pool()
+    s = ModelSnapshot(pool, delta=True, keyframe=10)
+    s.load({"control": {"power": {"intent": "on"}}}, 1)
+    pool.fail = True
+    s.load({"control": {"power": {"intent": "off"}}}, 2)
+    pool.fail = False
+    s.load({"control": {"power": {"intent": "off"}, "level": {"intent": 1}}}, 3)
+    # a failed load is not used as the base of a delta
+    assert s.loaded == 2
+    assert pool.loads[-1]["__snapshot"] == "full"
+    assert pool.loads[-1]["control"] == {"power": {"intent": "off"}, "level": {"intent": 1}}
+
+
+def test_model_at():
+    pool = _Pool()
+    s = ModelSnapshot(pool, delta=True, keyframe=3)
+    models = [{"control": {"power": {"intent": i % 2}, "level": {"intent": i}}}
+              for i in range(8)]
+    # the model's own ts and event_ts are kept
+    models[2]["ts"], models[5]["event_ts"] = 2, 5
+    for gen, model in enumerate(models):
+        s.load(model, gen)
+
+    def query_branch(branch, query):
+        # evaluates the filters issued by model_at
+        kind = re.search(r"__snapshot == '(\w+)'", query).group(1)
+        lo = re.search(r"__gen > (\d+)", query)
+        hi = re.search(r"__gen <= (\d+)", query)
+        records = [dict(r) for r in pool.loads if r["__snapshot"] == kind
+                   and (lo is None or r["__gen"] > int(lo.group(1)))
+                   and (hi is None or r["__gen"] <= int(hi.group(1)))]
+        records.sort(key=lambda r: r["__gen"], reverse=kind == "full")
+        return records[:1] if kind == "full" else records
+
+    p = ZedPool.__new__(ZedPool)
+    p.query_branch = query_branch
+    for gen, model in enumerate(models):
+        assert p.model_at(gen=gen) == model
+    assert p.model_at() == models[-1]
+
+
+class _Loader:
+    def __init__(self, fail=False, delay=0):
+        self.batches = list()
+        self.fail = fail
+        self.delay = delay
+
+    def __call__(self, objects, branch, encoding):
+        time.sleep(self.delay)
+        if self.fail:
+            raise ValueError("unable to encode")
+        self.batches.append((branch, encoding, list(objects)))
+
+
+def test_write_behind_batching():
+    load = _Loader()
+    w = WriteBehind(load, batch_size=3, batch_age=10, buffer_size=10)
+    w.start()
+    w.put(("main", "zjson"), [{"i": i} for i in range(4)])
+    w.put(("model", "zjson"), [{"i": 4}])
+    # full batches are loaded without waiting for the age
+    time.sleep(0.1)
+    assert load.batches[0] == ("main", "zjson", [{"i": 0}, {"i": 1}, {"i": 2}])
+    w.flush()
+    assert sorted((b, len(o)) for b, _, o in load.batches) == \
+           [("main", 1), ("main", 3), ("model", 1)]
+    w.stop()
+
+
+def test_write_behind_backpressure():
+    load = _Loader(delay=0.2)
+    w = WriteBehind(load, batch_size=2, batch_age=0, buffer_size=2)
+    w.start()
+    w.put(("main", "zjson"), [{"i": 0}, {"i": 1}])
+    time.sleep(0.05)
+    w.put(("main", "zjson"), [{"i": 2}, {"i": 3}])
+    # the buffer is full while the first batch loads
+    start = time.time()
+    w.put(("main", "zjson"), [{"i": 4}])
+    assert time.time() - start > 0.1
+    w.flush()
+    assert sum(len(o) for _, _, o in load.batches) == 5
+    w.stop()
+
+
+def test_write_behind_failure():
+    load = _Loader(fail=True)
+    w = WriteBehind(load, batch_size=1, batch_age=0, buffer_size=1)
+    w.start()
+    for i in range(3):
+        w.put(("main", "zjson"), [{"i": i}])
+    # the writer survives failed batches
+    done = threading.Event()
+    threading.Thread(target=lambda: (w.flush(), done.set()), daemon=True).start()
+    assert done.wait(1)
+    assert w.is_alive() and w.failed == 3
+
+    # after stop, objects are loaded by the caller
+    load.fail = False
+    w.stop()
+    w.put(("main", "zjson"), [{"i": 3}])
+    assert load.batches == [("main", "zjson", [{"i": 3}])]
+
+
+if __name__ == '__main__':
+    test_model_snapshot()
+    test_model_snapshot_delta()
+    test_model_snapshot_failure()
+    test_model_at()
+    test_write_behind_batching()
+    test_write_behind_backpressure()
+    test_write_behind_failure()
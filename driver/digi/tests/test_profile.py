@@ -0,0 +1,60 @@
+from digi.profile import Profiler
+
+
+def test_disabled():
+    p = Profiler(enabled=False)
+    with p.time("handler", "h"):
+        pass
+    p.count("stage", "conflict")
+    assert p.summary() == {}
+
+
+def test_summary():
+    p = Profiler(enabled=True)
+    for _ in range(3):
+        with p.time("handler", "h"):
+            pass
+    with p.stage("patch"):
+        pass
+    p.count("stage", "conflict")
+
+    s = p.summary()
+    assert s["handler"]["h"]["count"] == 3
+    assert s["stage"]["patch"]["count"] == 1
+    assert s["stage"]["conflict"]["p99_ms"] == 0
+
+    p.reset()
+    assert p.summary() == {}
+
+
+def test_prometheus():
+    p = Profiler(enabled=True)
+    p.observe("handler", "h", 0.002, 0.001)
+    out = p.prometheus()
+    assert 'digi_handler_wall_seconds_bucket{name="h",le="0.001"} 0' in out
+    assert 'digi_handler_wall_seconds_bucket{name="h",le="0.005"} 1' in out
+    assert 'digi_handler_wall_seconds_bucket{name="h",le="+Inf"} 1' in out
+    assert 'digi_handler_cpu_seconds_count{name="h"} 1' in out
+
+
+def test_wall_only():
+    p = Profiler(enabled=True)
+    with p.time("handler", "a", cpu=False):
+        pass
+    with p.time("handler", "s"):
+        pass
+
+    s = p.summary()
+    assert s["handler"]["a"]["count"] == 1 and "cpu_ms" not in s["handler"]["a"]
+    assert "cpu_ms" in s["handler"]["s"]
+    out = p.prometheus()
+    assert 'digi_handler_wall_seconds_count{name="a"} 1' in out
+    assert 'digi_handler_cpu_seconds_count{name="a"}' not in out
+    assert 'digi_handler_cpu_seconds_count{name="s"} 1' in out
+
+
+if __name__ == '__main__':
+    test_disabled()
+    test_summary()
+    test_prometheus()
+    test_wall_only()
@@ -0,0 +1,95 @@
+import os
+import time
+import asyncio
+
+from digi.filter import always
+from digi.on import adapter
+from digi.reconcile import Coalescer, rc
+
+for _k, _v in {"GROUP": "mock.digi.dev", "VERSION": "v1",
+               "PLURAL": "lamps", "NAME": "l1"}.items():
+    os.environ.setdefault(_k, _v)
+
+
+def _model(gen):
+    return {"spec": {"gen": gen}, "metadata": {"generation": gen}}
+
+
+def test_isolated():
+    c = Coalescer(lambda: _model(5), window=0.1, quiet=0.02)
+    # the first update is not part of a burst
+    assert c.latest(1) is None
+
+
+def test_burst():
+    gens = iter([3, 4, 4])
+    c = Coalescer(lambda: _model(next(gens)), window=1, quiet=0.02)
+    c.latest(1)
+    # a newer generation within the quiet period
+    m = c.latest(2)
+    assert m["metadata"]["generation"] == 4
+    assert c.count == 2
+
+
+def test_outdated():
+    c = Coalescer(lambda: _model(3), window=0.1, quiet=0.02)
+    c._last_arrival = -1
+    c.outdated()
+    assert c.latest(2)["metadata"]["generation"] == 3
+    # no newer generation
+    c.outdated()
+    assert c.latest(3) is None
+
+
+def test_async_handlers():
+    r = type(rc)()
+    order = list()
+
+    async def a(proc_view, **_):
+        await asyncio.sleep(0.1)
+        proc_view["a"] = 1
+        order.append("a")
+
+    async def b(proc_view, **_):
+        await asyncio.sleep(0.1)
+        proc_view["b"] = 1
+        order.append("b")
+
+    def c(proc_view, **_):
+        # runs after the lower priority group is done
+        proc_view["c"] = proc_view["a"] + proc_view["b"]
+        order.append("c")
+
+    for fn, prio in [(a, 0), (b, 0), (c, 1)]:
+        r.add(adapter(fn), always, prio, path=(".",))
+
+    start = time.time()
+    spec = r.run({}, None, [])
+    assert time.time() - start < 0.19
+    assert spec == {"a": 1, "b": 1, "c": 2}
+    assert order[-1] == "c"
+
+
+def test_async_timeout():
+    r = type(rc)()
+
+    async def slow(**_):
+        await asyncio.sleep(1)
+
+    def after(proc_view, **_):
+        proc_view["after"] = True
+
+    r.add(adapter(slow), always, 0, path=(".",), timeout=0.05)
+    r.add(adapter(after), always, 1, path=(".",))
+    # the next group is not run and the timed out
+    # handler is not marked as done
+    assert r.run({}, None, []) == {}
+    assert len(r._pending_handler) == 0
+
+
+if __name__ == '__main__':
+    test_isolated()
+    test_burst()
+    test_outdated()
+    test_async_handlers()
+    test_async_timeout()
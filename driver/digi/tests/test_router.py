@@ -0,0 +1,84 @@
+from digi.data import router, sync
+
+
+class _Sync:
+    def __init__(self, sources, source_ts=None, source_pool_ids=None,
+                 min_ts=None, client=None, **kwargs):
+        self.sources, self.kwargs = sources, kwargs
+        self.source_ts = {s: 0 for s in sources} if source_ts is None else source_ts
+        self.source_pool_ids = {f"0x{s}": s.split("@")[0] for s in sources} \
+            if source_pool_ids is None else source_pool_ids
+        self.min_ts, self.client = min_ts, client
+        self.ident, self.stopped, self.query_str = None, False, ""
+        self.alive = False
+
+    def start(self):
+        self.ident, self.alive = 1, True
+
+    def is_alive(self):
+        return self.alive
+
+    def stop(self):
+        self.stopped = True
+
+
+class _Pipelets(router.Pipelets):
+    def resolve(self, config: dict) -> dict:
+        return {name: {"sources": sources, "in_flow": "", "dest": "d"}
+                for name, sources in config.items()}
+
+
+def test_incremental_update():
+    _Sync_ = sync.Sync
+    sync.Sync = _Sync
+    try:
+        p = _Pipelets()
+        p.restart({"a": ["l1@main"], "b": ["l2@main"]})
+        a, b = p._syncs["a"], p._syncs["b"]
+        a.source_ts["l1@main"] = 5
+
+        # mounting l3 re-points a only and leaves b running
+        p.restart({"a": ["l1@main", "l3@main"], "b": ["l2@main"]})
+        assert a.stopped and not b.stopped
+        assert p._syncs["b"] is b and p._syncs["a"].ident is not None
+        assert p._syncs["a"].source_ts == {"l1@main": 5}
+        # pool ids are looked up again for the new pool l3
+        assert set(p._syncs["a"].source_pool_ids.values()) == {"l1", "l3"}
+
+        p.restart({"a": ["l1@main", "l3@main"]})
+        assert b.stopped and list(p._syncs) == ["a"]
+    finally:
+        sync.Sync = _Sync_
+
+
+def test_restart_dead():
+    _Sync_ = sync.Sync
+    sync.Sync = _Sync
+    try:
+        p = _Pipelets()
+        p.restart({"a": ["l1@main"], "b": ["l2@main"]})
+        a, b = p._syncs["a"], p._syncs["b"]
+        a.source_ts["l1@main"] = 5
+        a.alive = False  # crashed
+
+        # a dead sync is replaced and recovers its source ts rather
+        # than resuming past records it may have failed to load
+        p.restart({"a": ["l1@main"], "b": ["l2@main"]})
+        assert p._syncs["b"] is b
+        assert p._syncs["a"] is not a and p._syncs["a"].is_alive()
+        assert p._syncs["a"].source_ts == {"l1@main": 0}
+
+        # so is a dead sync being re-pointed
+        a = p._syncs["a"]
+        a.source_ts["l1@main"] = 5
+        a.alive = False
+        p.restart({"a": ["l1@main", "l3@main"], "b": ["l2@main"]})
+        assert a.stopped and p._syncs["a"].is_alive()
+        assert p._syncs["a"].source_ts == {"l1@main": 0, "l3@main": 0}
+    finally:
+        sync.Sync = _Sync_
+
+
+if __name__ == '__main__':
+    test_incremental_update()
+    test_restart_dead()
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+from digi.data import zed, zjson
+from digi.data.sync import EventHub, Sync, Checkpoint
+
+
+class _Sync:
+    def __init__(self):
+        self.commits = 0
+
+    def notify(self):
+        self.commits += 1
+
+
+def test_event_dispatch():
+    hub = EventHub("http://localhost:9867")
+    a, b = _Sync(), _Sync()
+    hub.subscribe(a, {("0x01", "main")})
+    hub.subscribe(b, {("0x01", "main"), ("0x02", "dev")})
+
+    lines = [
+        b"event: branch-commit",
+        b'data: {pool_id:0x01,branch:"main",commit_id:0xaa}',
+        b"",
+        b"event: branch-commit",
+        b'data: {pool_id:0x02,branch:"dev",commit_id:0xbb}',
+        b"event: pool-update",
+        b'data: {pool_id:0x01}',
+        b"event: branch-commit",
+        b'data: {pool_id:0x02,branch:"main",commit_id:0xcc}',
+    ]
+    hub._dispatch_loop(iter(lines))
+    assert (a.commits, b.commits) == (1, 2)
+
+    hub.unsubscribe(b)
+    hub._dispatch_loop(iter(lines))
+    assert (a.commits, b.commits) == (2, 2)
+    assert ("0x02", "dev") not in hub._index
+
+
+def test_event_errors():
+    hub = EventHub("http://localhost:9867", retry_interval=0.01)
+    a = _Sync()
+    hub.subscribe(a, {("0x01", "main")})
+    events = list()
+
+    def failing(typ, fields):
+        raise KeyError("listener bug")
+
+    hub.add_listener(failing)
+    hub.add_listener(lambda typ, fields: events.append(typ))
+    lines = [
+        b"event: branch-commit",
+        b'data: {pool_id:0x01,branch:"main",commit_id:0xaa}',
+        b"event: branch-commit",
+        b"data: \xff\xfe",
+        b"event: branch-commit",
+    ]
+    # a failing listener, bad data and the end of the
+    # stream do not stop the dispatch or raise
+    hub._dispatch_loop(iter(lines))
+    assert a.commits == 1 and events == ["branch-commit"]
+
+    # nor do errors of the stream end the hub
+    class _Session:
+        calls = 0
+
+        def get(self, *args, **kwargs):
+            _Session.calls += 1
+            if _Session.calls > 2:
+                # park the hub
+                threading.Event().wait()
+            raise ValueError("bad stream")
+
+    _session, zed.session = zed.session, _Session
+    try:
+        hub.max_retry_interval = 0.01
+        hub.start()
+        time.sleep(0.1)
+        assert hub.is_alive() and _Session.calls == 3
+    finally:
+        zed.session = _session
+
+
+class _Client:
+    """Serves the chunks of a single source."""
+
+    def __init__(self, chunks):
+        self.chunks, self.loads = list(chunks), list()
+
+    def query(self, query):
+        if "head" in query:
+            if len(self.chunks) == 0:
+                return iter([])
+            return iter([{"max": self.chunks[0][-1]["ts"], "__from": "s@main"}])
+        chunk = self.chunks.pop(0)
+        return iter(chunk + [{"max_ts": chunk[-1]["ts"], "__from": "s@main"}])
+
+    def load(self, pool, data, **kwargs):
+        self.loads.append((b"".join(data).decode().splitlines(),
+                           json.loads(kwargs["meta"])))
+
+
+class _FanInClient(_Client):
+    """Serves the records of several sources in per-source queries."""
+
+    def __init__(self, records: dict):
+        super().__init__([])
+        self.records = records
+
+    def query(self, query):
+        if "max(ts) |" in query:
+            return iter([{"max": r[-1]["ts"], "__from": s}
+                         for s, r in self.records.items()])
+        source = query.split("pool ")[1].split(" ")[0]
+        return iter(self.records.pop(source) + [{"__from": source}])
+
+
+class _FailingClient(_Client):
+    """Serves the same records to every read; the first load fails."""
+
+    def __init__(self, records):
+        super().__init__([])
+        self.records, self.queries, self.fail = records, list(), True
+
+    def query(self, query):
+        self.queries.append(query)
+        return iter(self.records + [{"max_ts": self.records[-1]["ts"],
+                                     "__from": "s@main"}])
+
+    def load(self, pool, data, **kwargs):
+        if self.fail:
+            self.fail = False
+            raise Exception("load failed")
+        self.loads.append((data.splitlines(), json.loads(kwargs["meta"])))
+
+
+def _sync(client, sources, **kwargs) -> Sync:
+    s = Sync.__new__(Sync)
+    s.sources, s.dest, s.source_ts = sources, "d@main", dict()
+    s.min_ts, s.eoio = datetime.min.replace(tzinfo=timezone.utc), True
+    s.in_flow = s.out_flow = s.owner = ""
+    s.patch_source, s._stop_flag = False, threading.Event()
+    s.chunk_size, s.fan_in, s.source_lag = -1, 0, dict()
+    s.checkpoint, s.client = None, client
+    for k, v in kwargs.items():
+        setattr(s, k, v)
+    return s
+
+
+def test_chunked_backfill():
+    ts = [datetime(2022, 1, 1, i, tzinfo=timezone.utc) for i in range(5)]
+    chunks = [[{"ts": t} for t in ts[:2]], [{"ts": t} for t in ts[2:4]],
+              [{"ts": ts[4]}]]
+    s = _sync(_Client(chunks), ["s@main"], chunk_size=2,
+              checkpoint=Checkpoint(os.path.join(tempfile.mkdtemp(), "s.json")))
+
+    s.once()
+    assert [len(_l) for _l, _ in s.client.loads] == [2, 2, 1]
+    # each load commits the source ts up to its chunk
+    assert [m["s@main"] for _, m in s.client.loads] == \
+           [zjson.encode_datetime(t) for t in [ts[1], ts[3], ts[4]]]
+    assert s.source_ts == {"s@main": ts[4]}
+    assert s.checkpoint.read() == s.source_ts
+
+
+def test_fan_in():
+    ts = [datetime(2022, 1, 1, i, tzinfo=timezone.utc) for i in range(6)]
+    records = {"a@main": [{"ts": t, "s": "a"} for t in ts[0::2]],
+               "b@main": [{"ts": t, "s": "b"} for t in ts[1::2]]}
+    s = _sync(_FanInClient(records), ["a@main", "b@main"], fan_in=2)
+
+    s.once()
+    loaded, meta = s.client.loads[0]
+    # records of the sources are merged by ts into one load
+    assert len(s.client.loads) == 1
+    assert [json.loads(_l)["value"][1] for _l in loaded] == ["a", "b"] * 3
+    assert s.source_ts == {"a@main": ts[4], "b@main": ts[5]}
+    assert set(s.source_lag) == {"a@main", "b@main"}
+
+
+def test_failed_load():
+    ts = [datetime(2022, 1, 1, i, tzinfo=timezone.utc) for i in range(3)]
+    s = _sync(_FailingClient([{"ts": t} for t in ts]), ["s@main"])
+
+    try:
+        s.once()
+        assert False, "load should fail"
+    except Exception as e:
+        assert str(e) == "load failed"
+    # the source ts is not advanced past the records not loaded
+    assert s.source_ts == {}
+
+    # the next round reads the same records again
+    s.once()
+    assert s.client.queries[0] == s.client.queries[1]
+    assert len(s.client.loads) == 1 and len(s.client.loads[0][0]) == 3
+    assert s.client.loads[0][1] == {"s@main": zjson.encode_datetime(ts[2])}
+    assert s.source_ts == {"s@main": ts[2]}
+
+
+def test_checkpoint():
+    cp = Checkpoint(os.path.join(tempfile.mkdtemp(), "s.json"))
+    assert cp.read() is None
+    source_ts = {"s@main": datetime(2022, 1, 1, 12, 0, 0, 1, tzinfo=timezone.utc)}
+    cp.write(source_ts)
+    assert cp.read() == source_ts
+    # the load of a pending checkpoint may not have committed
+    cp.write(source_ts, pending=True)
+    assert cp.read() is None
+
+
+if __name__ == '__main__':
+    test_event_dispatch()
+    test_event_errors()
+    test_chunked_backfill()
+    test_fan_in()
+    test_failed_load()
+    test_checkpoint()
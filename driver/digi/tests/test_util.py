@@ -0,0 +1,91 @@
+from kubernetes.client.rest import ApiException
+
+from digi import util
+from digi.profile import profiler
+from digi.util import merge_patch, diff, ModelCache
+
+
+def test_merge_patch():
+    old = {"control": {"power": {"intent": "on", "status": "on"}},
+           "meta": {"tags": [1]}}
+    new = {"control": {"power": {"intent": "on", "status": "off"}},
+           "meta": {"tags": [1]}, "obs": None}
+    assert merge_patch(old, new) == {"control": {"power": {"status": "off"}}}
+    assert merge_patch(old, old) == {}
+
+    # attributes set to None are removed; missing ones
+    # are removed only when pruning
+    new = {"control": {"power": {"intent": None}}}
+    assert merge_patch(old, new, prune=False) == \
+           {"control": {"power": {"intent": None}}}
+    assert merge_patch(old, new) == \
+           {"control": {"power": {"intent": None, "status": None}}, "meta": None}
+
+
+def test_model_cache():
+    c = ModelCache()
+    c.update("g", "v", "r", "n", "ns", {"a": 1}, "2", 2)
+    # older generations are ignored
+    c.update("g", "v", "r", "n", "ns", {"a": 0}, "1", 1)
+    assert c.get("g", "v", "r", "n", "ns") == ({"a": 1}, "2", 2)
+    c.invalidate("g", "v", "r", "n", "ns")
+    assert c.get("g", "v", "r", "n", "ns") is None
+
+    # callers may modify the specs they put or get
+    spec = {"a": {"b": 1}}
+    c.update("g", "v", "r", "n", "ns", spec, "3", 3)
+    spec["a"]["b"] = 2
+    c.get("g", "v", "r", "n", "ns")[0]["a"]["b"] = 3
+    assert c.get("g", "v", "r", "n", "ns")[0] == {"a": {"b": 1}}
+
+    c = ModelCache(ttl=-1)
+    c.update("g", "v", "r", "n", "ns", {"a": 1}, "2", 2)
+    assert c.get("g", "v", "r", "n", "ns") is None
+
+
+def test_diff():
+    old = {"spec": {"control": {"power": {"intent": "on"}}, "meta": {"tags": [1]}}}
+    new = {"spec": {"control": {"power": {"intent": "off"}}, "obs": {"on": 1}}}
+    assert sorted(diff(old, new)) == sorted([
+        ("change", ("spec", "control", "power", "intent"), "on", "off"),
+        ("remove", ("spec", "meta"), {"tags": [1]}, None),
+        ("add", ("spec", "obs"), None, {"on": 1}),
+    ])
+    assert diff(old, old) == []
+
+
+def test_patch_profile():
+    conflicts = [ApiException(status=409)]
+
+    def _patch(*args, **kwargs):
+        _, _ = args, kwargs
+        if conflicts:
+            return None, conflicts.pop()
+        return {"metadata": {"generation": 2}}, None
+
+    get_spec, patch_spec = util.get_spec, util.patch_spec
+    util.get_spec = lambda *args, **kwargs: ({"a": 1}, "1", 1)
+    util.patch_spec = _patch
+    profiler.enabled = True
+    try:
+        # only the callers that ask for it are profiled
+        util.check_gen_and_patch_spec("g", "v", "r", "n", "ns", {"a": 2}, gen=1)
+        assert profiler.summary() == {}
+
+        conflicts.append(ApiException(status=409))
+        util.check_gen_and_patch_spec("g", "v", "r", "n", "ns", {"a": 2}, gen=1,
+                                      profile=True)
+        stages = profiler.summary()["stage"]
+        assert stages["get"]["count"] == 2 and stages["patch"]["count"] == 2
+        assert stages["conflict"]["count"] == 1
+    finally:
+        util.get_spec, util.patch_spec = get_spec, patch_spec
+        profiler.enabled = False
+        profiler.reset()
+
+
+if __name__ == '__main__':
+    test_merge_patch()
+    test_model_cache()
+    test_diff()
+    test_patch_profile()
@@ -8,6 +8,8 @@ from digi.view import (
     TypeView,
     DotView,
     CleanView,
+    CowDict,
+    cow_diff,
 )
 
 
@@ -72,5 +74,86 @@ def test():
     print("clean view, before:", v)
     print(f"-----\nafter: {CleanView(v, 'rooms').m()}\n")
 
+def test_cow():
+    os.environ.update({
+        "GROUP": "mock.digi.dev",
+        "VERSION": "v1",
+        "PLURAL": "rooms",
+        "NAME": "room",
+        "NAMESPACE": "default",
+    })
+    lamps = {
+        f"default/l{i}": {"spec": {"control": {"power": {"intent": "on"}}}}
+        for i in range(100)
+    }
+    v = {
+        "control": {"mode": {"intent": "sleep", "status": "sleep"}},
+        "mount": {"mock.digi.dev/v1/lamps": lamps},
+    }
+    orig_v = copy.deepcopy(v)
+
+    with ModelView(v) as mv:
+        mv["l1"]["control"]["power"]["intent"] = "off"
+        mv["root"]["control"]["mode"].pop("status")
+        # the source is updated on exit only
+        assert v == orig_v
+        # untouched subtrees are not copied
+        assert dict.__getitem__(mv, "l2") is lamps["default/l2"]["spec"]
+
+    assert v["control"]["mode"] == {"intent": "sleep", "status": None}
+    assert lamps["default/l1"]["spec"]["control"]["power"]["intent"] == "off"
+    assert lamps["default/l2"] == orig_v["mount"]["mock.digi.dev/v1/lamps"]["default/l2"]
+
+    with TypeView(v) as tv:
+        tv["lamps"]["l3"]["control"]["power"] = {"status": "off"}
+    assert lamps["default/l3"]["spec"]["control"]["power"] == {"intent": None, "status": "off"}
+
+    # a child's spec is shared by its name and root.mount
+    with ModelView(v) as mv:
+        mv["l4"]["control"]["power"]["intent"] = "off"
+        spec = mv["root"]["mount"]["mock.digi.dev/v1/lamps"]["default/l4"]["spec"]
+        assert spec is mv["l4"]
+        assert spec["control"]["power"]["intent"] == "off"
+        spec["control"]["power"]["status"] = "off"
+    assert lamps["default/l4"]["spec"]["control"]["power"] == {"intent": "off", "status": "off"}
+
+
+def test_cow_access():
+    src = {"a": {"l": [1, 2], "b": {"c": 1}}}
+    orig = copy.deepcopy(src)
+
+    # writes through an earlier reference to a list are kept
+    c = CowDict(src)
+    l = c["a"]["l"]
+    _ = c["a"]["l"]
+    l.append(3)
+    assert cow_diff(src, c) == [("change", ("a", "l"), [1, 2], [1, 2, 3])]
+
+    # plain copies of the view are read through it
+    for copy_ in [lambda d: dict(d), lambda d: {**d}]:
+        c = CowDict(src)
+        copy_(c)["a"]["b"]["c"] = 2
+        copy_(c["a"])["l"].append(3)
+        assert cow_diff(src, c) == [("change", ("a", "l"), [1, 2], [1, 2, 3]),
+                                    ("change", ("a", "b", "c"), 1, 2)]
+
+    # as are iteration, items() and values()
+    c = CowDict(src)
+    for k in c:
+        c[k]["b"]["c"] = 3
+    for _, v in c["a"].items():
+        if isinstance(v, list):
+            v.append(4)
+    for v in c["a"].values():
+        if isinstance(v, dict):
+            v["d"] = 1
+    assert cow_diff(src, c) == [("change", ("a", "l"), [1, 2], [1, 2, 4]),
+                                ("change", ("a", "b", "c"), 1, 3),
+                                ("add", ("a", "b", "d"), None, 1)]
+    assert src == orig
+
+
 if __name__ == '__main__':
     test()
+    test_cow()
+    test_cow_access()
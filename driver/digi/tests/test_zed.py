@@ -0,0 +1,54 @@
+import gzip
+
+from digi.data import zed
+from digi.data.zed import Metadata
+
+
+class _Client:
+    def __init__(self):
+        self.queries = 0
+
+    def query(self, query):
+        self.queries += 1
+        if query == "from :pools":
+            return iter([{"name": "l1", "id": b"\x01"}])
+        return iter([{"branch": {"name": "main"}}])
+
+
+def test_metadata():
+    c, m = _Client(), Metadata(ttl=60)
+    assert m.pools(c) == {"l1": "0x01"}
+    assert m.branches(c, "l1") == {"main"}
+    assert m.branches(c, "l1") == {"main"} and c.queries == 2
+
+    # kept fresh from the events of the lake
+    m.on_event("branch-update", {"pool_id": "0x01", "branch": "dev"})
+    assert m.branches(c, "l1") == {"main", "dev"}
+    m.on_event("branch-delete", {"pool_id": "0x01", "branch": "dev"})
+    assert m.branches(c, "l1") == {"main"} and c.queries == 2
+
+    m.on_event("pool-new", {"pool_id": "0x02"})
+    m.pools(c)
+    assert c.queries == 3
+    m.on_event("reconnect", {})
+    m.branches(c, "l1")
+    assert c.queries == 4
+
+    m = Metadata(ttl=-1)
+    m.branches(c, "l1"), m.branches(c, "l1")
+    assert c.queries == 6
+
+
+def test_transport():
+    a, b = zed.Client(), zed.Client(base_url="http://lake:9867")
+    assert a.session.get_adapter("http://localhost:9867") is \
+           b.session.get_adapter("http://lake:9867") is zed.adapter()
+
+    lines = ["{}\n", "{}\n"]
+    assert gzip.decompress(zed._gzip("".join(lines))) == b"{}\n{}\n"
+    assert gzip.decompress(b"".join(zed._gzip(iter(lines)))) == b"{}\n{}\n"
+
+
+if __name__ == '__main__':
+    test_metadata()
+    test_transport()
@@ -0,0 +1,71 @@
+import json
+import datetime
+
+from digi.data import zjson
+
+
+def _round_trip(objs):
+    return list(zjson.decode_raw(json.loads(_l) for _l in zjson.encode(objs)))
+
+
+def test_encode_ref():
+    objs = [{"watt": 12, "user": {"alice": True}},
+            {"watt": 13, "user": {"bob": False}},
+            {"watt": 14, "user": {"alice": False}}]
+    lines = [json.loads(_l) for _l in zjson.encode(objs)]
+    # a repeated shape refers to the type defined first
+    assert lines[2]["type"] == {"kind": "ref", "id": lines[0]["type"]["id"]}
+    # nested shapes are cached too
+    assert lines[1]["type"]["fields"][0]["type"]["kind"] == "primitive"
+    assert lines[1]["type"]["fields"][1]["type"]["id"] != \
+           lines[0]["type"]["fields"][1]["type"]["id"]
+    assert _round_trip(objs) == objs
+
+
+def test_encode_values():
+    ts = datetime.datetime(2022, 1, 1, 12, 0, 0)
+    objs = [{"ts": ts, "tags": ["a", "b"], "ids": [{"i": 1}, {"i": 2}],
+             "empty": {}, "none": None, "rate": 0.5, "on": False},
+            {"ts": ts, "tags": [], "ids": [], "empty": {}, "none": None,
+             "rate": 1.5, "on": True}]
+    decoded = _round_trip(objs)
+    assert decoded[0]["ts"].replace(tzinfo=None) == ts
+    for o, d in zip(objs, decoded):
+        d.pop("ts"), o.pop("ts")
+        assert d == o
+
+
+def test_decode_time():
+    utc = datetime.timezone.utc
+    assert zjson.decode_time("2022-01-01T12:00:00Z") == \
+           datetime.datetime(2022, 1, 1, 12, tzinfo=utc)
+    # nanoseconds are truncated to microseconds
+    assert zjson.decode_time("2022-01-01T12:00:00.123456789Z") == \
+           datetime.datetime(2022, 1, 1, 12, 0, 0, 123456, tzinfo=utc)
+    assert zjson.decode_time("2022-01-01T12:00:00.5Z").microsecond == 500000
+    # other formats fall back to the generic parser
+    assert zjson.decode_time("2022-01-01T12:00:00+01:00") == \
+           datetime.datetime(2022, 1, 1, 11, tzinfo=utc)
+
+
+def test_decode_stream():
+    raw = [
+        {"type": {"kind": "record", "id": 30, "fields": [
+            {"name": "ts", "type": {"kind": "primitive", "name": "time"}},
+            {"name": "tags", "type": {"kind": "array", "id": 31, "type": {
+                "kind": "primitive", "name": "string"}}}]},
+         "value": ["2022-01-01T12:00:00Z", ["a"]]},
+        {"type": {"kind": "ref", "id": 30}, "value": [None, None]},
+        {"type": "QueryStats", "value": {}},
+    ]
+    decoded = zjson.decode_raw(iter(raw))
+    assert next(decoded)["tags"] == ["a"]
+    assert next(decoded) == {"ts": None, "tags": None}
+    assert list(decoded) == []
+
+
+if __name__ == '__main__':
+    test_encode_ref()
+    test_encode_values()
+    test_decode_time()
+    test_decode_stream()
@@ -1,11 +1,14 @@
 import os
+import copy
 import uuid
 import time
+import random
 import asyncio
 import contextlib
 import threading
 
 import digi
+from digi.profile import profiler
 import inflection
 import logging
 from typing import (
@@ -13,34 +16,56 @@ from typing import (
 )
 from functools import reduce
 
-import kubernetes
-from kubernetes import config
-from kubernetes.client.rest import ApiException
-
-import kopf
-from kopf._core.intents.registries import SmartOperatorRegistry as KopfRegistry
-
 logger = logging.getLogger(__name__)
 logger.setLevel(digi.log_level)
 
-try:
-    # use service config
-    config.load_incluster_config()
-except:
-    # use kubeconfig
-    config.load_kube_config()
-
 
 class DriverError:
     GEN_OUTDATED = 41
 
 
-_api = kubernetes.client.CustomObjectsApi()
+# kubernetes and kopf are imported and the cluster config is
+# loaded on first use, so that importing digi stays cheap
+_api = None
+_api_lock = threading.Lock()
+
+
+def load_config():
+    from kubernetes import config
+    try:
+        # use service config
+        config.load_incluster_config()
+    except:
+        # use kubeconfig
+        config.load_kube_config()
+
 
-def run_operator(registry: KopfRegistry,
+def api():
+    """Return the client of the custom objects API."""
+    global _api
+    if _api is not None:
+        return _api
+    with _api_lock:
+        if _api is None:
+            import kubernetes
+            load_config()
+            _api = kubernetes.client.CustomObjectsApi()
+    return _api
+
+
+def __getattr__(name):
+    if name == "KopfRegistry":
+        from kopf._core.intents.registries import SmartOperatorRegistry
+        return SmartOperatorRegistry
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
+
+def run_operator(registry: "KopfRegistry",
                  log_level=logging.INFO,
                  skip_log_setup=False,
                  ) -> Tuple[threading.Event, threading.Event]:
+    import kopf
+
     clusterwide = os.environ.get("CLUSTERWIDE", True)
     kopf_logging = os.environ.get("KOPFLOG", "true") == "true"
     if not kopf_logging:
@@ -139,6 +164,15 @@ def apply_diff(model: dict, diff: list) -> dict:
     return model
 
 
+def diff(old, new) -> list:
+    """Return the diff between two models in kopf's format,
+    i.e., a list of (op, path, old, new) with op being one
+    of add, change or remove; lists are compared as values."""
+    # kopf is imported on first use
+    from kopf._cogs.structs.diffs import diff as kopf_diff
+    return list(kopf_diff(old, new))
+
+
 def parse_spaced_name(nsn) -> Tuple[str, str]:
     parsed = nsn.split("/")
     if len(parsed) < 2:
@@ -205,65 +239,188 @@ def parse_model_id(s) -> Tuple[str, str, str, str, str]:
     return ps[0], ps[1], ps[2], ps[4], ps[3]
 
 
-def get_spec(g, v, r, n, ns) -> Tuple[dict, str, int]:
-    global _api
+class ModelCache:
+    """A local cache of the (spec, resourceVersion, generation) of
+    models, fed by the watch events the driver and the mounter already
+    receive and by the responses of patches. Entries are only used
+    as the base of optimistic writes: a stale entry results in a
+    conflict, upon which the entry is dropped and the model is read
+    from the apiserver again. Specs are copied on insert and on
+    return, since callers modify the specs they are given."""
+
+    def __init__(self, ttl: float = 30):
+        self.ttl = ttl
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def get(self, g, v, r, n, ns) -> Union[Tuple[dict, str, int], None]:
+        with self._lock:
+            e = self._entries.get(model_id(g, v, r, n, ns), None)
+        if e is None or time.time() - e[3] > self.ttl:
+            return None
+        return copy.deepcopy(e[0]), e[1], e[2]
+
+    def update(self, g, v, r, n, ns, spec: dict, rv: str, gen: int):
+        _id = model_id(g, v, r, n, ns)
+        spec = copy.deepcopy(dict(spec))
+        with self._lock:
+            e = self._entries.get(_id, None)
+            # events may arrive after a newer patch response
+            if e is not None and gen < e[2]:
+                return
+            self._entries[_id] = (spec, rv, gen, time.time())
 
-    try:
-        o = _api.get_namespaced_custom_object(group=g,
-                                              version=v,
-                                              namespace=ns,
-                                              name=n,
-                                              plural=r,
-                                              )
-    except ApiException as e:
-        logger.warning(f"unable to get model {n}:", e)
+    def update_from_body(self, g, v, r, n, ns, body: dict):
+        meta = body.get("metadata", {})
+        if "resourceVersion" not in meta or "generation" not in meta:
+            return
+        self.update(g, v, r, n, ns, body.get("spec", {}),
+                    meta["resourceVersion"], meta["generation"])
+
+    def invalidate(self, g, v, r, n, ns):
+        with self._lock:
+            self._entries.pop(model_id(g, v, r, n, ns), None)
+
+
+model_cache = ModelCache(ttl=digi.model_cache_ttl)
+
+
+def get_spec(g, v, r, n, ns, cached=False) -> Tuple[dict, str, int]:
+    if cached and digi.enable_model_cache:
+        e = model_cache.get(g, v, r, n, ns)
+        if e is not None:
+            return e
+
+    o = get_model(g, v, r, n, ns)
+    if o is None:
         return None
     return o.get("spec", {}), \
            o["metadata"]["resourceVersion"], \
            o["metadata"]["generation"]
 
 
+def get_model(g, v, r, n, ns) -> Union[dict, None]:
+    from kubernetes.client.rest import ApiException
+
+    try:
+        o = api().get_namespaced_custom_object(group=g,
+                                               version=v,
+                                               namespace=ns,
+                                               name=n,
+                                               plural=r,
+                                               )
+    except ApiException as e:
+        logger.warning(f"unable to get model {n}: {e}")
+        return None
+    model_cache.update_from_body(g, v, r, n, ns, o)
+    return o
+
+
 def patch_spec(g, v, r, n, ns, spec: dict, rv=None):
-    global _api
+    from kubernetes.client.rest import ApiException
+
     try:
-        resp = _api.patch_namespaced_custom_object(group=g,
-                                                   version=v,
-                                                   namespace=ns,
-                                                   name=n,
-                                                   plural=r,
-                                                   body={
-                                                       "metadata": {} if rv is None else {
-                                                           "resourceVersion": rv,
-                                                       },
-                                                       "spec": spec,
-                                                   },
-                                                   )
+        resp = api().patch_namespaced_custom_object(group=g,
+                                                    version=v,
+                                                    namespace=ns,
+                                                    name=n,
+                                                    plural=r,
+                                                    body={
+                                                        "metadata": {} if rv is None else {
+                                                            "resourceVersion": rv,
+                                                        },
+                                                        "spec": spec,
+                                                    },
+                                                    )
+        model_cache.update_from_body(g, v, r, n, ns, resp)
         return resp, None
     except ApiException as e:
+        if e.status == 409:
+            model_cache.invalidate(g, v, r, n, ns)
         return None, e
 
 
-def check_gen_and_patch_spec(g, v, r, n, ns, spec, gen):
+def check_gen_and_patch_spec(g, v, r, n, ns, spec, gen, minimal=False, profile=False):
     # patch the spec atomically if the current gen is
-    # less than the given spec
+    # less than the given spec; the first attempt is based
+    # on the cached model and a conflict falls back to a read.
+    # If minimal is set, only the attributes that differ from
+    # the current spec are sent, and no request is made (with
+    # None returned as the response) if there are none. If
+    # profile is set, the get/patch stages and conflicts are
+    # recorded to the profiler (by the reconcile path only).
+    cached = True
     while True:
-        _, rv, cur_gen = get_spec(g, v, r, n, ns)
+        with _stage("get", profile):
+            cur_spec, rv, cur_gen = get_spec(g, v, r, n, ns, cached=cached)
         if gen < cur_gen:
+            from kubernetes.client.rest import ApiException
             e = ApiException()
             e.status = DriverError.GEN_OUTDATED
             e.reason = f"generation outdated {gen} < {cur_gen}"
             return cur_gen, None, e
 
-        resp, e = patch_spec(g, v, r, n, ns, spec, rv=rv)
+        patch = merge_patch(cur_spec, spec, prune=False) if minimal else spec
+        if minimal and len(patch) == 0:
+            return cur_gen, None, None
+
+        with _stage("patch", profile):
+            resp, e = patch_spec(g, v, r, n, ns, patch, rv=rv)
         if e is None:
             return cur_gen, resp, None
         if e.status == 409:
             logger.info(f"unable to patch {n} due to conflict; retry")
+            if profile:
+                profiler.count("stage", "conflict")
+            cached = False
         else:
             logger.warning(f"patch error {e}")
             return cur_gen, resp, e
 
 
+def _stage(name, profile):
+    return profiler.stage(name) if profile else contextlib.nullcontext()
+
+
+def merge_patch(old: dict, new: dict, prune: bool = True) -> dict:
+    """Return a JSON merge patch (RFC 7386) that updates old to new,
+    containing only the changed attributes. If prune is not set,
+    attributes missing from new are kept rather than removed."""
+    patch = dict()
+    if prune:
+        for k in old:
+            if k not in new:
+                patch[k] = None
+
+    for k, v in new.items():
+        if k not in old:
+            if v is not None:
+                patch[k] = v
+            continue
+        o = old[k]
+        if isinstance(o, dict) and isinstance(v, dict):
+            p = merge_patch(o, v, prune=prune)
+            if len(p) > 0:
+                patch[k] = p
+        elif o != v:
+            patch[k] = v
+    return patch
+
+
+def apply_merge_patch(target: dict, patch: dict) -> dict:
+    """Apply a JSON merge patch (RFC 7386) to target in place."""
+    for k, v in patch.items():
+        if v is None:
+            target.pop(k, None)
+        elif isinstance(v, dict):
+            if not isinstance(target.get(k), dict):
+                target[k] = dict()
+            apply_merge_patch(target[k], v)
+        else:
+            target[k] = v
+    return target
+
+
 # utils
 def put(path, src, target, transform=lambda x: x):
     if not isinstance(target, dict):
@@ -538,6 +695,29 @@ def report_loop(fn: Callable):
             _loop.start()
 
 
+def backoff(attempt: int, base: float = 0.05, cap: float = 2) -> float:
+    """Exponential backoff (sec) with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def percentile(values: Iterable, p: float) -> float:
+    values = sorted(values)
+    if len(values) == 0:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def latency_summary(values: Iterable) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": values[-1] if len(values) > 0 else 0,
+    }
+
+
 def name_from_auri(auri: tuple):
     return auri[3]
 
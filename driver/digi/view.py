@@ -3,7 +3,6 @@ import os
 import copy
 from box import Box
 from abc import ABC, abstractmethod
-from kopf._cogs.structs.diffs import diff
 
 import digi.util as util
 from digi.util import deep_set
@@ -20,7 +19,7 @@ class View(ABC):
                  trim_name: bool = True,
                  ):
         self._src = root
-        self._root = copy.deepcopy(self._src)
+        self._root_copy = None
         self._root_key = root_key
         self._old, self._new = None, None
 
@@ -42,6 +41,14 @@ class View(ABC):
             self._gv_str = "/".join(util.parse_gvr(gvr_str)[:-1])
             self._gvr_str = gvr_str
 
+    @property
+    def _root(self) -> dict:
+        # a private copy of the root; only materialized
+        # views need one as transform() trims it in place
+        if self._root_copy is None:
+            self._root_copy = copy.deepcopy(self._src)
+        return self._root_copy
+
     @abstractmethod
     def __enter__(self):
         raise NotImplementedError
@@ -85,8 +92,8 @@ class NameView(View):
         super().__init__(*args, **kwargs)
 
     def __enter__(self):
-        _view = {"root": self._root}
-        _mount = self._root.get("mount", {})
+        _view = {"root": self._src}
+        _mount = self._src.get("mount", {})
 
         for typ, ms in _mount.items():
             for n, m in ms.items():
@@ -96,18 +103,17 @@ class NameView(View):
                 _view.update({n: m["spec"]})
                 self._nsn_gvr[n] = typ
 
-        self._old, self._new = _view, copy.deepcopy(_view)
+        self._old, self._new = _view, CowDict(_view)
         return self._new
 
     def __exit__(self, typ, value, traceback):
-        _view = {"root": self._root}
         # diff and apply
         _src = self._src
-        _diffs = diff(self._old, self._new)
+        _diffs = cow_diff(self._old, self._new)
         for op, path, old, new in _diffs:
             nsn = path[0]
             if nsn == "root":
-                deep_set(_src, ".".join(path[1:]), new)
+                deep_set(_src, list(path[1:]), new)
             else:
                 typ = self._nsn_gvr[nsn]
                 nsn = util.normalized_nsn(nsn)
@@ -150,8 +156,8 @@ class KindView(View):
 
     def __enter__(self):
         # _view = {self._r: {"root": self._root_view}}
-        _view = {"root": self._root}
-        _mount = self._root.get("mount", {})
+        _view = {"root": self._src}
+        _mount = self._src.get("mount", {})
 
         for typ, ms in _mount.items():
             _typ = typ.replace(self._gv_str + "/", "") if self._trim_gv else typ
@@ -164,17 +170,17 @@ class KindView(View):
                 n = util.trim_default_space(n)
                 _view[_typ].update({n: m["spec"]})
 
-        self._old, self._new = _view, copy.deepcopy(_view)
+        self._old, self._new = _view, CowDict(_view)
         return self._new
 
     def __exit__(self, typ, value, traceback):
         _src = self._src
-        _diffs = diff(self._old, self._new)
+        _diffs = cow_diff(self._old, self._new)
 
         for op, path, old, new in _diffs:
             typ = path[0]
             if typ == "root":
-                deep_set(_src, ".".join(path[1:]), new)
+                deep_set(_src, list(path[1:]), new)
             else:
                 typ = self._typ_full_typ[typ]
                 nsn = util.normalized_nsn(path[1])
@@ -243,7 +249,8 @@ class CleanView(View):
                 self.transform(spec, view["mount"][_typ][new_name])
 
     def materialize(self) -> dict:
-        root, view = self._root, dict()
+        # transform() copies the root as it goes
+        root, view = self._src, dict()
         self.transform(root, view)
         return view
 
@@ -278,6 +285,9 @@ class DotView(View):
         return self._dot_view
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        # kopf is imported on use; see digi.__init__
+        from kopf._cogs.structs.diffs import diff
+
         _src = self._src_view
         self._dot_view = self._dot_view.to_dict()
         _diffs = diff(self._dot_view_old, self._dot_view)
@@ -309,6 +319,120 @@ class DotView(View):
         return s
 
 
+class CowDict(dict):
+    """
+    A copy-on-write proxy of a dict used by the views. It starts
+    as a shallow copy of the source and wraps nested dicts (and
+    copies nested lists) only when they are accessed, so a handler
+    that changes a few leaves allocates proportional to what it
+    touches rather than to the size of the model. The source is
+    never modified; use cow_diff() to collect the changes.
+
+    A nested value reachable from several paths of the source, e.g.,
+    a child's spec under its name and under root.mount, gets a single
+    wrapper, so a write through one path is seen through the others.
+    """
+
+    def __init__(self, src: dict, _memo: dict = None):
+        super().__init__(src)
+        self._src = src
+        # keys whose values are owned by the view, i.e., wrapped,
+        # copied or set; the others are shared with the source
+        self._owned = set()
+        # wrappers of the nested values by the id of their source,
+        # shared by all the wrappers of a view
+        self._memo = dict() if _memo is None else _memo
+
+    def __getitem__(self, k):
+        v = dict.__getitem__(self, k)
+        if k in self._owned:
+            return v
+        if type(v) not in {dict, list}:
+            return v
+        w = self._memo.get(id(v))
+        if w is None:
+            w = CowDict(v, self._memo) if type(v) is dict else copy.deepcopy(v)
+            self._memo[id(v)] = w
+        v = w
+        dict.__setitem__(self, k, v)
+        self._owned.add(k)
+        return v
+
+    def __setitem__(self, k, v):
+        dict.__setitem__(self, k, v)
+        self._owned.add(k)
+
+    def __delitem__(self, k):
+        dict.__delitem__(self, k)
+        self._owned.discard(k)
+
+    def __iter__(self):
+        # overriding __iter__ makes dict(view) and {**view}
+        # read the values through __getitem__
+        return dict.__iter__(self)
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def get(self, k, default=None):
+        return self[k] if k in self else default
+
+    def setdefault(self, k, default=None):
+        if k not in self:
+            self[k] = default
+        return self[k]
+
+    def pop(self, k, *args):
+        if k in self:
+            v = self[k]
+            del self[k]
+            return v
+        return dict.pop(self, k, *args)
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def copy(self):
+        return dict(self.items())
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return {k: copy.deepcopy(v, memo) for k, v in dict.items(self)}
+
+
+def cow_diff(old: dict, new: dict, path: tuple = ()) -> list:
+    """Diff a CowDict against its source in the form of kopf diffs,
+    i.e., (op, path, old, new). Untouched subtrees are shared with the
+    source and skipped by identity; a removed key yields a None value."""
+    diffs = list()
+    for k in old:
+        if not dict.__contains__(new, k):
+            diffs.append(("remove", path + (k,), old[k], None))
+
+    for k, v in dict.items(new):
+        if k not in old:
+            diffs.append(("add", path + (k,), None, _plain(v)))
+            continue
+        o = old[k]
+        if o is v:
+            continue
+        if isinstance(o, dict) and isinstance(v, dict):
+            diffs += cow_diff(o, v, path + (k,))
+        elif o != v:
+            diffs.append(("change", path + (k,), o, _plain(v)))
+    return diffs
+
+
+def _plain(v):
+    # detach new values from the view
+    return copy.deepcopy(v) if isinstance(v, (dict, list)) else v
+
+
 # aliases
 ModelView, TypeView = NameView, KindView
 
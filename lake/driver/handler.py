@@ -5,10 +5,12 @@ from threading import Timer, Thread
 import digi
 import pyzed
 import event
+from digi.data import zed
 
 ZED_LAKE_URL = "http://localhost:9867"
 SPAWNED_THREADS = []
 zed_client = pyzed.Client(base_url=ZED_LAKE_URL)
+zed.mount(zed_client.session)
 
 BRANCHES = {}
 
@@ -97,7 +99,7 @@ def poll_func():
     patch_existing_pools(new_spec)
     
 def event_func():
-    s = requests.Session()
+    s = zed.session()
     with s.get(f"{ZED_LAKE_URL}/events", headers=None, stream=True) as resp:
         parse_line = False
         